@@ -3,6 +3,7 @@ Django settings for cerelia_project project.
 Cerelia Production Simulation Tool
 """
 
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -66,10 +67,82 @@ DATABASES = {
         'OPTIONS': {
             'timeout': 20,
         }
+    },
+    # Read-only connection used by the simulation services (see simulation/routers.py).
+    # Point it at a replica when running on a server database.
+    'read': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+# PostgreSQL instead of SQLite: set POSTGRES_DB (and POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST, POSTGRES_PORT). POSTGRES_READ_HOST sends simulation reads to a replica.
+if os.environ.get('POSTGRES_DB'):
+    _postgres = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+        'CONN_MAX_AGE': 60,
+    }
+    DATABASES = {
+        'default': _postgres,
+        'read': {
+            **_postgres,
+            'HOST': os.environ.get('POSTGRES_READ_HOST', _postgres['HOST']),
+            'TEST': {
+                'MIRROR': 'default',
+            },
+        },
     }
+
+DATABASE_ROUTERS = ['simulation.routers.SimulationReadRouter']
+
+# Database alias the simulation services read from
+SIMULATION_READ_DATABASE = 'read'
+
+# Compute daily line demand and its modifications in one SQL query (PostgreSQL only,
+# see simulation/sql_demand.py)
+SIMULATION_SQL_PUSHDOWN = os.environ.get('SIMULATION_SQL_PUSHDOWN') == '1'
+
+# PRAGMAs applied to every new SQLite connection (see simulation/signals.py)
+SQLITE_PRAGMAS = {
+    # Readers don't block the writer (imports, config edits) and vice versa
+    'journal_mode': 'WAL',
+    # Durable at checkpoints only, which is safe with WAL
+    'synchronous': 'NORMAL',
+    # Map up to 256 MB of the database file instead of copying pages through read()
+    'mmap_size': 256 * 1024 * 1024,
+    # 64 MB page cache per connection (negative values are KiB)
+    'cache_size': -64 * 1024,
+    # Sorts and temporary indexes of the demand aggregations stay in memory
+    'temp_store': 'MEMORY',
 }
 
-# Caching configuration - use local memory cache for development
+# Memory-mapped demand snapshot shared by all workers (see simulation/demand_store.py)
+DEMAND_STORE_DIR = BASE_DIR / 'demand_store'
+
+# Read weekly demand sums from the store when it is up to date (off: always query DemandForecast)
+DEMAND_STORE_ENABLED = True
+
+# Forecasts of weeks older than this are moved to the archive by archive_forecasts
+FORECAST_ARCHIVE_HORIZON_WEEKS = 52
+
+# Forecast versions kept decompressed in memory per worker (see simulation/forecast_versions.py)
+FORECAST_VERSION_CACHE_SIZE = 4
+
+# Caching configuration - use local memory cache for development.
+# Line simulation result tokens (keep_state / base_token) are kept in this
+# cache: with several worker processes use a shared backend (Redis, Memcached)
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -2,11 +2,13 @@
 Django Admin configuration for Cerelia Simulation
 """
 
+from django import forms
 from django.contrib import admin
+from .archive import archived_week_error
 from .models import (
     Site, ShiftConfiguration, ProductionLine,
     Client, Product, LineProductAssignment, DemandForecast,
-    SimulationCategory, CustomShiftConfiguration, LineConfigOverride
+    SimulationCategory, CustomShiftConfiguration, LineConfigOverride, DataVersion
 )
 
 
@@ -59,8 +61,23 @@ class LineProductAssignmentAdmin(admin.ModelAdmin):
     autocomplete_fields = ['line', 'product']
 
 
+class DemandForecastAdminForm(forms.ModelForm):
+    class Meta:
+        model = DemandForecast
+        fields = '__all__'
+    
+    def clean_week_start_date(self):
+        # Simulations read weeks up to the archive cutoff from the archive only
+        week_start_date = self.cleaned_data['week_start_date']
+        error = archived_week_error(week_start_date)
+        if error:
+            raise forms.ValidationError(error)
+        return week_start_date
+
+
 @admin.register(DemandForecast)
 class DemandForecastAdmin(admin.ModelAdmin):
+    form = DemandForecastAdminForm
     list_display = ['client', 'product', 'year', 'week_number', 'week_start_date', 
                     'forecast_quantity']
     list_filter = ['year', 'client']
@@ -68,6 +85,15 @@ class DemandForecastAdmin(admin.ModelAdmin):
     autocomplete_fields = ['client', 'product']
     date_hierarchy = 'week_start_date'
     ordering = ['-year', '-week_number']
+    
+    # Forecast deletes send no signal (see signals.py)
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        DataVersion.bump('demandforecast')
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        DataVersion.bump('demandforecast')
 
 
 @admin.register(SimulationCategory)
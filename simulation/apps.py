@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SimulationConfig(AppConfig):
     name = 'simulation'
+
+    def ready(self):
+        from . import signals  # noqa: F401
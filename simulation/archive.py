@@ -0,0 +1,214 @@
+"""
+Forecast archive for Cerelia Simulation
+Past weeks are moved from DemandForecast to ArchivedDemandForecast, partitioned
+by year on PostgreSQL, so the live table and its range scans stay small.
+Weeks up to the latest archived week are read from the archive transparently
+(see services._sum_demand_by_week), so forecasts imported for them later are
+moved there as well and single edits of them are rejected.
+"""
+
+from datetime import date, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Max, Q, Sum
+
+from .demand_store import DEMAND_VERSION_MODEL, build_demand_store
+from .models import DemandForecast, ArchivedDemandForecast, DataVersion
+
+
+ARCHIVE_VERSION_MODEL = 'archiveddemandforecast'
+
+# Rows copied per bulk insert when archiving
+ARCHIVE_CHUNK_SIZE = 5000
+
+_cutoff = None  # (archive version, cutoff)
+
+
+def get_archive_horizon(weeks: Optional[int] = None) -> date:
+    """
+    Weeks starting before this date are archived: the Monday `weeks` weeks ago
+    (default settings.FORECAST_ARCHIVE_HORIZON_WEEKS)
+    """
+    if weeks is None:
+        weeks = getattr(settings, 'FORECAST_ARCHIVE_HORIZON_WEEKS', 52)
+    today = date.today()
+    return today - timedelta(days=today.weekday(), weeks=weeks)
+
+
+def get_archive_cutoff() -> Optional[date]:
+    """
+    week_start_date of the latest archived week, None when nothing is archived.
+    Weeks up to the cutoff are served by the archive only. Costs one small
+    DataVersion query per call; callers cache the result per request.
+    """
+    global _cutoff
+    version = DataVersion.get_versions([ARCHIVE_VERSION_MODEL])[ARCHIVE_VERSION_MODEL]
+    if _cutoff is None or _cutoff[0] != version:
+        latest = ArchivedDemandForecast.objects.aggregate(latest=Max('week_start_date'))['latest']
+        _cutoff = (version, latest)
+    return _cutoff[1]
+
+
+def archived_week_error(week_start_date) -> Optional[str]:
+    """Why a live forecast can't be written for this week, None if it can"""
+    cutoff = get_archive_cutoff()
+    if cutoff is not None and week_start_date <= cutoff:
+        return f'Weeks up to {cutoff} are archived; import them again to replace the archived forecasts'
+    return None
+
+
+def sum_archived_demand_by_week(product_ids, week_start, week_end, client_id: Optional[int] = None) -> dict:
+    """
+    Sum archived forecast_quantity per week_start_date (one partition per year
+    on PostgreSQL, pruned by the week range).
+
+    Returns:
+        Dict mapping week_start_date -> total_demand
+    """
+    forecast_filter = Q(
+        product_id__in=product_ids,
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    )
+
+    if client_id:
+        forecast_filter &= Q(client_id=client_id)
+
+    forecasts = ArchivedDemandForecast.objects.filter(forecast_filter).values(
+        'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by('week_start_date')
+
+    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+
+
+def sum_archived_demand_by_line_and_week(product_ids, week_start, week_end,
+                                         client_id: Optional[int] = None) -> dict:
+    """
+    sum_archived_demand_by_week grouped by the products' default line as well.
+
+    Returns:
+        Dict mapping default_line_id -> {week_start_date -> total_demand}
+    """
+    forecast_filter = Q(
+        product_id__in=product_ids,
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    )
+
+    if client_id:
+        forecast_filter &= Q(client_id=client_id)
+
+    forecasts = ArchivedDemandForecast.objects.filter(forecast_filter).values(
+        'product__default_line_id', 'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by()
+
+    demand = {}
+    for f in forecasts:
+        demand.setdefault(f['product__default_line_id'], {})[f['week_start_date']] = f['total_demand']
+    return demand
+
+
+def sum_archived_demand_by_client_and_week(product_ids, week_start, week_end) -> dict:
+    """
+    sum_archived_demand_by_week of every client at once.
+
+    Returns:
+        Dict mapping client_id -> {week_start_date -> total_demand}
+    """
+    forecasts = ArchivedDemandForecast.objects.filter(
+        product_id__in=product_ids,
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    ).values(
+        'client_id', 'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by()
+
+    demand = {}
+    for f in forecasts:
+        demand.setdefault(f['client_id'], {})[f['week_start_date']] = f['total_demand']
+    return demand
+
+
+def archive_live_past_weeks(stdout=None) -> int:
+    """
+    Move live forecasts of weeks up to the archive cutoff to the archive.
+    Simulations only read those weeks from the archive, so a past week
+    imported again would otherwise stay invisible; it replaces its archived
+    copy instead, like archive_forecasts.
+
+    Returns:
+        Number of forecasts moved (the demand store is rebuilt when any)
+    """
+    cutoff = get_archive_cutoff()
+    if cutoff is None:
+        return 0
+    return archive_forecasts(cutoff + timedelta(days=1), stdout=stdout)
+
+
+def ensure_year_partitions(connection, years) -> None:
+    """Create the missing yearly partitions of the archive table (PostgreSQL only)"""
+    if connection.vendor != 'postgresql':
+        return
+    table = ArchivedDemandForecast._meta.db_table
+    with connection.cursor() as cursor:
+        for year in sorted(years):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+
+
+def archive_forecasts(before: date, dry_run: bool = False, stdout=None) -> int:
+    """
+    Move the forecasts of weeks starting before `before` to the archive.
+    A past week that was imported again replaces its archived copy.
+    The demand store is rebuilt afterwards, since it only holds live rows.
+
+    Returns:
+        Number of forecasts moved (or that would be moved with dry_run)
+    """
+    live = DemandForecast.objects.filter(week_start_date__lt=before)
+    weeks = list(live.order_by().values_list('week_start_date', flat=True).distinct())
+    count = live.count()
+    if dry_run or not count:
+        return count
+
+    with transaction.atomic():
+        ensure_year_partitions(
+            connections[router.db_for_write(ArchivedDemandForecast)],
+            {week.year for week in weeks}
+        )
+        ArchivedDemandForecast.objects.filter(week_start_date__in=weeks).delete()
+
+        rows = live.order_by().values_list(
+            'client_id', 'product_id', 'year', 'week_number', 'week_start_date', 'forecast_quantity'
+        )
+        batch = []
+        for client_id, product_id, year, week_number, week_start_date, quantity in rows.iterator(
+            chunk_size=ARCHIVE_CHUNK_SIZE
+        ):
+            batch.append(ArchivedDemandForecast(
+                client_id=client_id, product_id=product_id, year=year, week_number=week_number,
+                week_start_date=week_start_date, forecast_quantity=quantity
+            ))
+            if len(batch) >= ARCHIVE_CHUNK_SIZE:
+                ArchivedDemandForecast.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            ArchivedDemandForecast.objects.bulk_create(batch)
+
+        live.delete()
+        DataVersion.bump(DEMAND_VERSION_MODEL, ARCHIVE_VERSION_MODEL)
+
+    if stdout:
+        stdout.write(f'  Archived {count} forecasts of {len(weeks)} weeks before {before}')
+    build_demand_store(stdout=stdout)
+    return count
@@ -0,0 +1,99 @@
+"""
+Build-ahead smoothing for Cerelia Simulation
+Over-capacity weeks are covered, where possible, by producing ahead in earlier
+weeks with slack. A single backward pass over the weekly demand and capacity
+keeps it linear in the number of weeks, so it stays interactive over the
+whole forecast horizon.
+"""
+
+from collections import deque
+from decimal import Decimal
+from typing import Optional
+
+
+def smooth_build_ahead(demand: list, capacity: list,
+                       max_stock_weeks: Optional[int] = None,
+                       shelf_life_weeks: Optional[int] = None) -> dict:
+    """
+    Greedy backward pass: walking from the last week to the first, the excess
+    of each over-capacity week waits for the slack of earlier weeks, and the
+    slack of a week serves the latest waiting weeks first (walking backward,
+    their shelf-life window closes first). Each week's excess enters and
+    leaves the queue once.
+
+    Args:
+        demand: Demand per week
+        capacity: Capacity per week (same length)
+        max_stock_weeks: Stock at the end of a week may not exceed the demand of
+            the next max_stock_weeks weeks (weeks of cover); None = no limit
+        shelf_life_weeks: Production may serve demand at most this many weeks
+            later; None = no limit
+
+    Returns:
+        Dict of lists, one entry per week: 'production' (units produced,
+        never above capacity), 'built_ahead' (part of production kept for
+        later weeks), 'inventory' (stock at the end of the week) and
+        'shortfall' (demand left unmet)
+    """
+    count = len(demand)
+    zero = Decimal('0')
+    shortfall = [max(d - c, zero) for d, c in zip(demand, capacity)]
+    built_ahead = [zero] * count
+
+    # Stock cap after week t: demand of weeks t+1 .. t+max_stock_weeks
+    stock_cap = None
+    if max_stock_weeks is not None:
+        cumulative = [zero]
+        for d in demand:
+            cumulative.append(cumulative[-1] + d)
+        stock_cap = [
+            cumulative[min(week + 1 + max_stock_weeks, count)] - cumulative[week + 1]
+            for week in range(count)
+        ]
+
+    # Waiting excess as [week, amount]: left = latest week, right = earliest
+    pending = deque()
+    pending_total = zero
+    for week in range(count - 1, -1, -1):
+        if shelf_life_weeks is not None:
+            while pending and pending[0][0] - week > shelf_life_weeks:
+                pending_total -= pending.popleft()[1]
+        if stock_cap is not None:
+            # Whatever is still waiting here would be in stock at the end of this week
+            while pending and pending_total > stock_cap[week]:
+                drop = min(pending[0][1], pending_total - stock_cap[week])
+                pending[0][1] -= drop
+                pending_total -= drop
+                if not pending[0][1]:
+                    pending.popleft()
+
+        slack = capacity[week] - demand[week]
+        while slack > 0 and pending:
+            served = min(slack, pending[0][1])
+            shortfall[pending[0][0]] -= served
+            built_ahead[week] += served
+            pending[0][1] -= served
+            pending_total -= served
+            slack -= served
+            if not pending[0][1]:
+                pending.popleft()
+
+        if shortfall[week] > 0:
+            pending.append([week, shortfall[week]])
+            pending_total += shortfall[week]
+
+    production = []
+    inventory = []
+    stock = zero
+    for d, c, ahead, short in zip(demand, capacity, built_ahead, shortfall):
+        produced = min(d, c) + ahead
+        stock += produced - (d - short)
+        production.append(produced)
+        inventory.append(stock)
+
+    return {
+        'production': production,
+        'built_ahead': built_ahead,
+        'inventory': inventory,
+        'shortfall': shortfall,
+    }
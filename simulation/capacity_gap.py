@@ -0,0 +1,67 @@
+"""
+Capacity gap solver for Cerelia Simulation
+Inverts the weekly capacity formula of ProductionLine.get_weekly_capacity
+(base_capacity_per_hour x efficiency_factor x weekly hours) on line x week
+arrays: the hours each line needs to keep utilization under a target, the extra
+hours over its current configuration, and the smallest shift configuration
+that provides them.
+"""
+
+import numpy as np
+
+
+# Required hours are compared with config hours with this tolerance, so a
+# requirement of exactly 80h maps to an 80h configuration
+_HOURS_TOLERANCE = 1e-6
+
+
+def solve_capacity_gap(demand: np.ndarray, capacity: np.ndarray, rates,
+                       target_utilization: float, config_hours) -> dict:
+    """
+    Args:
+        demand: float64[lines, weeks] weekly demand of each line
+        capacity: float64[lines, weeks] current capacity calendar of each line
+        rates: Units per hour of each line (base_capacity_per_hour x efficiency_factor)
+        target_utilization: Utilization % not to exceed
+        config_hours: Weekly hours of the candidate configurations, sorted ascending
+
+    Returns:
+        Dict of [lines, weeks] arrays: 'current_hours', 'required_hours' and
+        'extra_hours' (NaN for lines without a rate), 'config_index' (smallest
+        covering configuration of weeks with a gap, -1 otherwise).
+        Per line: 'peak_required_hours', 'horizon_config_index' (smallest
+        configuration covering every week, -1 if none), 'gap_weeks',
+        'uncovered_weeks' (gaps no configuration covers), 'total_extra_hours'
+        and 'max_extra_hours'
+    """
+    rates = np.asarray(rates, dtype=float)
+    config_hours = np.asarray(config_hours, dtype=float)
+    rate = rates[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_hours = np.where(rate > 0, capacity / rate, np.nan)
+        required_hours = np.where(rate > 0, demand * 100 / (rate * target_utilization), np.nan)
+    extra_hours = np.maximum(required_hours - current_hours, 0)
+
+    gap = extra_hours > _HOURS_TOLERANCE
+    # NaN requirements sort after every configuration, i.e. not covered
+    position = np.searchsorted(config_hours, required_hours - _HOURS_TOLERANCE)
+    covered = position < len(config_hours)
+
+    solvable = rates > 0
+    peak_required_hours = np.where(
+        solvable, np.where(solvable[:, None], required_hours, 0).max(axis=1, initial=0), np.nan
+    )
+    horizon_position = np.searchsorted(config_hours, peak_required_hours - _HOURS_TOLERANCE)
+
+    return {
+        'current_hours': current_hours,
+        'required_hours': required_hours,
+        'extra_hours': extra_hours,
+        'config_index': np.where(gap & covered, position, -1),
+        'peak_required_hours': peak_required_hours,
+        'horizon_config_index': np.where(horizon_position < len(config_hours), horizon_position, -1),
+        'gap_weeks': gap.sum(axis=1),
+        'uncovered_weeks': (gap & ~covered).sum(axis=1),
+        'total_extra_hours': np.nansum(extra_hours, axis=1),
+        'max_extra_hours': np.nan_to_num(extra_hours).max(axis=1, initial=0),
+    }
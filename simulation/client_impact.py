@@ -0,0 +1,126 @@
+"""
+Client impact analysis for Cerelia Simulation
+Array evaluation of client scenarios over (client or line) x week matrices:
+- ranking: "client k's demand changes by p%" for every client at once, so
+  ranking all clients costs one demand aggregation and one capacity calendar
+  instead of one lost client simulation per client
+- new client mix: the new client's demand routed to each product's default line
+  and compared with each line's own capacity calendar
+The utilization helpers are shared with the sensitivity sweep.
+"""
+
+import numpy as np
+
+
+# Metrics a ranking can be ordered by (largest absolute change first)
+RANK_METRICS = ('over_capacity_periods', 'average_utilization', 'peak_utilization')
+
+
+def period_matrix(values_by_key: dict, keys: list, periods: list) -> np.ndarray:
+    """
+    float64[keys, periods] matrix of a {key -> {period -> value}} dict; missing
+    keys/periods are 0 and periods outside `periods` are dropped
+    """
+    period_positions = {period: position for position, period in enumerate(periods)}
+    matrix = np.zeros((len(keys), len(periods)))
+    for row, key in enumerate(keys):
+        for period, value in values_by_key.get(key, {}).items():
+            position = period_positions.get(period)
+            if position is not None:
+                matrix[row, position] = float(value)
+    return matrix
+
+
+def client_week_matrix(demand_by_client: dict, weeks: list) -> tuple:
+    """
+    Dense demand matrix of a {client_id -> {week_start_date -> demand}} dict.
+
+    Returns:
+        (client_ids, float64[clients, weeks] demand)
+    """
+    client_ids = sorted(demand_by_client)
+    return client_ids, period_matrix(demand_by_client, client_ids, weeks)
+
+
+def utilization_percent(demand: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    """Utilization % per week, 0 for weeks without capacity (like run_lost_client_simulation)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(capacity > 0, demand * 100 / capacity, 0.0)
+
+
+def utilization_stats(utilization: np.ndarray) -> dict:
+    """Summary stats over the last (week) axis"""
+    if not utilization.shape[-1]:
+        zeros = np.zeros(utilization.shape[:-1])
+        return {
+            'average_utilization': zeros,
+            'peak_utilization': zeros,
+            'over_capacity_periods': zeros.astype(np.int64),
+        }
+    return {
+        'average_utilization': utilization.mean(axis=-1),
+        'peak_utilization': utilization.max(axis=-1),
+        'over_capacity_periods': (utilization > 100).sum(axis=-1),
+    }
+
+
+def rank_client_impacts(client_demand: np.ndarray, capacity, change_percent: float,
+                        rank_by: str = 'over_capacity_periods', top_n: int = 10) -> dict:
+    """
+    Apply the scenario to each client in turn (all others unchanged) and rank
+    the clients by how much it moves the lines' utilization.
+
+    Args:
+        client_demand: float64[clients, weeks] demand of each client
+        capacity: Capacity of the lines per week (sequence of floats)
+        change_percent: Change of one client's demand (-100 = the client is lost)
+        rank_by: One of RANK_METRICS; ties go to the other metrics in order
+        top_n: Number of clients to keep
+
+    Returns:
+        Dict with 'baseline' stats, 'rows' (matrix rows of the top clients,
+        most impacted first), their stats and stat 'changes' vs the baseline,
+        and their weekly 'utilization'
+    """
+    capacity = np.asarray(capacity, dtype=float)
+    base_demand = client_demand.sum(axis=0)
+    baseline = utilization_stats(utilization_percent(base_demand, capacity))
+
+    # Row k: baseline demand with client k's share scaled by change_percent
+    utilization = utilization_percent(base_demand + client_demand * (change_percent / 100), capacity)
+    stats = utilization_stats(utilization)
+    changes = {name: stats[name] - baseline[name] for name in RANK_METRICS}
+
+    metrics = [rank_by] + [name for name in RANK_METRICS if name != rank_by]
+    # np.lexsort sorts by the last key first; stable, so ties keep client ID order
+    rows = np.lexsort([-np.abs(changes[name]) for name in reversed(metrics)])[:top_n]
+    return {
+        'baseline': baseline,
+        'rows': rows,
+        'stats': {name: values[rows] for name, values in stats.items()},
+        'changes': {name: values[rows] for name, values in changes.items()},
+        'utilization': utilization[rows],
+    }
+
+
+def line_impacts(base_demand: np.ndarray, added_demand: np.ndarray, removed_demand: np.ndarray,
+                 capacity: np.ndarray) -> dict:
+    """
+    Utilization of each line before and after a new client (rows = lines).
+
+    Args:
+        base_demand: float64[lines, weeks] current demand
+        added_demand: float64[lines, weeks] demand of the new client
+        removed_demand: float64[lines, weeks] demand of a client leaving at the same time
+        capacity: float64[lines, weeks] capacity calendar of each line
+
+    Returns:
+        Dict with 'before' and 'after' stats per line and the weekly
+        'utilization' after the change
+    """
+    utilization = utilization_percent(base_demand + added_demand - removed_demand, capacity)
+    return {
+        'before': utilization_stats(utilization_percent(base_demand, capacity)),
+        'after': utilization_stats(utilization),
+        'utilization': utilization,
+    }
@@ -0,0 +1,304 @@
+"""
+Compiled demand store for Cerelia Simulation
+A read-only snapshot of DemandForecast written as memory-mapped .npy files.
+Every worker maps the same files, so the page cache is shared and weekly demand
+sums never go through the ORM.
+
+Layout (CSR by product, entries sorted by product, client, week):
+    products   int64[P]     product IDs
+    indptr     int64[P+1]   entries of products[i] are indptr[i]:indptr[i+1]
+    client     int64[N]     client ID of each entry
+    week       int32[N]     index into weeks
+    qty_cents  int64[N]     forecast_quantity in cents (exact)
+    weeks      int64[W]     week_start_date as days since 1970-01-01
+"""
+
+import json
+import logging
+import os
+import shutil
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .models import DemandForecast, DataVersion
+
+
+DEMAND_VERSION_MODEL = 'demandforecast'
+
+_ARRAYS = ('products', 'indptr', 'client', 'week', 'qty_cents', 'weeks')
+_EPOCH = date(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def get_store_dir():
+    return getattr(settings, 'DEMAND_STORE_DIR', os.path.join(settings.BASE_DIR, 'demand_store'))
+
+
+class DemandStore:
+    """Memory-mapped snapshot of DemandForecast at a given data version"""
+
+    def __init__(self, path: str, version: int):
+        self.path = path
+        self.version = version
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+
+    def _entries(self, product_ids: Iterable[int]) -> np.ndarray:
+        """Entry indices of the given products"""
+        ids = np.fromiter(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self.products, ids)
+        found = positions < len(self.products)
+        found[found] &= self.products[positions[found]] == ids[found]
+        positions = positions[found]
+        if not len(positions):
+            return np.empty(0, dtype=np.int64)
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        # Concatenate the ranges starts[i]:starts[i]+lengths[i] without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def weekly_demand(self, product_ids: Iterable[int], week_start, week_end,
+                      client_ids: Optional[Iterable[int]] = None) -> dict:
+        """
+        Sum of forecast_quantity per week_start_date, like the ORM aggregation
+        used by the services (weeks without any forecast row are absent).
+
+        Args:
+            product_ids: Products to include
+            week_start, week_end: Inclusive week_start_date bounds
+            client_ids: Optional clients to restrict to
+
+        Returns:
+            Dict mapping week_start_date -> Decimal total (2 decimal places)
+        """
+        entries = self._entries(product_ids)
+        if client_ids is not None:
+            entries = entries[np.isin(self.client[entries], np.fromiter(client_ids, dtype=np.int64))]
+
+        first = np.searchsorted(self.weeks, (week_start - _EPOCH).days, side='left')
+        last = np.searchsorted(self.weeks, (week_end - _EPOCH).days, side='right')
+        week = self.week[entries]
+        in_range = (week >= first) & (week < last)
+        week = week[in_range]
+        if not len(week):
+            return {}
+
+        counts = np.bincount(week, minlength=len(self.weeks))
+        # Cents fit well within float64's exact integer range for these totals
+        totals = np.bincount(week, weights=self.qty_cents[entries][in_range], minlength=len(self.weeks))
+        return {
+            _EPOCH + timedelta(days=int(self.weeks[index])): Decimal(int(round(totals[index]))).scaleb(-2)
+            for index in np.flatnonzero(counts)
+        }
+
+    def weekly_demand_by_group(self, product_groups: dict, week_start, week_end,
+                               client_ids: Optional[Iterable[int]] = None) -> dict:
+        """
+        weekly_demand of several product groups (e.g. products by default line)
+        in one pass over the entries.
+
+        Args:
+            product_groups: Dict mapping product_id -> group key
+            week_start, week_end: Inclusive week_start_date bounds
+            client_ids: Optional clients to restrict to
+
+        Returns:
+            Dict mapping group key -> {week_start_date -> Decimal total}
+        """
+        group_keys = list(dict.fromkeys(product_groups.values()))
+        group_positions = {key: position for position, key in enumerate(group_keys)}
+        group_products = np.array(sorted(product_groups), dtype=np.int64)
+        group_of_product = np.array(
+            [group_positions[product_groups[product_id]] for product_id in group_products.tolist()],
+            dtype=np.int64
+        )
+
+        entries = self._entries(group_products)
+        if client_ids is not None:
+            entries = entries[np.isin(self.client[entries], np.fromiter(client_ids, dtype=np.int64))]
+
+        first = np.searchsorted(self.weeks, (week_start - _EPOCH).days, side='left')
+        last = np.searchsorted(self.weeks, (week_end - _EPOCH).days, side='right')
+        week = self.week[entries]
+        in_range = (week >= first) & (week < last)
+        entries = entries[in_range]
+        if not len(entries):
+            return {}
+
+        # Product of each entry from the CSR pointers, then its group
+        entry_products = self.products[np.searchsorted(self.indptr, entries, side='right') - 1]
+        group = group_of_product[np.searchsorted(group_products, entry_products)]
+        cells = group * len(self.weeks) + week[in_range]
+        size = len(group_keys) * len(self.weeks)
+        counts = np.bincount(cells, minlength=size)
+        totals = np.bincount(cells, weights=self.qty_cents[entries], minlength=size)
+
+        demand = {}
+        for cell in np.flatnonzero(counts):
+            group_index, week_index = divmod(int(cell), len(self.weeks))
+            demand.setdefault(group_keys[group_index], {})[
+                _EPOCH + timedelta(days=int(self.weeks[week_index]))
+            ] = Decimal(int(round(totals[cell]))).scaleb(-2)
+        return demand
+
+    def weekly_demand_by_client(self, product_ids: Iterable[int], week_start, week_end) -> dict:
+        """
+        weekly_demand of every client at once (the client x week demand matrix).
+
+        Args:
+            product_ids: Products to include
+            week_start, week_end: Inclusive week_start_date bounds
+
+        Returns:
+            Dict mapping client_id -> {week_start_date -> Decimal total}
+        """
+        entries = self._entries(product_ids)
+        first = np.searchsorted(self.weeks, (week_start - _EPOCH).days, side='left')
+        last = np.searchsorted(self.weeks, (week_end - _EPOCH).days, side='right')
+        week = self.week[entries]
+        in_range = (week >= first) & (week < last)
+        entries = entries[in_range]
+        if not len(entries):
+            return {}
+
+        clients, client_index = np.unique(self.client[entries], return_inverse=True)
+        cells = client_index * len(self.weeks) + week[in_range]
+        size = len(clients) * len(self.weeks)
+        counts = np.bincount(cells, minlength=size)
+        totals = np.bincount(cells, weights=self.qty_cents[entries], minlength=size)
+
+        demand = {}
+        for cell in np.flatnonzero(counts):
+            client_position, week_index = divmod(int(cell), len(self.weeks))
+            demand.setdefault(int(clients[client_position]), {})[
+                _EPOCH + timedelta(days=int(self.weeks[week_index]))
+            ] = Decimal(int(round(totals[cell]))).scaleb(-2)
+        return demand
+
+
+def build_demand_store(stdout=None) -> str:
+    """
+    Compile DemandForecast into a new store directory stamped with the current
+    demand data version. Old versions are removed; workers that still map them
+    keep their file handles until they reload.
+    """
+    version = DataVersion.get_versions([DEMAND_VERSION_MODEL])[DEMAND_VERSION_MODEL]
+    rows = DemandForecast.objects.order_by('product_id', 'client_id', 'week_start_date').values_list(
+        'product_id', 'client_id', 'week_start_date', 'forecast_quantity'
+    )
+
+    product, client, days, cents = [], [], [], []
+    for product_id, client_id, week_start_date, quantity in rows.iterator(chunk_size=10000):
+        product.append(product_id)
+        client.append(client_id)
+        days.append((week_start_date - _EPOCH).days)
+        cents.append(int(quantity * 100))
+
+    product = np.array(product, dtype=np.int64)
+    days = np.array(days, dtype=np.int64)
+    products, first_entries = np.unique(product, return_index=True)
+    weeks = np.unique(days)
+    arrays = {
+        'products': products,
+        'indptr': np.append(first_entries, len(product)).astype(np.int64),
+        'client': np.array(client, dtype=np.int64),
+        'week': np.searchsorted(weeks, days).astype(np.int32),
+        'qty_cents': np.array(cents, dtype=np.int64),
+        'weeks': weeks,
+    }
+
+    root = get_store_dir()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f'v{version}')
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'entries': len(product)}, f)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    for name in os.listdir(root):
+        if name != f'v{version}' and name.startswith('v') and '.tmp' not in name:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    if stdout:
+        stdout.write(f'  Demand store v{version}: {len(product)} forecasts, {len(products)} products, {len(weeks)} weeks')
+    return path
+
+
+_store: Optional[DemandStore] = None
+
+# Data version the "store is stale" warning was last logged for (once per version)
+_stale_warned_version: Optional[int] = None
+
+
+def _built_versions() -> list:
+    """Data versions of the complete stores in the store directory"""
+    root = get_store_dir()
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        int(name[1:]) for name in os.listdir(root)
+        if name.startswith('v') and name[1:].isdigit()
+        and os.path.exists(os.path.join(root, name, 'meta.json'))
+    )
+
+
+def demand_store_status() -> dict:
+    """
+    Whether simulations currently read the store. Any forecast write (import,
+    API or admin edit) moves the demand data version; until build_demand_store
+    runs again the store is stale and simulations read the ORM.
+
+    Returns:
+        Dict with 'enabled', 'data_version', 'store_version' (latest built,
+        None if never built) and 'stale' (enabled but not matching the data)
+    """
+    enabled = getattr(settings, 'DEMAND_STORE_ENABLED', True)
+    version = DataVersion.get_versions([DEMAND_VERSION_MODEL])[DEMAND_VERSION_MODEL]
+    built = _built_versions()
+    store_version = built[-1] if built else None
+    return {
+        'enabled': enabled,
+        'data_version': version,
+        'store_version': store_version,
+        'stale': enabled and store_version != version,
+    }
+
+
+def get_demand_store() -> Optional[DemandStore]:
+    """
+    The store matching the current demand data version, or None when it has
+    not been built or settings.DEMAND_STORE_ENABLED is off (callers then fall
+    back to the ORM). Costs one small DataVersion query per call; callers
+    cache the result per request. A store left behind by forecast writes is
+    logged once per data version (see demand_store_status).
+    """
+    global _store, _stale_warned_version
+    if not getattr(settings, 'DEMAND_STORE_ENABLED', True):
+        return None
+    version = DataVersion.get_versions([DEMAND_VERSION_MODEL])[DEMAND_VERSION_MODEL]
+    if _store is not None and _store.version == version:
+        return _store
+    path = os.path.join(get_store_dir(), f'v{version}')
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        _store = None
+        built = _built_versions()
+        if built and _stale_warned_version != version:
+            _stale_warned_version = version
+            logger.warning(
+                'Demand store v%s is stale (demand data v%s): simulations read the ORM '
+                'until build_demand_store runs', built[-1], version
+            )
+        return None
+    _store = DemandStore(path, version)
+    return _store
@@ -0,0 +1,112 @@
+"""
+Product attribute facets for Cerelia Simulation
+Distinct product_type / recipe_type / material_type / packaging_type values
+with product counts, used by the category manager to build filters
+"""
+
+from collections import Counter
+from typing import Optional
+
+from django.core.cache import cache
+
+from .models import Product, DataVersion
+
+
+# Facet name -> Product field
+FACET_FIELDS = {
+    'product_type': 'product_type',
+    'recipe_type': 'recipe_type',
+    'material_type': 'material_type',
+    'packaging_type': 'packaging_type',
+}
+
+# Scoping by site goes through Product.default_line, so line writes matter too
+FACET_VERSION_MODELS = ['product', 'productionline']
+
+FACET_CACHE_TIMEOUT = 60 * 60
+
+
+def _facet_rows() -> list:
+    """
+    Attribute rows of all active products, cached per data version.
+    The cache key embeds the Product/ProductionLine versions so any write
+    invalidates it in every worker process.
+    """
+    versions = DataVersion.get_versions(FACET_VERSION_MODELS)
+    key = 'product_facets:' + ':'.join(str(versions[name]) for name in FACET_VERSION_MODELS)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            Product.objects.filter(is_active=True)
+            .order_by()
+            .values_list('default_line_id', 'default_line__site_id', *FACET_FIELDS.values())
+        )
+        cache.set(key, rows, FACET_CACHE_TIMEOUT)
+    return rows
+
+
+def get_product_facets(site_id: Optional[int] = None, line_ids: Optional[list] = None,
+                       selected: Optional[dict] = None) -> dict:
+    """
+    Compute product attribute facets with counts.
+
+    Products are scoped like category matching: by their default line (line_ids)
+    and/or the site of that line (site_id). Counts are cross-filtered: each
+    facet's counts apply the selections of all *other* facets, so the user sees
+    how many products each extra value would bring in.
+
+    Args:
+        site_id: Only products whose default line belongs to this site
+        line_ids: Only products whose default line is one of these
+        selected: {facet_name: [values]} current selections
+
+    Returns:
+        Dict with per-facet [{value, count}] lists, the distinct values per facet
+        (pre-selection, like the former product_attributes payload) and the
+        number of products matching all selections
+    """
+    selected = {name: set(values) for name, values in (selected or {}).items() if values}
+    line_ids = set(line_ids) if line_ids else None
+    names = list(FACET_FIELDS)
+
+    scoped = [
+        row for row in _facet_rows()
+        if (line_ids is None or row[0] in line_ids)
+        and (site_id is None or row[1] == site_id)
+    ]
+
+    counters = {name: Counter() for name in names}
+    distinct = {name: set() for name in names}
+    match_count = 0
+    for row in scoped:
+        attributes = row[2:]
+        # Facets whose selection this product fails
+        failed = [
+            name for name, value in zip(names, attributes)
+            if name in selected and value not in selected[name]
+        ]
+        for name, value in zip(names, attributes):
+            if not value:
+                continue
+            distinct[name].add(value)
+            # Cross-filtering: a facet ignores its own selection
+            if not failed or failed == [name]:
+                counters[name][value] += 1
+        if not failed:
+            match_count += 1
+
+    return {
+        'facets': {
+            name: [
+                {'value': value, 'count': counters[name][value]}
+                for value in sorted(distinct[name])
+            ]
+            for name in names
+        },
+        'product_types': sorted(distinct['product_type']),
+        'recipe_types': sorted(distinct['recipe_type']),
+        'material_types': sorted(distinct['material_type']),
+        'packaging_types': sorted(distinct['packaging_type']),
+        'total_products': len(scoped),
+        'match_count': match_count,
+    }
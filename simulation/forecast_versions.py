@@ -0,0 +1,316 @@
+"""
+Forecast versions for Cerelia Simulation
+Each ForecastVersion stores the forecasts as seen by the simulations (archived
+weeks up to the archive cutoff, live forecasts after it) in one compressed
+np.savez_compressed archive, so versions don't duplicate DemandForecast rows.
+
+Layout (one dense row per (client, product) pair with any forecast):
+    clients    int64[P]     client ID of each pair
+    products   int64[P]     product ID of each pair
+    weeks      int64[W]     week_start_date as days since 1970-01-01
+    qty_cents  int64[P, W]  forecast_quantity in cents, -1 where the pair has no
+                            forecast row that week
+"""
+
+import io
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .archive import get_archive_cutoff
+from .models import DemandForecast, ArchivedDemandForecast, ForecastVersion
+
+
+_ARRAYS = ('clients', 'products', 'weeks', 'qty_cents')
+_EPOCH = date(1970, 1, 1)
+
+# Missing forecast row, told apart from a zero forecast like the ORM does
+_ABSENT = -1
+
+
+class ForecastSnapshot:
+    """Decompressed arrays of a ForecastVersion"""
+
+    def __init__(self, version_id: int, arrays: dict):
+        self.version_id = version_id
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def _rows(self, product_ids: Optional[Iterable[int]], client_ids: Optional[Iterable[int]]) -> np.ndarray:
+        """Boolean mask of the pairs matching the filters (None = no filter)"""
+        rows = np.ones(len(self.products), dtype=bool)
+        if product_ids is not None:
+            rows &= np.isin(self.products, np.fromiter(product_ids, dtype=np.int64))
+        if client_ids is not None:
+            rows &= np.isin(self.clients, np.fromiter(client_ids, dtype=np.int64))
+        return rows
+
+    def _week_range(self, week_start, week_end) -> slice:
+        first = np.searchsorted(self.weeks, (week_start - _EPOCH).days, side='left')
+        last = np.searchsorted(self.weeks, (week_end - _EPOCH).days, side='right')
+        return slice(first, last)
+
+    def weekly_demand(self, product_ids: Iterable[int], week_start, week_end,
+                      client_ids: Optional[Iterable[int]] = None) -> dict:
+        """
+        Sum of forecast_quantity per week_start_date, same contract as
+        DemandStore.weekly_demand (weeks without any forecast row are absent).
+
+        Returns:
+            Dict mapping week_start_date -> Decimal total (2 decimal places)
+        """
+        weeks = self._week_range(week_start, week_end)
+        block = self.qty_cents[self._rows(product_ids, client_ids), weeks]
+        present = (block != _ABSENT).any(axis=0)
+        totals = np.where(block > 0, block, 0).sum(axis=0)
+        return {
+            _EPOCH + timedelta(days=int(day)): Decimal(int(total)).scaleb(-2)
+            for day, total in zip(self.weeks[weeks][present], totals[present])
+        }
+
+    def weekly_demand_by_group(self, product_groups: dict, week_start, week_end,
+                               client_ids: Optional[Iterable[int]] = None) -> dict:
+        """
+        weekly_demand of several product groups at once, same contract as
+        DemandStore.weekly_demand_by_group.
+
+        Returns:
+            Dict mapping group key -> {week_start_date -> Decimal total}
+        """
+        group_keys = list(dict.fromkeys(product_groups.values()))
+        group_positions = {key: position for position, key in enumerate(group_keys)}
+        group_products = np.array(sorted(product_groups), dtype=np.int64)
+        group_of_product = np.array(
+            [group_positions[product_groups[product_id]] for product_id in group_products.tolist()],
+            dtype=np.int64
+        )
+
+        weeks = self._week_range(week_start, week_end)
+        rows = np.flatnonzero(self._rows(group_products, client_ids))
+        block = self.qty_cents[rows, weeks]
+        group = group_of_product[np.searchsorted(group_products, self.products[rows])]
+        present = np.zeros((len(group_keys), block.shape[1]), dtype=bool)
+        totals = np.zeros((len(group_keys), block.shape[1]), dtype=np.int64)
+        np.logical_or.at(present, group, block != _ABSENT)
+        np.add.at(totals, group, np.maximum(block, 0))
+
+        days = self.weeks[weeks]
+        demand = {}
+        for group_index, week_index in zip(*np.nonzero(present)):
+            demand.setdefault(group_keys[group_index], {})[
+                _EPOCH + timedelta(days=int(days[week_index]))
+            ] = Decimal(int(totals[group_index, week_index])).scaleb(-2)
+        return demand
+
+    def weekly_demand_by_client(self, product_ids: Iterable[int], week_start, week_end) -> dict:
+        """
+        weekly_demand of every client at once, same contract as
+        DemandStore.weekly_demand_by_client.
+
+        Returns:
+            Dict mapping client_id -> {week_start_date -> Decimal total}
+        """
+        weeks = self._week_range(week_start, week_end)
+        rows = np.flatnonzero(self._rows(product_ids, None))
+        block = self.qty_cents[rows, weeks]
+        clients, client_index = np.unique(self.clients[rows], return_inverse=True)
+        present = np.zeros((len(clients), block.shape[1]), dtype=bool)
+        totals = np.zeros((len(clients), block.shape[1]), dtype=np.int64)
+        np.logical_or.at(present, client_index, block != _ABSENT)
+        np.add.at(totals, client_index, np.maximum(block, 0))
+
+        days = self.weeks[weeks]
+        demand = {}
+        for client_position, week_index in zip(*np.nonzero(present)):
+            demand.setdefault(int(clients[client_position]), {})[
+                _EPOCH + timedelta(days=int(days[week_index]))
+            ] = Decimal(int(totals[client_position, week_index])).scaleb(-2)
+        return demand
+
+    def week_totals(self, week_start, week_end, product_ids: Optional[Iterable[int]] = None,
+                    client_ids: Optional[Iterable[int]] = None) -> tuple:
+        """
+        Totals in cents per week and per client over the week range.
+
+        Returns:
+            (weeks, totals, clients, client_totals) arrays; weeks as days since
+            1970-01-01, missing forecasts count as zero
+        """
+        weeks = self._week_range(week_start, week_end)
+        rows = self._rows(product_ids, client_ids)
+        block = np.maximum(self.qty_cents[rows, weeks], 0)
+        clients, pair_client = np.unique(self.clients[rows], return_inverse=True)
+        client_totals = np.zeros(len(clients), dtype=np.int64)
+        np.add.at(client_totals, pair_client, block.sum(axis=1))
+        return self.weeks[weeks], block.sum(axis=0), clients, client_totals
+
+
+def _forecast_rows():
+    """(client_id, product_id, week_start_date, forecast_quantity) read by the simulations"""
+    cutoff = get_archive_cutoff()
+    columns = ('client_id', 'product_id', 'week_start_date', 'forecast_quantity')
+    if cutoff is None:
+        return DemandForecast.objects.order_by().values_list(*columns).iterator(chunk_size=10000)
+    archived = ArchivedDemandForecast.objects.filter(week_start_date__lte=cutoff)
+    live = DemandForecast.objects.filter(week_start_date__gt=cutoff)
+    return (
+        row
+        for queryset in (archived, live)
+        for row in queryset.order_by().values_list(*columns).iterator(chunk_size=10000)
+    )
+
+
+def build_snapshot() -> dict:
+    """Arrays of the current forecasts (see the module docstring for the layout)"""
+    client, product, days, cents = [], [], [], []
+    for client_id, product_id, week_start_date, quantity in _forecast_rows():
+        client.append(client_id)
+        product.append(product_id)
+        days.append((week_start_date - _EPOCH).days)
+        cents.append(int(quantity * 100))
+
+    pairs = np.array([client, product], dtype=np.int64).reshape(2, -1).T
+    keys, pair_index = np.unique(pairs, axis=0, return_inverse=True)
+    weeks, week_index = np.unique(np.array(days, dtype=np.int64), return_inverse=True)
+    qty_cents = np.full((len(keys), len(weeks)), _ABSENT, dtype=np.int64)
+    qty_cents[pair_index.ravel(), week_index] = np.array(cents, dtype=np.int64)
+    return {
+        'clients': np.ascontiguousarray(keys[:, 0]),
+        'products': np.ascontiguousarray(keys[:, 1]),
+        'weeks': weeks,
+        'qty_cents': qty_cents,
+    }
+
+
+@transaction.atomic
+def create_forecast_version(name: str, description: str = '', stdout=None) -> ForecastVersion:
+    """Snapshot the current forecasts under a new ForecastVersion"""
+    arrays = build_snapshot()
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+
+    weeks = arrays['weeks']
+    version = ForecastVersion.objects.create(
+        name=name,
+        description=description,
+        forecast_count=int((arrays['qty_cents'] != _ABSENT).sum()),
+        client_count=len(np.unique(arrays['clients'])),
+        product_count=len(np.unique(arrays['products'])),
+        first_week=_EPOCH + timedelta(days=int(weeks[0])) if len(weeks) else None,
+        last_week=_EPOCH + timedelta(days=int(weeks[-1])) if len(weeks) else None,
+        snapshot=buffer.getvalue(),
+    )
+    if stdout:
+        stdout.write(
+            f'  Forecast version "{name}": {version.forecast_count} forecasts, '
+            f'{len(arrays["clients"])} client/product pairs x {len(weeks)} weeks, '
+            f'{len(version.snapshot) // 1024} KB compressed'
+        )
+    return version
+
+
+# Decompressed snapshots by version ID; versions never change once taken
+_snapshots = OrderedDict()
+
+
+def get_forecast_snapshot(version_id: int) -> Optional[ForecastSnapshot]:
+    """
+    Arrays of a forecast version, None if it doesn't exist. The most recently
+    used versions (settings.FORECAST_VERSION_CACHE_SIZE) stay decompressed.
+    """
+    if version_id in _snapshots:
+        _snapshots.move_to_end(version_id)
+        return _snapshots[version_id]
+    data = ForecastVersion.objects.filter(id=version_id).values_list('snapshot', flat=True).first()
+    if data is None:
+        return None
+    with np.load(io.BytesIO(bytes(data))) as archive:
+        snapshot = ForecastSnapshot(version_id, {name: archive[name] for name in _ARRAYS})
+    _snapshots[version_id] = snapshot
+    while len(_snapshots) > max(getattr(settings, 'FORECAST_VERSION_CACHE_SIZE', 4), 1):
+        _snapshots.popitem(last=False)
+    return snapshot
+
+
+def forget_forecast_snapshot(version_id: int) -> None:
+    """Drop a deleted version from this process' cache"""
+    _snapshots.pop(version_id, None)
+
+
+def diff_snapshots(base: ForecastSnapshot, compare: ForecastSnapshot, week_start, week_end,
+                   product_ids: Optional[Iterable[int]] = None,
+                   client_ids: Optional[Iterable[int]] = None) -> dict:
+    """
+    Week-by-week and per-client demand deltas between two versions, computed
+    on the arrays without going back to forecast rows.
+
+    Args:
+        base, compare: Snapshots to compare (delta = compare - base)
+        week_start, week_end: Inclusive week_start_date bounds
+        product_ids: Optional products to restrict to
+        client_ids: Optional clients to restrict to
+
+    Returns:
+        Dict with parallel 'weeks', 'base', 'compare', 'delta' and 'delta_pct'
+        arrays, totals, and 'by_client' rows sorted by absolute delta
+    """
+    if product_ids is not None:
+        product_ids = list(product_ids)
+    if client_ids is not None:
+        client_ids = list(client_ids)
+    base_weeks, base_totals, base_clients, base_client_totals = base.week_totals(
+        week_start, week_end, product_ids, client_ids
+    )
+    compare_weeks, compare_totals, compare_clients, compare_client_totals = compare.week_totals(
+        week_start, week_end, product_ids, client_ids
+    )
+
+    def align(keys, values, all_keys):
+        aligned = np.zeros(len(all_keys), dtype=np.int64)
+        aligned[np.searchsorted(all_keys, keys)] = values
+        return aligned
+
+    weeks = np.union1d(base_weeks, compare_weeks)
+    base_cents = align(base_weeks, base_totals, weeks)
+    compare_cents = align(compare_weeks, compare_totals, weeks)
+    delta_cents = compare_cents - base_cents
+
+    clients = np.union1d(base_clients, compare_clients)
+    base_by_client = align(base_clients, base_client_totals, clients)
+    compare_by_client = align(compare_clients, compare_client_totals, clients)
+    delta_by_client = compare_by_client - base_by_client
+    changed = np.flatnonzero(delta_by_client)
+    changed = changed[np.argsort(-np.abs(delta_by_client[changed]), kind='stable')]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_pct = np.round(delta_cents * 100 / base_cents, 1)
+
+    base_total = int(base_cents.sum())
+    compare_total = int(compare_cents.sum())
+    return {
+        'weeks': [(_EPOCH + timedelta(days=int(day))).isoformat() for day in weeks],
+        'base': (base_cents / 100).tolist(),
+        'compare': (compare_cents / 100).tolist(),
+        'delta': (delta_cents / 100).tolist(),
+        'delta_pct': [None if base_cents[i] == 0 else float(delta_pct[i]) for i in range(len(weeks))],
+        'totals': {
+            'base': base_total / 100,
+            'compare': compare_total / 100,
+            'delta': (compare_total - base_total) / 100,
+            'delta_pct': round((compare_total - base_total) * 100 / base_total, 1) if base_total else None,
+        },
+        'by_client': [
+            {
+                'client_id': int(clients[i]),
+                'base': int(base_by_client[i]) / 100,
+                'compare': int(compare_by_client[i]) / 100,
+                'delta': int(delta_by_client[i]) / 100,
+            }
+            for i in changed
+        ],
+    }
@@ -0,0 +1,47 @@
+"""
+Management command to move past weeks of DemandForecast to the forecast archive
+Simulations keep reading archived weeks transparently (see simulation/archive.py)
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simulation.archive import archive_forecasts, get_archive_horizon
+
+
+class Command(BaseCommand):
+    help = 'Archive demand forecasts of weeks older than the archive horizon'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horizon-weeks',
+            type=int,
+            help='Archive weeks starting more than this many weeks ago '
+                 '(default: settings.FORECAST_ARCHIVE_HORIZON_WEEKS)',
+        )
+        parser.add_argument(
+            '--before',
+            type=str,
+            help='Archive weeks starting before this date (YYYY-MM-DD), overrides --horizon-weeks',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many forecasts would be archived',
+        )
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--before must be a date in YYYY-MM-DD format')
+        else:
+            before = get_archive_horizon(options['horizon_weeks'])
+
+        count = archive_forecasts(before, dry_run=options['dry_run'], stdout=self.stdout)
+        if options['dry_run']:
+            self.stdout.write(f'{count} forecasts of weeks before {before} would be archived')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Archived {count} forecasts of weeks before {before}'))
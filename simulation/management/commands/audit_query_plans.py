@@ -0,0 +1,184 @@
+"""
+Management command to audit index coverage of the simulation queries
+Runs representative simulations, captures every query they issue and prints
+its plan (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL), flagging full
+table scans on large tables
+"""
+
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from simulation.models import ProductionLine, Client, Product, DemandForecast, SimulationCategory
+from simulation.services import (
+    clear_caches,
+    run_line_simulation, run_category_simulation,
+    run_new_client_simulation, run_lost_client_simulation, run_client_impact_ranking,
+    run_line_heatmap, run_capacity_gap, run_sensitivity_sweep
+)
+
+
+# Full table scans as reported by each backend
+SCAN_PATTERNS = {
+    'sqlite': re.compile(r'^SCAN (?P<table>\w+)(?!.*\bINDEX\b)'),
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\w+)'),
+}
+
+
+def _query_shape(sql: str) -> str:
+    """SQL with literals and IN lists replaced, to group identical query shapes"""
+    shape = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    return re.sub(r'\(\?(?:, \?)*\)', '(?...)', shape)
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries issued by the simulation engine and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Only flag scans of tables with at least this many rows')
+        parser.add_argument('--weeks', type=int, default=12, help='Simulation horizon in weeks')
+        parser.add_argument('--with-demand-store', action='store_true',
+                            help='Let weekly demand come from the demand store (default: audit the ORM queries)')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error when a full scan is flagged')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the plan of every query, not only flagged ones')
+
+    def handle(self, *args, **options):
+        scenarios = self._scenarios(options['weeks'])
+        if not scenarios:
+            raise CommandError('No forecasts or active lines to simulate')
+
+        # Simulation reads go through the read connection (see routers.py)
+        captured = []
+        with override_settings(DEMAND_STORE_ENABLED=options['with_demand_store']):
+            for name, run in scenarios:
+                with CaptureQueriesContext(connections['default']) as default_queries, \
+                        CaptureQueriesContext(connections['read']) as read_queries:
+                    clear_caches()
+                    run()
+                for alias, queries in (('default', default_queries), ('read', read_queries)):
+                    captured += [(name, alias, query['sql']) for query in queries.captured_queries]
+
+        shapes = {}
+        for scenario, alias, sql in captured:
+            shape = shapes.setdefault(_query_shape(sql), {'sql': sql, 'alias': alias, 'scenarios': set(), 'count': 0})
+            shape['scenarios'].add(scenario)
+            shape['count'] += 1
+
+        flagged = 0
+        row_counts = {}
+        for shape in shapes.values():
+            connection = connections[shape['alias']]
+            plan = self._explain(connection, shape['sql'])
+            pattern = SCAN_PATTERNS.get(connection.vendor)
+            scans = []
+            for line in plan:
+                match = pattern.search(line.strip()) if pattern else None
+                if match:
+                    table = match.group('table')
+                    if table not in row_counts:
+                        row_counts[table] = self._row_count(connection, table)
+                    if row_counts[table] >= options['min_rows']:
+                        scans.append(f"{table} ({row_counts[table]} rows)")
+
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(
+                    f"FULL SCAN of {', '.join(scans)} - {shape['count']}x in {', '.join(sorted(shape['scenarios']))}"
+                ))
+            elif not options['verbose_plans']:
+                continue
+            else:
+                self.stdout.write(f"OK - {shape['count']}x in {', '.join(sorted(shape['scenarios']))}")
+            self.stdout.write(f"  {shape['sql'][:300]}")
+            for line in plan:
+                self.stdout.write(f'    {line}')
+
+        summary = f'{len(captured)} queries, {len(shapes)} distinct shapes, {flagged} with full scans'
+        if flagged:
+            self.stdout.write(self.style.WARNING(summary))
+            if options['fail_on_scan']:
+                raise CommandError('Full table scans found in simulation queries')
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def _scenarios(self, weeks: int) -> list:
+        """(name, callable) simulations covering the engine's query shapes"""
+        first_week = DemandForecast.objects.order_by('week_start_date').values_list(
+            'week_start_date', flat=True
+        ).first()
+        line_ids = list(
+            ProductionLine.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)[:4]
+        )
+        if first_week is None or not line_ids:
+            return []
+
+        start_date = first_week
+        end_date = first_week + timedelta(weeks=weeks, days=-1)
+        clients = list(Client.objects.filter(is_active=True).order_by('id')[:2])
+        product = Product.objects.filter(is_active=True, default_line_id__in=line_ids).order_by('id').first()
+        category = SimulationCategory.objects.order_by('id').first()
+        shift_configs = [{'line_id': line_id, 'use_override': True} for line_id in line_ids]
+        modifications = [
+            {'client_id': client.id, 'start_date': start_date, 'end_date': end_date, 'percentage': -10}
+            for client in clients[:1]
+        ]
+        client_codes = [client.code for client in clients]
+        base = {'line_ids': line_ids, 'shift_configs': shift_configs,
+                'start_date': start_date, 'end_date': end_date}
+
+        scenarios = [
+            ('line week', lambda: run_line_simulation(
+                **base, client_codes=client_codes[:1], overlay_client_codes=client_codes[1:],
+                demand_modifications=modifications
+            )),
+            ('line day', lambda: run_line_simulation(
+                **base, granularity='day', client_codes=client_codes, demand_modifications=modifications
+            )),
+            ('heatmap', lambda: run_line_heatmap(start_date, end_date)),
+            ('capacity gap', lambda: run_capacity_gap(start_date, end_date)),
+            ('sensitivity', lambda: run_sensitivity_sweep(start_date, end_date, efficiency_multipliers=[0.9, 1.1])),
+            ('client impact', lambda: run_client_impact_ranking(**base)),
+        ]
+        if product is not None:
+            scenarios.append(('line product', lambda: run_line_simulation(**base, product_code=product.code)))
+        if category is not None:
+            scenarios.append(('line category', lambda: run_line_simulation(**base, category_id=category.id)))
+            scenarios.append(('category week', lambda: run_category_simulation(
+                category.id, shift_configs, start_date, end_date,
+                overlay_client_codes=client_codes, demand_modifications=modifications
+            )))
+            scenarios.append(('category day', lambda: run_category_simulation(
+                category.id, shift_configs, start_date, end_date, granularity='day',
+                client_codes=client_codes[:1]
+            )))
+        if clients:
+            scenarios.append(('new client', lambda: run_new_client_simulation(
+                **base, new_client_demand=1000, remove_client_id=clients[0].id
+            )))
+            scenarios.append(('new client mix', lambda: run_new_client_simulation(
+                **base, profile_client_id=clients[0].id, profile_scale=2
+            )))
+            scenarios.append(('lost client', lambda: run_lost_client_simulation(
+                **base, lost_client_id=clients[0].id
+            )))
+        return scenarios
+
+    def _explain(self, connection, sql: str) -> list:
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        # SQLite rows are (id, parent, notused, detail), PostgreSQL rows are plan lines
+        return [str(row[-1]) for row in rows]
+
+    def _row_count(self, connection, table: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
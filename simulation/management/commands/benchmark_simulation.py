@@ -0,0 +1,143 @@
+"""
+Management command to benchmark simulate-endpoint latency under concurrent
+read/write load, before (rollback journal) and after the SQLite tuning
+applied from settings.SQLITE_PRAGMAS
+"""
+
+import json
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.test import Client as HttpClient
+from django.test.utils import override_settings
+
+from simulation.models import ProductionLine, DemandForecast
+
+
+class Command(BaseCommand):
+    help = 'Benchmark simulation latency with concurrent writes, baseline vs tuned SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            choices=['baseline', 'tuned', 'both'],
+            default='both',
+            help='baseline: rollback journal as before, tuned: settings.SQLITE_PRAGMAS',
+        )
+        parser.add_argument('--readers', type=int, default=4, help='Concurrent dashboard clients')
+        parser.add_argument('--requests', type=int, default=10, help='Simulations per client')
+        parser.add_argument('--lines', type=int, default=4, help='Lines per simulation')
+        parser.add_argument('--weeks', type=int, default=26, help='Simulation horizon in weeks')
+        parser.add_argument('--write-rows', type=int, default=500, help='Forecast rows rewritten per write')
+        parser.add_argument('--write-hold-ms', type=int, default=50,
+                            help='Time each write transaction holds the lock, like an import chunk')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('This benchmark compares SQLite settings, default is not SQLite')
+
+        first_week = DemandForecast.objects.order_by('week_start_date').values_list(
+            'week_start_date', flat=True
+        ).first()
+        line_ids = list(
+            ProductionLine.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)[:options['lines']]
+        )
+        if first_week is None or not line_ids:
+            raise CommandError('No forecasts or active lines to simulate')
+
+        body = json.dumps({
+            'line_ids': line_ids,
+            'shift_configs': [],
+            'start_date': first_week.isoformat(),
+            'end_date': (first_week + timedelta(weeks=options['weeks'], days=-1)).isoformat(),
+        })
+
+        profiles = {
+            'baseline': {'journal_mode': 'DELETE'},
+            'tuned': getattr(settings, 'SQLITE_PRAGMAS', {}),
+        }
+        names = ['baseline', 'tuned'] if options['profile'] == 'both' else [options['profile']]
+        for name in names:
+            self._run_profile(name, profiles[name], body, options)
+
+    def _run_profile(self, name, pragmas, body, options):
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            # The journal mode can only change while no other connection is open
+            connections.close_all()
+            with connections['default'].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+
+            latencies, errors, writes = [], [], []
+            stop = threading.Event()
+            hold = options['write_hold_ms'] / 1000
+
+            def reader():
+                client = HttpClient()
+                try:
+                    for _ in range(options['requests']):
+                        started = time.perf_counter()
+                        try:
+                            response = client.post('/api/simulate/line/', body, content_type='application/json')
+                        except OperationalError as exc:
+                            errors.append(str(exc))
+                            continue
+                        latencies.append(time.perf_counter() - started)
+                        if response.status_code != 200:
+                            errors.append(f'HTTP {response.status_code}')
+                finally:
+                    connections.close_all()
+
+            def writer():
+                ids = list(DemandForecast.objects.order_by('id').values_list('id', flat=True)[:options['write_rows']])
+                try:
+                    while not stop.is_set():
+                        try:
+                            with transaction.atomic():
+                                # Rewrites rows with their own values: takes the write lock
+                                # like an import chunk without changing any data
+                                DemandForecast.objects.filter(id__in=ids).update(
+                                    forecast_quantity=F('forecast_quantity')
+                                )
+                                time.sleep(hold)
+                            writes.append(1)
+                        except OperationalError as exc:
+                            errors.append(str(exc))
+                        time.sleep(0.005)
+                finally:
+                    connections.close_all()
+
+            write_thread = threading.Thread(target=writer)
+            read_threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+            started = time.perf_counter()
+            write_thread.start()
+            for thread in read_threads:
+                thread.start()
+            for thread in read_threads:
+                thread.join()
+            stop.set()
+            write_thread.join()
+            elapsed = time.perf_counter() - started
+            connections.close_all()
+
+        if latencies:
+            latencies_ms = sorted(latency * 1000 for latency in latencies)
+            p95 = statistics.quantiles(latencies_ms, n=20)[18] if len(latencies_ms) > 1 else latencies_ms[0]
+            timings = (
+                f'p50 {statistics.median(latencies_ms):.0f} ms, p95 {p95:.0f} ms, '
+                f'max {latencies_ms[-1]:.0f} ms'
+            )
+        else:
+            timings = 'no successful request'
+        self.stdout.write(
+            f'{name:<9} journal_mode={journal_mode:<6} {len(latencies)} simulations in {elapsed:.1f}s '
+            f'({timings}), {len(writes)} writes, {len(errors)} errors'
+        )
+        for error in sorted(set(errors)):
+            self.stdout.write(self.style.WARNING(f'  {error}'))
@@ -0,0 +1,27 @@
+"""
+Management command to compile DemandForecast into the memory-mapped demand store
+Run after bulk forecast changes; import_from_excel runs it automatically.
+Scheduled with --if-stale, it also picks up single forecast edits (API/admin)
+"""
+
+from django.core.management.base import BaseCommand
+
+from simulation.demand_store import build_demand_store, demand_store_status
+
+
+class Command(BaseCommand):
+    help = 'Compile demand forecasts into the memory-mapped demand store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            help='Only rebuild when the store no longer matches the forecasts',
+        )
+
+    def handle(self, *args, **options):
+        if options['if_stale'] and not demand_store_status()['stale']:
+            self.stdout.write('Demand store is up to date')
+            return
+        path = build_demand_store(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Demand store written to {path}'))
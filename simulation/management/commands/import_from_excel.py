@@ -9,11 +9,15 @@ from decimal import Decimal
 import pandas as pd
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from simulation.archive import archive_live_past_weeks
+from simulation.demand_store import build_demand_store
+from simulation.forecast_versions import create_forecast_version
 from simulation.models import (
     Site, ShiftConfiguration, ProductionLine,
-    Client, Product, LineProductAssignment, DemandForecast,
-    SimulationCategory, CustomShiftConfiguration
+    Client, Product, LineProductAssignment, DemandForecast, ArchivedDemandForecast,
+    SimulationCategory, CustomShiftConfiguration, DataVersion
 )
+from simulation.signals import bulk_data_changes
 
 
 class Command(BaseCommand):
@@ -37,8 +41,19 @@ class Command(BaseCommand):
             default='generated_data/forecast_cheikh.xlsx',
             help='Path to the forecast Excel file to import',
         )
+        parser.add_argument(
+            '--save-version',
+            type=str,
+            help='Also save the imported forecasts as a forecast version with this name',
+        )
 
     def handle(self, *args, **options):
+        # Category membership and data versions are refreshed once at the end
+        # instead of on every row written or deleted
+        with bulk_data_changes():
+            self._import(options)
+
+    def _import(self, options):
         if options['clear']:
             self.stdout.write('Clearing existing data...')
             self._clear_data()
@@ -99,6 +114,15 @@ class Command(BaseCommand):
                 # Set all lines to default shift config '3x8 5d' after import
                 self._set_default_shift_3x8_5d()
             
+            # Imported weeks the archive already covers replace their archived
+            # copy, where simulations read them; compile the demand store once
+            # the import is committed (archiving rebuilds it when it moves rows)
+            if not archive_live_past_weeks(stdout=self.stdout):
+                build_demand_store(stdout=self.stdout)
+            if options['save_version']:
+                create_forecast_version(options['save_version'], f'Imported from {forecast_file_path}',
+                                        stdout=self.stdout)
+            
             self.stdout.write(self.style.SUCCESS('Data import completed successfully!'))
             
         except FileNotFoundError:
@@ -112,6 +136,7 @@ class Command(BaseCommand):
     def _clear_data(self):
         """Clear all existing data"""
         DemandForecast.objects.all().delete()
+        ArchivedDemandForecast.objects.all().delete()
         LineProductAssignment.objects.all().delete()
         Product.objects.all().delete()
         ProductionLine.objects.all().delete()
@@ -120,6 +145,8 @@ class Command(BaseCommand):
         Site.objects.all().delete()
         SimulationCategory.objects.all().delete()
         CustomShiftConfiguration.objects.all().delete()
+        # Forecasts are not tracked by signals (bulk operations)
+        DataVersion.bump('demandforecast', 'archiveddemandforecast')
         self.stdout.write('  Cleared all existing data')
 
     def _create_sites(self, data_df):
@@ -468,6 +495,7 @@ class Command(BaseCommand):
         # Bulk create forecasts
         if forecasts_to_create:
             DemandForecast.objects.bulk_create(forecasts_to_create, batch_size=5000)
+            DataVersion.bump('demandforecast')
             self.stdout.write(f'  Created {len(forecasts_to_create)} demand forecasts')
     
     def _set_default_shift_3x8_5d(self):
@@ -0,0 +1,24 @@
+"""
+Management command to save the current demand forecasts as a ForecastVersion
+Run before an import overwrites the forecasts; import_from_excel --save-version
+saves the imported forecasts automatically
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simulation.forecast_versions import create_forecast_version
+from simulation.models import ForecastVersion
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the current demand forecasts as a named forecast version'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', type=str, help='Version name, e.g. "2026-10 forecast"')
+        parser.add_argument('--description', type=str, default='', help='Optional description')
+
+    def handle(self, *args, **options):
+        if ForecastVersion.objects.filter(name=options['name']).exists():
+            raise CommandError(f'Forecast version "{options["name"]}" already exists')
+        version = create_forecast_version(options['name'], options['description'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Saved forecast version {version.id} "{version.name}"'))
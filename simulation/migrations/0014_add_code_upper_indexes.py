@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0013_add_weekend_hours_and_cleaning_time'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='client_code_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='product_code_upper_idx'),
+        ),
+    ]
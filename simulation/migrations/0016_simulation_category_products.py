@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_memberships(apps, schema_editor):
+    """Materialize the products matching each existing category"""
+    SimulationCategory = apps.get_model('simulation', 'SimulationCategory')
+    SimulationCategoryProduct = apps.get_model('simulation', 'SimulationCategoryProduct')
+    Product = apps.get_model('simulation', 'Product')
+
+    def split(value):
+        return [t.strip() for t in value.split(',') if t.strip()]
+
+    for category in SimulationCategory.objects.all():
+        line_ids = list(category.lines.values_list('id', flat=True))
+        if not line_ids:
+            continue
+        products = Product.objects.filter(is_active=True, default_line_id__in=line_ids)
+        for field in ('product_type', 'recipe_type', 'material_type', 'packaging_type'):
+            values = split(getattr(category, f'{field}s'))
+            if values:
+                products = products.filter(**{f'{field}__in': values})
+        SimulationCategoryProduct.objects.bulk_create([
+            SimulationCategoryProduct(category_id=category.id, product_id=product_id)
+            for product_id in products.values_list('id', flat=True)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0015_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationCategoryProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_memberships', to='simulation.simulationcategory')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_memberships', to='simulation.product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='simulationcategory',
+            name='products',
+            field=models.ManyToManyField(blank=True, help_text='Products currently matching this category (maintained automatically)', related_name='simulation_categories', through='simulation.SimulationCategoryProduct', to='simulation.product'),
+        ),
+        migrations.AddIndex(
+            model_name='simulationcategoryproduct',
+            index=models.Index(fields=['product', 'category'], name='simulation__product_645124_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='simulationcategoryproduct',
+            unique_together={('category', 'product')},
+        ),
+        migrations.RunPython(populate_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-18 15:05
+
+from django.db import migrations
+
+
+# PostgreSQL-only covering indexes: the weekly demand aggregations read
+# forecast_quantity (and client_id) straight from the index, without heap lookups.
+# Other backends have no INCLUDE clause and keep the regular indexes.
+COVERING_INDEXES = {
+    'simulation_demandforecast_product_week_cov': (
+        '(product_id, week_start_date) INCLUDE (forecast_quantity, client_id)'
+    ),
+    'simulation_demandforecast_client_product_week_cov': (
+        '(client_id, product_id, week_start_date) INCLUDE (forecast_quantity)'
+    ),
+}
+
+
+def create_covering_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, columns in COVERING_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON simulation_demandforecast {columns}')
+
+
+def drop_covering_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in COVERING_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0016_simulation_category_products'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_covering_indexes, drop_covering_indexes),
+    ]
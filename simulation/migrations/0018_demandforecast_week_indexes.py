@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-18 21:32
+
+from django.db import migrations, models
+
+
+INDEXES = [
+    models.Index(fields=['product', 'week_start_date'], name='simulation__product_bcd72c_idx'),
+    models.Index(fields=['client', 'product', 'week_start_date'], name='simulation__client__eb1a15_idx'),
+]
+
+# On PostgreSQL the covering indexes of 0017 already have these keys: they are
+# renamed to the model's index names instead of adding key-only duplicates
+POSTGRES_COVERING = {
+    'simulation__product_bcd72c_idx': 'simulation_demandforecast_product_week_cov',
+    'simulation__client__eb1a15_idx': 'simulation_demandforecast_client_product_week_cov',
+}
+
+
+def add_indexes(apps, schema_editor):
+    DemandForecast = apps.get_model('simulation', 'DemandForecast')
+    for index in INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(f'ALTER INDEX {POSTGRES_COVERING[index.name]} RENAME TO {index.name}')
+        else:
+            schema_editor.add_index(DemandForecast, index)
+
+
+def remove_indexes(apps, schema_editor):
+    DemandForecast = apps.get_model('simulation', 'DemandForecast')
+    for index in INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(f'ALTER INDEX {index.name} RENAME TO {POSTGRES_COVERING[index.name]}')
+        else:
+            schema_editor.remove_index(DemandForecast, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0017_demandforecast_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='demandforecast', index=index)
+                for index in INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+        ),
+    ]
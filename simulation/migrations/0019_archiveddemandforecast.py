@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 21:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def partition_by_year(apps, schema_editor):
+    """
+    On PostgreSQL, recreate the (still empty) archive table partitioned by
+    week_start_date; archive.ensure_year_partitions adds one partition per year.
+    The primary key has to include the partition key.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    ArchivedDemandForecast = apps.get_model('simulation', 'ArchivedDemandForecast')
+    table = ArchivedDemandForecast._meta.db_table
+    schema_editor.execute(f'DROP TABLE {table}')
+    schema_editor.execute(f"""
+        CREATE TABLE {table} (
+            id bigint GENERATED BY DEFAULT AS IDENTITY,
+            year integer NOT NULL,
+            week_number integer NOT NULL,
+            week_start_date date NOT NULL,
+            forecast_quantity numeric(12, 2) NOT NULL,
+            client_id bigint NOT NULL REFERENCES simulation_client (id) DEFERRABLE INITIALLY DEFERRED,
+            product_id bigint NOT NULL REFERENCES simulation_product (id) DEFERRABLE INITIALLY DEFERRED,
+            PRIMARY KEY (id, week_start_date)
+        ) PARTITION BY RANGE (week_start_date)
+    """)
+    for index in ArchivedDemandForecast._meta.indexes:
+        schema_editor.add_index(ArchivedDemandForecast, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0018_demandforecast_week_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDemandForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('week_number', models.IntegerField()),
+                ('week_start_date', models.DateField()),
+                ('forecast_quantity', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_forecasts', to='simulation.client')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_forecasts', to='simulation.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['week_start_date'], name='simulation__week_st_cfd793_idx'), models.Index(fields=['product', 'week_start_date'], name='simulation__product_d4bbb0_idx'), models.Index(fields=['client', 'product', 'week_start_date'], name='simulation__client__5a8644_idx')],
+            },
+        ),
+        migrations.RunPython(partition_by_year, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 21:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulation', '0019_archiveddemandforecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('forecast_count', models.PositiveIntegerField(default=0)),
+                ('client_count', models.PositiveIntegerField(default=0)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('first_week', models.DateField(blank=True, null=True)),
+                ('last_week', models.DateField(blank=True, null=True)),
+                ('snapshot', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
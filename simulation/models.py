@@ -4,6 +4,7 @@ Database models for production planning and simulation
 """
 
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -394,6 +395,8 @@ class Client(models.Model):
         indexes = [
             models.Index(fields=['is_active']),
             models.Index(fields=['code']),
+            # Case-insensitive code lookups (see services.resolve_codes)
+            models.Index(Upper('code'), name='client_code_upper_idx'),
         ]
 
     def __str__(self):
@@ -426,6 +429,15 @@ class SimulationCategory(models.Model):
         help_text='Production lines included in this category'
     )
     
+    # Materialized result of the filters below (see refresh_matching_products)
+    products = models.ManyToManyField(
+        'Product',
+        through='SimulationCategoryProduct',
+        blank=True,
+        related_name='simulation_categories',
+        help_text='Products currently matching this category (maintained automatically)'
+    )
+    
     # Product attribute filters (comma-separated values for multiple selections)
     product_types = models.TextField(
         blank=True,
@@ -480,9 +492,9 @@ class SimulationCategory(models.Model):
         """Return list of packaging types"""
         return [t.strip() for t in self.packaging_types.split(',') if t.strip()]
     
-    def get_matching_products(self):
+    def compute_matching_products(self):
         """
-        Get products matching this category's filters.
+        Evaluate this category's filters against the Product table.
         
         IMPORTANT: Products are ALWAYS filtered by their default_line.
         Only products whose default_line is one of the category's lines are included.
@@ -524,6 +536,32 @@ class SimulationCategory(models.Model):
         
         return queryset
     
+    def matches_product(self, product, line_ids) -> bool:
+        """Same rules as compute_matching_products, for a single product in memory"""
+        if not product.is_active or product.default_line_id not in line_ids:
+            return False
+        filters = (
+            (self.product_types_list, product.product_type),
+            (self.recipe_types_list, product.recipe_type),
+            (self.material_types_list, product.material_type),
+            (self.packaging_types_list, product.packaging_type),
+        )
+        return all(not values or value in values for values, value in filters)
+    
+    def refresh_matching_products(self):
+        """Recompute the membership table for this category"""
+        self.products.set(self.compute_matching_products().values_list('id', flat=True))
+    
+    def get_matching_products(self):
+        """Get products matching this category's filters (from the membership table)"""
+        return self.products.all()
+    
+    def get_matching_product_ids(self) -> set:
+        """IDs of the products matching this category, without touching Product"""
+        return set(SimulationCategoryProduct.objects.filter(
+            category_id=self.id
+        ).values_list('product_id', flat=True))
+    
     def get_line_ids(self):
         """Get list of line IDs for this category"""
         return list(self.lines.values_list('id', flat=True))
@@ -572,12 +610,59 @@ class Product(models.Model):
             models.Index(fields=['recipe_type']),
             models.Index(fields=['material_type']),
             models.Index(fields=['packaging_type']),
+            # Case-insensitive code lookups (see services.resolve_codes)
+            models.Index(Upper('code'), name='product_code_upper_idx'),
         ]
 
     def __str__(self):
         return f"{self.code} - {self.name}"
 
 
+class SimulationCategoryProduct(models.Model):
+    """
+    Membership of a product in a simulation category.
+    Materializes SimulationCategory.compute_matching_products so simulations start
+    from a precomputed ID set; kept up to date by signals on category, line and
+    product writes (see signals.py).
+    """
+    category = models.ForeignKey(
+        SimulationCategory,
+        on_delete=models.CASCADE,
+        related_name='product_memberships'
+    )
+    product = models.ForeignKey(
+        'Product',
+        on_delete=models.CASCADE,
+        related_name='category_memberships'
+    )
+
+    class Meta:
+        unique_together = ['category', 'product']
+        indexes = [
+            models.Index(fields=['product', 'category']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.code} in {self.category.name}"
+
+    @classmethod
+    def refresh_for_product(cls, product):
+        """Add or remove a single product from every category it (no longer) matches"""
+        categories = SimulationCategory.objects.prefetch_related('lines')
+        matching = {
+            category.id for category in categories
+            if category.matches_product(product, {line.id for line in category.lines.all()})
+        }
+        current = set(cls.objects.filter(product=product).values_list('category_id', flat=True))
+        if current - matching:
+            cls.objects.filter(product=product, category_id__in=current - matching).delete()
+        if matching - current:
+            cls.objects.bulk_create([
+                cls(category_id=category_id, product=product)
+                for category_id in matching - current
+            ])
+
+
 class LineProductAssignment(models.Model):
     """
     Which products can be produced on which lines
@@ -657,12 +742,77 @@ class DemandForecast(models.Model):
             models.Index(fields=['week_start_date']),
             models.Index(fields=['client', 'year', 'week_number']),
             models.Index(fields=['product', 'year', 'week_number']),
+            # Shapes of the simulation demand queries: product_id IN (...) and a
+            # week_start_date range, optionally for one client
+            models.Index(fields=['product', 'week_start_date']),
+            models.Index(fields=['client', 'product', 'week_start_date']),
         ]
 
     def __str__(self):
         return f"{self.client.code} - {self.product.code} - W{self.week_number}/{self.year}: {self.forecast_quantity}"
 
 
+class ArchivedDemandForecast(models.Model):
+    """
+    Demand forecasts of past weeks, moved out of DemandForecast by the
+    archive_forecasts command (see archive.py) so the live table stays small.
+    Simulations read weeks up to the latest archived week from here.
+    Partitioned by year of week_start_date on PostgreSQL.
+    """
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='archived_forecasts'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='archived_forecasts'
+    )
+    year = models.IntegerField()
+    week_number = models.IntegerField()
+    week_start_date = models.DateField()
+    forecast_quantity = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['week_start_date']),
+            models.Index(fields=['product', 'week_start_date']),
+            models.Index(fields=['client', 'product', 'week_start_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.client_id} - {self.product_id} - W{self.week_number}/{self.year} (archived): {self.forecast_quantity}"
+
+
+class ForecastVersion(models.Model):
+    """
+    A saved copy of the demand forecasts, e.g. before the next import overwrites them.
+    The forecasts are kept as one compressed (client, product) x week array
+    (see forecast_versions.py) instead of duplicated DemandForecast rows.
+    Simulations can run against a version, and two versions can be diffed.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    description = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Snapshot summary, filled when the snapshot is taken
+    forecast_count = models.PositiveIntegerField(default=0)
+    client_count = models.PositiveIntegerField(default=0)
+    product_count = models.PositiveIntegerField(default=0)
+    first_week = models.DateField(null=True, blank=True)
+    last_week = models.DateField(null=True, blank=True)
+
+    # np.savez_compressed archive of the snapshot arrays
+    snapshot = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.forecast_count} forecasts)"
+
+
 class CustomShiftConfiguration(models.Model):
     """
     User-defined custom shift configuration.
@@ -762,3 +912,40 @@ class CustomShiftConfiguration(models.Model):
             self.name = self.config_display
         super().save(*args, **kwargs)
 
+
+
+class DataVersion(models.Model):
+    """
+    Change counter per table, bumped on every write (see signals.py).
+    Shared through the database so every worker process sees the same version;
+    used to build ETags and to invalidate derived caches.
+    """
+    name = models.CharField(max_length=50, unique=True, help_text='Model name, e.g. "product"')
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    @classmethod
+    def bump(cls, *names):
+        """Increment the version of each named table"""
+        from django.db.models import F
+        from django.utils import timezone
+
+        for name in names:
+            updated = cls.objects.filter(name=name).update(
+                version=F('version') + 1, updated_at=timezone.now()
+            )
+            if not updated:
+                version, _ = cls.objects.get_or_create(name=name)
+                cls.objects.filter(pk=version.pk).update(version=F('version') + 1)
+
+    @classmethod
+    def get_versions(cls, names):
+        """Current version of each named table in one query (0 if never written)"""
+        versions = dict(cls.objects.filter(name__in=names).values_list('name', 'version'))
+        return {name: versions.get(name, 0) for name in names}
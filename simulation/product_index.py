@@ -0,0 +1,149 @@
+"""
+In-memory product index for Cerelia Simulation
+Maps product IDs to dense positions and keeps per-line, per-attribute and
+per-category membership as NumPy bitsets, so product filter combinations are
+evaluated with bitwise operations instead of ORM queries and Python set math
+"""
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .models import Product, SimulationCategoryProduct, DataVersion
+
+
+# Attribute fields indexed as bitsets
+INDEXED_ATTRIBUTES = ('product_type', 'recipe_type', 'material_type', 'packaging_type')
+
+# Tables the index is built from; the process-wide index is rebuilt when any
+# of their versions moves (membership rows follow product/category/line writes)
+INDEX_VERSION_MODELS = ['product', 'productionline', 'simulationcategory']
+
+
+class ProductIndex:
+    """
+    Immutable snapshot of active products.
+
+    Bitsets are np.packbits-packed uint8 arrays with one bit per dense product
+    position; combine them with &, | and ~ (see bitset_not) and turn them back
+    into product IDs with ids().
+    """
+
+    def __init__(self, products: list, memberships: list, version: tuple = ()):
+        """
+        Args:
+            products: (id, default_line_id, *INDEXED_ATTRIBUTES) rows of active products
+            memberships: (category_id, product_id) rows
+            version: DataVersion stamp the snapshot was built from
+        """
+        self.version = version
+        products = sorted(products)
+        self.product_ids = np.array([row[0] for row in products], dtype=np.int64)
+        self.size = len(products)
+
+        line_positions = {}
+        attribute_positions = {name: {} for name in INDEXED_ATTRIBUTES}
+        for position, (_, line_id, *attributes) in enumerate(products):
+            if line_id is not None:
+                line_positions.setdefault(line_id, []).append(position)
+            for name, value in zip(INDEXED_ATTRIBUTES, attributes):
+                if value:
+                    attribute_positions[name].setdefault(value, []).append(position)
+
+        category_positions = {}
+        for category_id, product_id in memberships:
+            position = self.position(product_id)
+            if position is not None:
+                category_positions.setdefault(category_id, []).append(position)
+
+        self._lines = {key: self._pack(p) for key, p in line_positions.items()}
+        self._attributes = {
+            name: {value: self._pack(p) for value, p in values.items()}
+            for name, values in attribute_positions.items()
+        }
+        self._categories = {key: self._pack(p) for key, p in category_positions.items()}
+        self._empty = self._pack([])
+
+    def _pack(self, positions) -> np.ndarray:
+        bits = np.zeros(self.size, dtype=bool)
+        bits[positions] = True
+        return np.packbits(bits)
+
+    def _union(self, bitsets) -> np.ndarray:
+        result = self._empty.copy()
+        for bitset in bitsets:
+            result |= bitset
+        return result
+
+    def position(self, product_id: int) -> Optional[int]:
+        """Dense position of a product, None if not an active product"""
+        position = int(np.searchsorted(self.product_ids, product_id))
+        if position < self.size and self.product_ids[position] == product_id:
+            return position
+        return None
+
+    def all(self) -> np.ndarray:
+        """Bitset of every active product"""
+        return self._pack(slice(None))
+
+    def lines(self, line_ids: Iterable[int]) -> np.ndarray:
+        """Products whose default line is one of line_ids"""
+        return self._union(self._lines[line_id] for line_id in line_ids if line_id in self._lines)
+
+    def product_lines(self, line_ids: Iterable[int]) -> dict:
+        """Default line of each product on line_ids (product_id -> line_id)"""
+        return {
+            product_id: line_id
+            for line_id in line_ids if line_id in self._lines
+            for product_id in self.ids(self._lines[line_id])
+        }
+
+    def attribute(self, name: str, values: Iterable[str]) -> np.ndarray:
+        """Products whose attribute `name` is one of values"""
+        bitsets = self._attributes[name]
+        return self._union(bitsets[value] for value in values if value in bitsets)
+
+    def category(self, category_id: int) -> np.ndarray:
+        """Products in the SimulationCategory membership table"""
+        return self._categories.get(category_id, self._empty)
+
+    def products(self, product_ids: Iterable[int]) -> np.ndarray:
+        """Bitset of the given product IDs (inactive/unknown IDs are dropped)"""
+        ids = np.fromiter(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self.product_ids, ids)
+        found = positions < self.size
+        found[found] &= self.product_ids[positions[found]] == ids[found]
+        return self._pack(positions[found])
+
+    def bitset_not(self, bitset: np.ndarray) -> np.ndarray:
+        """Complement of a bitset, without the padding bits"""
+        return np.packbits(~np.unpackbits(bitset, count=self.size).astype(bool))
+
+    def ids(self, bitset: np.ndarray) -> set:
+        """Product IDs of the bits set"""
+        positions = np.flatnonzero(np.unpackbits(bitset, count=self.size))
+        return set(self.product_ids[positions].tolist())
+
+    def count(self, bitset: np.ndarray) -> int:
+        return int(np.unpackbits(bitset, count=self.size).sum())
+
+
+_index: Optional[ProductIndex] = None
+
+
+def get_product_index() -> ProductIndex:
+    """
+    Process-wide product index, rebuilt when the underlying tables change.
+    Costs one small DataVersion query per call; callers cache the result per request.
+    """
+    global _index
+    versions = DataVersion.get_versions(INDEX_VERSION_MODELS)
+    version = tuple(versions[name] for name in INDEX_VERSION_MODELS)
+    if _index is None or _index.version != version:
+        products = list(
+            Product.objects.filter(is_active=True).order_by()
+            .values_list('id', 'default_line_id', *INDEXED_ATTRIBUTES)
+        )
+        memberships = list(SimulationCategoryProduct.objects.values_list('category_id', 'product_id'))
+        _index = ProductIndex(products, memberships, version)
+    return _index
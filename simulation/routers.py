@@ -0,0 +1,62 @@
+"""
+Database routing for Cerelia Simulation
+Reads made by the simulation services go to a dedicated read connection
+(settings.SIMULATION_READ_DATABASE), so dashboards and writes from imports,
+the overrides API or line config edits don't hold each other up
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+
+_simulation_reads = ContextVar('simulation_reads', default=False)
+
+
+def get_read_database() -> str:
+    """Alias of the read connection, 'default' when none is configured"""
+    alias = getattr(settings, 'SIMULATION_READ_DATABASE', 'default')
+    return alias if alias in settings.DATABASES else 'default'
+
+
+@contextmanager
+def simulation_reads():
+    """Route reads made inside the block to the read connection"""
+    token = _simulation_reads.set(True)
+    try:
+        yield
+    finally:
+        _simulation_reads.reset(token)
+
+
+def reads_from_read_database(func):
+    """Decorator running a read-only service inside simulation_reads()"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with simulation_reads():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class SimulationReadRouter:
+    """
+    Sends reads made inside simulation_reads() to the read connection.
+    All other reads and every write use default; migrations only run on default
+    (the read connection is the same database or a replica of it).
+    """
+
+    def db_for_read(self, model, **hints):
+        if _simulation_reads.get():
+            return get_read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,59 @@
+"""
+Efficiency and cadence sensitivity for Cerelia Simulation
+Capacity is linear in ProductionLine.efficiency_factor and
+base_capacity_per_hour, so scaling the capacity calendar of each line by an
+efficiency multiplier x a cadence multiplier gives the capacity of that
+what-if without editing the line. The whole grid is evaluated by
+broadcasting line x efficiency x cadence x week arrays.
+"""
+
+import numpy as np
+
+from .client_impact import utilization_percent, utilization_stats
+
+
+# Efficiency factors are fractions: a multiplier never takes a line above this
+MAX_EFFICIENCY = 1.0
+
+
+def sweep_capacity(demand: np.ndarray, capacity: np.ndarray, efficiency,
+                   efficiency_multipliers, cadence_multipliers) -> dict:
+    """
+    Args:
+        demand: float64[lines, weeks] weekly demand of each line
+        capacity: float64[lines, weeks] current capacity calendar of each line
+        efficiency: Current efficiency_factor of each line
+        efficiency_multipliers: Multipliers of efficiency_factor (E values)
+        cadence_multipliers: Multipliers of base_capacity_per_hour (C values)
+
+    Returns:
+        Dict with 'efficiency' (float64[lines, E] swept efficiency factors,
+        capped at MAX_EFFICIENCY), per line float64[lines, E, C] surfaces
+        'average_utilization', 'peak_utilization' and 'over_capacity_periods',
+        the same surfaces for all lines pooled ('total', [E, C]) and the
+        current values ('current', per line and 'current_total')
+    """
+    efficiency = np.asarray(efficiency, dtype=float)
+    multipliers = np.asarray(efficiency_multipliers, dtype=float)
+    cadence = np.asarray(cadence_multipliers, dtype=float)
+
+    # Lines already above MAX_EFFICIENCY keep their own factor as the cap
+    swept_efficiency = np.minimum(
+        efficiency[:, None] * multipliers, np.maximum(efficiency, MAX_EFFICIENCY)[:, None]
+    )
+    # Effective multiplier of each line once capped (1 for lines without efficiency)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(efficiency[:, None] > 0, swept_efficiency / efficiency[:, None], 1.0)
+
+    # [lines, E, C, weeks]
+    swept_capacity = capacity[:, None, None, :] * scale[:, :, None, None] * cadence[None, None, :, None]
+    utilization = utilization_percent(demand[:, None, None, :], swept_capacity)
+    total_utilization = utilization_percent(demand.sum(axis=0), swept_capacity.sum(axis=0))
+
+    return {
+        'efficiency': swept_efficiency,
+        **utilization_stats(utilization),
+        'total': utilization_stats(total_utilization),
+        'current': utilization_stats(utilization_percent(demand, capacity)),
+        'current_total': utilization_stats(utilization_percent(demand.sum(axis=0), capacity.sum(axis=0))),
+    }
@@ -2,12 +2,16 @@
 Django REST Framework Serializers for Cerelia Simulation
 """
 
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import (
     Site, ShiftConfiguration, ProductionLine,
-    Client, Product, LineProductAssignment, DemandForecast, LineConfigOverride,
+    Client, Product, LineProductAssignment, DemandForecast, ForecastVersion, LineConfigOverride,
     SimulationCategory, CustomShiftConfiguration
 )
+from .archive import archived_week_error
+from .product_index import INDEXED_ATTRIBUTES
 
 
 class SiteSerializer(serializers.ModelSerializer):
@@ -123,6 +127,22 @@ class DemandForecastSerializer(serializers.ModelSerializer):
         fields = ['id', 'client', 'client_name', 'product', 'product_code',
                   'product_name', 'year', 'week_number', 'week_start_date',
                   'forecast_quantity']
+    
+    def validate_week_start_date(self, value):
+        # Simulations read weeks up to the archive cutoff from the archive only
+        error = archived_week_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+
+class ForecastVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ForecastVersion
+        fields = ['id', 'name', 'description', 'created_at', 'forecast_count',
+                  'client_count', 'product_count', 'first_week', 'last_week']
+        read_only_fields = ['created_at', 'forecast_count', 'client_count',
+                            'product_count', 'first_week', 'last_week']
 
 
 # Simulation Request/Response Serializers
@@ -172,6 +192,97 @@ class LineSimulationRequestSerializer(serializers.Serializer):
         default='week'
     )
     demand_modifications = DemandModificationSerializer(many=True, required=False, allow_null=True)
+    # Stream the JSON response incrementally (long daily horizons)
+    stream = serializers.BooleanField(required=False, default=False)
+    # 'columnar' returns parallel arrays instead of one dict per period
+    format = serializers.ChoiceField(
+        choices=['rows', 'columnar'],
+        required=False,
+        default='rows'
+    )
+    # Downsample charted series to at most max_points (summary stats stay exact)
+    max_points = serializers.IntegerField(required=False, allow_null=True, min_value=2)
+    bucket = serializers.ChoiceField(
+        choices=['minmax', 'lttb'],
+        required=False,
+        default='minmax'
+    )
+    # Token of a previous result: demand_modifications are then applied on top
+    # of that result's (already modified) demand instead of reloading it
+    base_token = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    # Keep this result's demand and return a result_token to pass as base_token
+    # (tokens live in the default cache, which must be shared between workers)
+    keep_state = serializers.BooleanField(required=False, default=False)
+    # Run against a saved ForecastVersion instead of the current forecasts
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+    # Pre-build over-capacity weeks in earlier weeks with slack (weekly only),
+    # optionally limited to max_stock_weeks of cover and shelf_life_weeks
+    build_ahead = serializers.BooleanField(required=False, default=False)
+    max_stock_weeks = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    shelf_life_weeks = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+
+
+class LineHeatmapRequestSerializer(serializers.Serializer):
+    """Request for the line x period utilization heatmap"""
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    # All active lines by default, or those of one site / the listed lines
+    site_id = serializers.IntegerField(required=False, allow_null=True)
+    line_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True)
+    shift_configs = LineShiftConfigSerializer(many=True, required=False, default=list)
+    granularity = serializers.ChoiceField(
+        choices=['week', 'day'],
+        required=False,
+        default='week'
+    )
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+class CapacityGapRequestSerializer(serializers.Serializer):
+    """Request for the extra hours per line and week needed to meet demand"""
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    # All active lines by default, or those of one site / the listed lines
+    site_id = serializers.IntegerField(required=False, allow_null=True)
+    line_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True)
+    shift_configs = LineShiftConfigSerializer(many=True, required=False, default=list)
+    target_utilization = serializers.DecimalField(
+        max_digits=5, decimal_places=1, min_value=Decimal('1'), max_value=Decimal('200'),
+        required=False, default=Decimal('100')
+    )
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+class SensitivitySweepRequestSerializer(serializers.Serializer):
+    """Request for utilization surfaces over efficiency x cadence multipliers"""
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    # All active lines by default, or those of one site / the listed lines
+    site_id = serializers.IntegerField(required=False, allow_null=True)
+    line_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True)
+    shift_configs = LineShiftConfigSerializer(many=True, required=False, default=list)
+    # Multipliers of efficiency_factor and base_capacity_per_hour (1 = current value)
+    efficiency_multipliers = serializers.ListField(
+        child=serializers.DecimalField(
+            max_digits=5, decimal_places=3, min_value=Decimal('0.01'), max_value=Decimal('10')
+        ),
+        required=False, min_length=1, max_length=25, default=list
+    )
+    cadence_multipliers = serializers.ListField(
+        child=serializers.DecimalField(
+            max_digits=5, decimal_places=3, min_value=Decimal('0.01'), max_value=Decimal('10')
+        ),
+        required=False, min_length=1, max_length=25, default=list
+    )
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+class ProductShareSerializer(serializers.Serializer):
+    """Share of a new client's demand: one product, or the products with an attribute value"""
+    product_code = serializers.CharField(required=False, allow_blank=True)
+    attribute = serializers.ChoiceField(choices=list(INDEXED_ATTRIBUTES), required=False)
+    value = serializers.CharField(required=False, allow_blank=True)
+    share = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=Decimal('0.01'))
 
 
 class NewClientSimulationRequestSerializer(serializers.Serializer):
@@ -180,8 +291,13 @@ class NewClientSimulationRequestSerializer(serializers.Serializer):
     shift_configs = LineShiftConfigSerializer(many=True)
     start_date = serializers.DateField()
     end_date = serializers.DateField()
-    new_client_demand = serializers.DecimalField(max_digits=12, decimal_places=2)
+    # Weekly demand: added flat, or split by product_shares
+    new_client_demand = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
     remove_client_id = serializers.IntegerField(required=False, allow_null=True)
+    # Product mix: a scaled copy of an existing client's forecasts, or product/attribute shares
+    profile_client_id = serializers.IntegerField(required=False, allow_null=True)
+    profile_scale = serializers.DecimalField(max_digits=8, decimal_places=3, min_value=0, required=False, default=1)
+    product_shares = ProductShareSerializer(many=True, required=False)
 
 
 class LostClientSimulationRequestSerializer(serializers.Serializer):
@@ -193,6 +309,25 @@ class LostClientSimulationRequestSerializer(serializers.Serializer):
     lost_client_id = serializers.IntegerField()
 
 
+class ClientImpactRequestSerializer(serializers.Serializer):
+    """Request for the ranking of all clients by utilization impact"""
+    line_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1)
+    shift_configs = LineShiftConfigSerializer(many=True, required=False, default=list)
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    # Change applied to one client at a time: -100 = lost client, +20 = 20% growth
+    change_percent = serializers.DecimalField(
+        max_digits=7, decimal_places=2, min_value=-100, required=False, default=-100
+    )
+    rank_by = serializers.ChoiceField(
+        choices=['over_capacity_periods', 'average_utilization', 'peak_utilization'],
+        required=False,
+        default='over_capacity_periods'
+    )
+    top_n = serializers.IntegerField(required=False, default=10, min_value=1, max_value=500)
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+
+
 class SimulationDataPointSerializer(serializers.Serializer):
     """Single data point in simulation results"""
     date = serializers.CharField()  # Week label
@@ -312,3 +447,42 @@ class CategorySimulationRequestSerializer(serializers.Serializer):
         default='week'
     )
     demand_modifications = DemandModificationSerializer(many=True, required=False, allow_null=True)
+    # Stream the JSON response incrementally (long daily horizons)
+    stream = serializers.BooleanField(required=False, default=False)
+    # 'columnar' returns parallel arrays instead of one dict per period
+    format = serializers.ChoiceField(
+        choices=['rows', 'columnar'],
+        required=False,
+        default='rows'
+    )
+    # Downsample charted series to at most max_points (summary stats stay exact)
+    max_points = serializers.IntegerField(required=False, allow_null=True, min_value=2)
+    bucket = serializers.ChoiceField(
+        choices=['minmax', 'lttb'],
+        required=False,
+        default='minmax'
+    )
+    # Run against a saved ForecastVersion instead of the current forecasts
+    forecast_version_id = serializers.IntegerField(required=False, allow_null=True)
+    # Add per-line and per-site series and summary stats to the result
+    breakdown = serializers.BooleanField(required=False, default=False)
+
+
+class ForecastVersionDiffRequestSerializer(serializers.Serializer):
+    """Request for a week-by-week diff between two forecast versions"""
+    compare_version_id = serializers.IntegerField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    # Optional scope, like the simulations: lines or a category, clients, products
+    line_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_null=True)
+    simulation_category_id = serializers.IntegerField(required=False, allow_null=True)
+    client_codes = serializers.ListField(
+        child=serializers.CharField(max_length=20),
+        required=False,
+        allow_null=True
+    )
+    product_codes = serializers.ListField(
+        child=serializers.CharField(max_length=50),
+        required=False,
+        allow_null=True
+    )
@@ -3,31 +3,352 @@ Simulation Services for Cerelia Production Planning
 Core business logic for capacity and demand simulations
 """
 
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Optional, Dict, List, Set
+from django.core.cache import cache
+from django.db import connections
 from django.db.models import Sum, Q, Prefetch
-from functools import lru_cache
+from django.db.models.functions import Upper
+from functools import lru_cache, partial
 from .models import (
     ProductionLine, ShiftConfiguration, Product, Client,
-    DemandForecast, LineProductAssignment, LineConfigOverride
+    DemandForecast, LineProductAssignment, LineConfigOverride, DataVersion
 )
+from .product_index import ProductIndex, get_product_index
+from .demand_store import DemandStore, get_demand_store
+from .archive import (
+    get_archive_cutoff, sum_archived_demand_by_week, sum_archived_demand_by_line_and_week,
+    sum_archived_demand_by_client_and_week
+)
+from .forecast_versions import ForecastSnapshot, get_forecast_snapshot, diff_snapshots
+from .client_impact import client_week_matrix, period_matrix, rank_client_impacts, line_impacts
+from .capacity_gap import solve_capacity_gap
+from .build_ahead import smooth_build_ahead
+from .sensitivity import sweep_capacity
+from .routers import reads_from_read_database, simulation_reads
+from .sql_demand import sql_pushdown_enabled, daily_demand_rows
+
+
+class _RequestCaches:
+    """
+    Caches of one request, and the forecast version its simulation reads.
+    Held in a context variable (see _caches), so concurrent requests - threads,
+    or sync_to_async calls outside the shared sync thread - never see each
+    other's state; _run_loads workers inherit their request's.
+    """
+    
+    def __init__(self):
+        self.lines = {}
+        self.shift_configs = {}
+        self.product_ids = {}
+        self.overrides = {}
+        self.product_index = None
+        self.demand_store = False  # False = not looked up yet, None = no store for this version
+        self.archive_cutoff = False  # False = not looked up yet, None = nothing archived
+        self.forecast_snapshot = None  # Forecast version read by the simulation, None = current forecasts
+
+
+_request_caches = ContextVar('simulation_request_caches', default=None)
 
+# Per-line capacity arrays kept between requests (see _line_capacity_by_period)
+LINE_CAPACITY_CACHE_TIMEOUT = 60 * 60
 
-# Cache for frequently accessed data within a request
-_line_cache = {}
-_shift_config_cache = {}
-_product_ids_cache = {}
-_override_cache = {}
+# Modified demand of line simulations run with keep_state, reusable through
+# result_token. Stored in the default cache, so with several worker processes
+# that cache must be shared (Redis, Memcached, database): a LocMemCache token
+# only resolves in the process that created it.
+DEMAND_STATE_TIMEOUT = 30 * 60
+
+# Upper bound on threads used by _run_loads for one simulation
+MAX_CONCURRENT_LOADS = 8
 
 
 def clear_caches():
     """Clear all service caches - call at the start of each request"""
-    global _line_cache, _shift_config_cache, _product_ids_cache, _override_cache
-    _line_cache = {}
-    _shift_config_cache = {}
-    _product_ids_cache = {}
-    _override_cache = {}
+    _request_caches.set(_RequestCaches())
+
+
+def _caches() -> _RequestCaches:
+    """Caches of the current request (a new set when clear_caches was not called in this context)"""
+    caches = _request_caches.get()
+    if caches is None:
+        caches = _RequestCaches()
+        _request_caches.set(caches)
+    return caches
+
+
+@contextmanager
+def _request_context(caches: _RequestCaches):
+    """Use a request's caches again, e.g. in data points consumed after its simulation returned"""
+    token = _request_caches.set(caches)
+    try:
+        yield
+    finally:
+        _request_caches.reset(token)
+
+
+def _get_product_index() -> ProductIndex:
+    """Process-wide product index, version-checked once per request"""
+    caches = _caches()
+    if caches.product_index is None:
+        caches.product_index = get_product_index()
+    return caches.product_index
+
+
+def _get_demand_store() -> Optional[DemandStore]:
+    """Memory-mapped demand store, version-checked once per request (None if not built)"""
+    caches = _caches()
+    if caches.demand_store is False:
+        caches.demand_store = get_demand_store()
+    return caches.demand_store
+
+
+def _get_archive_cutoff():
+    """Latest archived week, looked up once per request (None if nothing is archived)"""
+    caches = _caches()
+    if caches.archive_cutoff is False:
+        caches.archive_cutoff = get_archive_cutoff()
+    return caches.archive_cutoff
+
+
+def _use_forecast_version(forecast_version_id: Optional[int]) -> Optional[ForecastSnapshot]:
+    """
+    Make the demand reads of the current simulation use a forecast version
+    (None = current forecasts). Every simulation sets it, so one run never
+    inherits the version of the previous one; the setting is local to the
+    request (see _RequestCaches).
+    
+    Returns:
+        The version's snapshot, None when forecast_version_id is None or unknown
+    """
+    caches = _caches()
+    caches.forecast_snapshot = get_forecast_snapshot(forecast_version_id) if forecast_version_id else None
+    return caches.forecast_snapshot
+
+
+def _forecast_snapshot() -> Optional[ForecastSnapshot]:
+    """Forecast version read by the current simulation, None = current forecasts"""
+    return _caches().forecast_snapshot
+
+
+def _sum_demand_by_week(product_ids, week_start, week_end, client_id: Optional[int] = None) -> dict:
+    """
+    Sum forecast_quantity per week_start_date for the given products.
+    Weeks up to the archive cutoff are read from the forecast archive, later
+    weeks from the live forecasts; a simulation run against a forecast version
+    reads that version's snapshot instead.
+    
+    Returns:
+        Dict mapping week_start_date -> total_demand
+    """
+    snapshot = _forecast_snapshot()
+    if snapshot is not None:
+        return snapshot.weekly_demand(
+            product_ids, week_start, week_end,
+            client_ids=[client_id] if client_id else None
+        )
+    
+    cutoff = _get_archive_cutoff()
+    if cutoff is None or week_start > cutoff:
+        return _sum_live_demand_by_week(product_ids, week_start, week_end, client_id)
+    
+    demand = sum_archived_demand_by_week(product_ids, week_start, min(week_end, cutoff), client_id)
+    if week_end > cutoff:
+        demand.update(_sum_live_demand_by_week(product_ids, cutoff + timedelta(days=1), week_end, client_id))
+    return demand
+
+
+def _sum_live_demand_by_week(product_ids, week_start, week_end, client_id: Optional[int] = None) -> dict:
+    """
+    Sum live forecast_quantity per week_start_date for the given products.
+    Reads the demand store when it matches the current data, else the ORM.
+    
+    Returns:
+        Dict mapping week_start_date -> total_demand
+    """
+    store = _get_demand_store()
+    if store is not None:
+        return store.weekly_demand(
+            product_ids, week_start, week_end,
+            client_ids=[client_id] if client_id else None
+        )
+    
+    forecast_filter = Q(
+        product_id__in=product_ids,
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    )
+    
+    if client_id:
+        forecast_filter &= Q(client_id=client_id)
+    
+    forecasts = DemandForecast.objects.filter(forecast_filter).values(
+        'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by('week_start_date')
+    
+    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+
+
+def _sum_demand_by_line_and_week(product_lines: dict, week_start, week_end,
+                                 client_id: Optional[int] = None) -> dict:
+    """
+    Weekly demand of many lines in one aggregation grouped by the products'
+    default line, read from the same sources as _sum_demand_by_week.
+    
+    Args:
+        product_lines: Dict mapping product_id -> default line ID (see ProductIndex.product_lines)
+        week_start, week_end: Inclusive week_start_date bounds
+        client_id: Optional client to restrict to
+    
+    Returns:
+        Dict mapping line_id -> {week_start_date -> total_demand}
+    """
+    if not product_lines:
+        return {}
+    snapshot = _forecast_snapshot()
+    if snapshot is not None:
+        return snapshot.weekly_demand_by_group(
+            product_lines, week_start, week_end,
+            client_ids=[client_id] if client_id else None
+        )
+    
+    cutoff = _get_archive_cutoff()
+    if cutoff is None or week_start > cutoff:
+        return _sum_live_demand_by_line_and_week(product_lines, week_start, week_end, client_id)
+    
+    demand = sum_archived_demand_by_line_and_week(product_lines, week_start, min(week_end, cutoff), client_id)
+    if week_end > cutoff:
+        live = _sum_live_demand_by_line_and_week(product_lines, cutoff + timedelta(days=1), week_end, client_id)
+        for line_id, line_demand in live.items():
+            demand.setdefault(line_id, {}).update(line_demand)
+    return demand
+
+
+def _sum_live_demand_by_line_and_week(product_lines: dict, week_start, week_end,
+                                      client_id: Optional[int] = None) -> dict:
+    """
+    _sum_live_demand_by_week grouped by default line (demand store, else one ORM query)
+    
+    Returns:
+        Dict mapping line_id -> {week_start_date -> total_demand}
+    """
+    store = _get_demand_store()
+    if store is not None:
+        return store.weekly_demand_by_group(
+            product_lines, week_start, week_end,
+            client_ids=[client_id] if client_id else None
+        )
+    
+    forecast_filter = Q(
+        product_id__in=list(product_lines),
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    )
+    
+    if client_id:
+        forecast_filter &= Q(client_id=client_id)
+    
+    forecasts = DemandForecast.objects.filter(forecast_filter).values(
+        'product__default_line_id', 'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by()
+    
+    demand = {}
+    for f in forecasts:
+        demand.setdefault(f['product__default_line_id'], {})[f['week_start_date']] = f['total_demand']
+    return demand
+
+
+def _sum_demand_by_client_and_week(product_ids, week_start, week_end) -> dict:
+    """
+    Weekly demand of every client in one aggregation grouped by client, read
+    from the same sources as _sum_demand_by_week.
+    
+    Returns:
+        Dict mapping client_id -> {week_start_date -> total_demand}
+    """
+    if not product_ids:
+        return {}
+    snapshot = _forecast_snapshot()
+    if snapshot is not None:
+        return snapshot.weekly_demand_by_client(product_ids, week_start, week_end)
+    
+    cutoff = _get_archive_cutoff()
+    if cutoff is None or week_start > cutoff:
+        return _sum_live_demand_by_client_and_week(product_ids, week_start, week_end)
+    
+    demand = sum_archived_demand_by_client_and_week(product_ids, week_start, min(week_end, cutoff))
+    if week_end > cutoff:
+        live = _sum_live_demand_by_client_and_week(product_ids, cutoff + timedelta(days=1), week_end)
+        for client_id, client_demand in live.items():
+            demand.setdefault(client_id, {}).update(client_demand)
+    return demand
+
+
+def _sum_live_demand_by_client_and_week(product_ids, week_start, week_end) -> dict:
+    """
+    _sum_live_demand_by_week grouped by client (demand store, else one ORM query)
+    
+    Returns:
+        Dict mapping client_id -> {week_start_date -> total_demand}
+    """
+    store = _get_demand_store()
+    if store is not None:
+        return store.weekly_demand_by_client(product_ids, week_start, week_end)
+    
+    forecasts = DemandForecast.objects.filter(
+        product_id__in=product_ids,
+        week_start_date__gte=week_start,
+        week_start_date__lte=week_end
+    ).values(
+        'client_id', 'week_start_date'
+    ).annotate(
+        total_demand=Sum('forecast_quantity')
+    ).order_by()
+    
+    demand = {}
+    for f in forecasts:
+        demand.setdefault(f['client_id'], {})[f['week_start_date']] = f['total_demand']
+    return demand
+
+
+def _run_loads(loads: dict, concurrent: bool = False) -> dict:
+    """
+    Run independent data loads of a simulation, on a thread pool when concurrent.
+    Worker threads use their own database connections, closed once their load is done,
+    and inherit the caller's context (database routing, see routers.simulation_reads).
+    
+    Args:
+        loads: Dict mapping key -> callable without arguments
+        concurrent: Run the loads at the same time instead of one after the other
+    
+    Returns:
+        Dict mapping key -> result of the callable
+    """
+    if not concurrent or len(loads) < 2:
+        return {key: load() for key, load in loads.items()}
+    
+    # Per-request lookups shared by most loads are done once, before fanning out
+    _get_product_index()
+    _get_demand_store()
+    
+    def run(load):
+        try:
+            return load()
+        finally:
+            connections.close_all()
+    
+    with ThreadPoolExecutor(max_workers=min(len(loads), MAX_CONCURRENT_LOADS)) as executor:
+        futures = {key: executor.submit(copy_context().run, run, load) for key, load in loads.items()}
+        return {key: future.result() for key, future in futures.items()}
 
 
 def get_week_start(date):
@@ -60,9 +381,10 @@ def _get_lines_with_configs(line_ids: list, start_date=None, end_date=None) -> d
     Batch load production lines with their configurations and overrides.
     Returns a dict mapping line_id -> line object with prefetched data.
     """
+    line_cache = _caches().lines
     cache_key = (tuple(sorted(line_ids)), start_date, end_date)
-    if cache_key in _line_cache:
-        return _line_cache[cache_key]
+    if cache_key in line_cache:
+        return line_cache[cache_key]
     
     # Build override filter if date range provided
     override_filter = Q(is_active=True)
@@ -84,18 +406,19 @@ def _get_lines_with_configs(line_ids: list, start_date=None, end_date=None) -> d
     )
     
     result = {line.id: line for line in lines}
-    _line_cache[cache_key] = result
+    line_cache[cache_key] = result
     return result
 
 
 def _get_shift_config(shift_config_id: int) -> Optional[ShiftConfiguration]:
     """Get shift config from cache or database"""
-    if shift_config_id in _shift_config_cache:
-        return _shift_config_cache[shift_config_id]
+    shift_config_cache = _caches().shift_configs
+    if shift_config_id in shift_config_cache:
+        return shift_config_cache[shift_config_id]
     
     try:
         config = ShiftConfiguration.objects.get(id=shift_config_id)
-        _shift_config_cache[shift_config_id] = config
+        shift_config_cache[shift_config_id] = config
         return config
     except ShiftConfiguration.DoesNotExist:
         return None
@@ -103,12 +426,13 @@ def _get_shift_config(shift_config_id: int) -> Optional[ShiftConfiguration]:
 
 def _get_override_by_id(override_id: int) -> Optional[LineConfigOverride]:
     """Get override config from cache or database"""
-    if override_id in _override_cache:
-        return _override_cache[override_id]
+    override_cache = _caches().overrides
+    if override_id in override_cache:
+        return override_cache[override_id]
     
     try:
         override = LineConfigOverride.objects.get(id=override_id)
-        _override_cache[override_id] = override
+        override_cache[override_id] = override
         return override
     except LineConfigOverride.DoesNotExist:
         return None
@@ -164,21 +488,134 @@ def _get_product_ids_for_lines(line_ids: list) -> Set[int]:
     Only products with default_line set to one of the selected lines are included.
     Uses caching to avoid repeated queries.
     """
+    product_ids_cache = _caches().product_ids
     cache_key = tuple(sorted(line_ids))
-    if cache_key in _product_ids_cache:
-        return _product_ids_cache[cache_key]
+    if cache_key in product_ids_cache:
+        return product_ids_cache[cache_key]
     
     # Only get products where the selected line is their DEFAULT line
-    default_products = set(Product.objects.filter(
-        default_line_id__in=line_ids,
-        is_active=True
-    ).values_list('id', flat=True))
-    
-    result = default_products
-    _product_ids_cache[cache_key] = result
+    index = _get_product_index()
+    result = index.ids(index.lines(line_ids))
+    product_ids_cache[cache_key] = result
     return result
 
 
+def resolve_codes(model, codes: list) -> tuple:
+    """
+    Resolve client or product codes to model instances in a single query.
+    Matching is case-insensitive and uses the Upper(code) index.
+    
+    Args:
+        model: Client or Product
+        codes: List of codes as typed by the user (duplicates are ignored)
+    
+    Returns:
+        (resolved, not_found) where resolved maps each upper-cased code to its
+        instance (in request order) and not_found lists the unmatched codes
+    """
+    requested = {}
+    for code in codes or []:
+        key = code.upper()
+        if key and key not in requested:
+            requested[key] = code
+    
+    if not requested:
+        return {}, []
+    
+    instances = model.objects.annotate(
+        code_upper=Upper('code')
+    ).filter(code_upper__in=list(requested)).only('id', 'code', 'name').order_by()
+    found = {obj.code_upper: obj for obj in instances}
+    
+    resolved = {key: found[key] for key in requested if key in found}
+    not_found = [code for key, code in requested.items() if key not in found]
+    return resolved, not_found
+
+
+def _config_state(config) -> Optional[tuple]:
+    """Fields of a shift configuration or override that capacity depends on"""
+    if config is None:
+        return None
+    return (
+        config.shifts_per_day, config.hours_per_shift, config.days_per_week,
+        getattr(config, 'includes_saturday', getattr(config, 'include_saturday', False)),
+        getattr(config, 'includes_sunday', getattr(config, 'include_sunday', False)),
+        config.weekly_hours,
+    )
+
+
+def _override_state(override) -> Optional[tuple]:
+    """Date range, recurrence and configuration of an override"""
+    if override is None:
+        return None
+    return (
+        override.start_date, override.end_date, override.is_active,
+        override.is_recurrent, override.recurrence_weeks,
+    ) + _config_state(override)
+
+
+def _line_capacity_by_period(line, periods: list, granularity: str,
+                             shift_config_id: Optional[int], override_id: Optional[int],
+                             compute) -> dict:
+    """
+    Capacity of a single line for each period, reusing the previous run of the
+    same scenario (line, selected config or override, periods).
+    
+    When only the line's dated overrides changed since that run, just the periods
+    overlapping the old or new date range of a changed override are recomputed;
+    any change to the line itself or to its default/selected configuration
+    recomputes the whole line.
+    
+    Args:
+        line: ProductionLine with prefetched_overrides covering the periods
+        periods: Week start dates or days
+        granularity: 'week' or 'day'
+        shift_config_id: Shift config selected in the UI for this line, if any
+        override_id: Override scenario selected in the UI for this line, if any
+        compute: Callable period -> capacity of this line for that period
+    
+    Returns:
+        Dict mapping period -> capacity
+    """
+    span = timedelta(days=6 if granularity == 'week' else 0)
+    key = f'line_capacity:{granularity}:{line.id}:{shift_config_id}:{override_id}:{periods[0]}:{periods[-1]}'
+    state = (
+        line.base_capacity_per_hour, line.efficiency_factor,
+        _config_state(line.default_shift_config),
+        _config_state(_get_shift_config(shift_config_id)) if shift_config_id else None,
+        _override_state(_get_override_by_id(override_id)) if override_id else None,
+    )
+    overrides = {o.id: _override_state(o) for o in getattr(line, 'prefetched_overrides', [])}
+    
+    cached = cache.get(key)
+    if cached is None or cached['state'] != state:
+        stale = periods
+    else:
+        previous = cached['overrides']
+        changed_ranges = [
+            (override[0], override[1])
+            for override_key in overrides.keys() | previous.keys()
+            if overrides.get(override_key) != previous.get(override_key)
+            for override in (overrides.get(override_key), previous.get(override_key))
+            if override is not None
+        ]
+        stale = [
+            period for period in periods
+            if period not in cached['values'] or any(
+                start <= period + span and period <= end for start, end in changed_ranges
+            )
+        ]
+    
+    values = dict(cached['values']) if cached is not None and stale is not periods else {}
+    for period in stale:
+        values[period] = compute(period)
+    
+    if stale or cached is None:
+        cache.set(key, {'state': state, 'overrides': overrides, 'values': values},
+                  LINE_CAPACITY_CACHE_TIMEOUT)
+    return values
+
+
 def calculate_daily_capacity(line_ids: list, shift_configs: dict, for_date, 
                              lines_dict: dict = None, override_dict: dict = None) -> Decimal:
     """
@@ -277,6 +714,59 @@ def calculate_daily_capacity(line_ids: list, shift_configs: dict, for_date,
     
     return total_capacity
 
+def _capacity_by_line(line_ids: list, shift_configs: dict, periods: list, granularity: str,
+                      override_dict: dict = None) -> dict:
+    """
+    Capacity calendar of each line: the per-line values the period totals of
+    calculate_capacity_per_week/calculate_capacity_per_day are summed from.
+    Pre-loads all lines with configs once; each line is only recomputed where
+    its configuration changed (see _line_capacity_by_period).
+    
+    Args:
+        line_ids: List of production line IDs
+        shift_configs: Dict mapping line_id -> shift_config_id (manual override from UI)
+        periods: Non-empty list of week start dates or days
+        granularity: 'week' or 'day'
+        override_dict: Optional dict mapping line_id -> specific override_id to use
+    
+    Returns:
+        Dict mapping line_id -> {period -> capacity}, for the active lines in line_ids order
+    """
+    if override_dict is None:
+        override_dict = {}
+    
+    if not periods:
+        return {}
+    
+    # Pre-load all lines with configs for the entire date range
+    start_date = min(periods)
+    end_date = max(periods)
+    if granularity == 'week':
+        end_date += timedelta(days=6)  # Include the whole last week
+    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date)
+    
+    def compute(line_id, period):
+        if granularity == 'week':
+            # The middle of the week is used for override checking
+            return calculate_weekly_capacity(
+                [line_id], shift_configs, for_date=period + timedelta(days=3),
+                lines_dict=lines_dict, override_dict=override_dict
+            )
+        return calculate_daily_capacity(
+            [line_id], shift_configs, for_date=period,
+            lines_dict=lines_dict, override_dict=override_dict
+        )
+    
+    return {
+        line_id: _line_capacity_by_period(
+            lines_dict[line_id], periods, granularity,
+            shift_configs.get(line_id), override_dict.get(line_id),
+            partial(compute, line_id)
+        )
+        for line_id in line_ids if line_id in lines_dict
+    }
+
+
 def calculate_capacity_per_day(line_ids: list, shift_configs: dict, days: list, 
                                 override_dict: dict = None) -> dict:
     """
@@ -291,15 +781,10 @@ def calculate_capacity_per_day(line_ids: list, shift_configs: dict, days: list,
     if not days:
         return capacity_by_day
     
-    # Pre-load all lines with configs for the entire date range
-    start_date = min(days)
-    end_date = max(days)
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date)
+    capacity_by_line = list(_capacity_by_line(line_ids, shift_configs, days, 'day', override_dict).values())
     
     for day in days:
-        capacity = calculate_daily_capacity(line_ids, shift_configs, for_date=day, 
-                                            lines_dict=lines_dict, override_dict=override_dict)
-        capacity_by_day[day] = capacity
+        capacity_by_day[day] = sum((values[day] for values in capacity_by_line), Decimal('0'))
     
     return capacity_by_day
 
@@ -425,17 +910,10 @@ def calculate_capacity_per_week(line_ids: list, shift_configs: dict, weeks: list
     if not weeks:
         return capacity_by_week
     
-    # Pre-load all lines with configs for the entire date range
-    start_date = min(weeks)
-    end_date = max(weeks) + timedelta(days=6)  # Include the whole last week
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date)
+    capacity_by_line = list(_capacity_by_line(line_ids, shift_configs, weeks, 'week', override_dict).values())
     
     for week_start in weeks:
-        # Use the middle of the week for override checking
-        week_date = week_start + timedelta(days=3)
-        capacity = calculate_weekly_capacity(line_ids, shift_configs, for_date=week_date, 
-                                             lines_dict=lines_dict, override_dict=override_dict)
-        capacity_by_week[week_start] = capacity
+        capacity_by_week[week_start] = sum((values[week_start] for values in capacity_by_line), Decimal('0'))
     
     return capacity_by_week
 
@@ -493,70 +971,38 @@ def get_demand_for_lines(line_ids: list, week_start, week_end,
     # Get products assigned to these lines (cached)
     product_ids = _get_product_ids_for_lines(line_ids)
     
-    if not product_ids:
-        return {}
-    
-    # Build forecast query
-    forecast_filter = Q(
-        product_id__in=product_ids,
-        week_start_date__gte=week_start,
-        week_start_date__lte=week_end
-    )
-    
-    if client_id:
-        forecast_filter &= Q(client_id=client_id)
-    
+    # Restrict to a simulation category's members
     if category_id:
-        forecast_filter &= Q(product__category_id=category_id)
+        index = _get_product_index()
+        product_ids = index.ids(index.lines(line_ids) & index.category(category_id))
     
     if product_id:
-        forecast_filter &= Q(product_id=product_id)
+        product_ids = product_ids & {product_id}
     
-    # Aggregate demand by week
-    forecasts = DemandForecast.objects.filter(forecast_filter).values(
-        'week_start_date'
-    ).annotate(
-        total_demand=Sum('forecast_quantity')
-    ).order_by('week_start_date')
+    if not product_ids:
+        return {}
     
-    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+    # Aggregate demand by week
+    return _sum_demand_by_week(product_ids, week_start, week_end, client_id)
 
 
 def get_demand_for_category(category_id: int, line_ids: list, 
                             week_start, week_end,
                             product_id: Optional[int] = None) -> dict:
     """
-    Get demand forecast for a specific category on specified lines.
-    Optimized: Uses cached product IDs and filters by category.
+    Get demand forecast for a specific simulation category on specified lines.
+    Optimized: Intersects line and category bitsets of the product index.
     """
-    # Get all products for these lines
-    all_product_ids = _get_product_ids_for_lines(line_ids)
+    index = _get_product_index()
+    category_product_ids = index.ids(index.lines(line_ids) & index.category(category_id))
     
-    # Filter to only products in this category
-    category_product_ids = set(Product.objects.filter(
-        id__in=all_product_ids,
-        category_id=category_id
-    ).values_list('id', flat=True))
+    if product_id:
+        category_product_ids &= {product_id}
     
     if not category_product_ids:
         return {}
     
-    forecast_filter = Q(
-        product_id__in=category_product_ids,
-        week_start_date__gte=week_start,
-        week_start_date__lte=week_end
-    )
-    
-    if product_id:
-        forecast_filter &= Q(product_id=product_id)
-    
-    forecasts = DemandForecast.objects.filter(forecast_filter).values(
-        'week_start_date'
-    ).annotate(
-        total_demand=Sum('forecast_quantity')
-    ).order_by('week_start_date')
-    
-    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+    return _sum_demand_by_week(category_product_ids, week_start, week_end)
 
 
 def get_client_demand(client_id: int, line_ids: list, week_start, week_end) -> dict:
@@ -566,34 +1012,135 @@ def get_client_demand(client_id: int, line_ids: list, week_start, week_end) -> d
     if not product_ids:
         return {}
     
-    forecasts = DemandForecast.objects.filter(
-        client_id=client_id,
-        product_id__in=product_ids,
-        week_start_date__gte=week_start,
-        week_start_date__lte=week_end
-    ).values('week_start_date').annotate(
-        total_demand=Sum('forecast_quantity')
-    ).order_by('week_start_date')
-    
-    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+    return _sum_demand_by_week(product_ids, week_start, week_end, client_id)
 
 
-def apply_demand_modifications_weekly(demand_data: dict, modifications: list, 
-                                      line_ids: list, weeks: list,
-                                      global_product_ids: list = None) -> dict:
+def _combined_line_demand(get_demand, line_ids: list, start_date, end_date,
+                          client_id, category_id, product_id, product_ids: list,
+                          combine_clients: bool = False, client_ids: list = None) -> dict:
     """
-    Apply demand modifications (percentage adjustments) to weekly demand data.
-    Optimized: Uses cached product IDs.
-    
-    Args:
-        demand_data: Dict mapping week_start -> demand value
-        modifications: List of modification dicts with keys:
-            - client_id: int
-            - product_id: int (optional, if None applies to all client products)
-            - start_date: date string (YYYY-MM-DD)
-            - end_date: date string (YYYY-MM-DD)
-            - percentage: float (-100 to +infinity, e.g., -50 means reduce by 50%, +20 means increase by 20%)
-        line_ids: List of production line IDs to filter products
+    Demand of a line simulation, summed over several products and/or clients.
+    get_demand is get_demand_for_lines or get_demand_for_lines_daily.
+    """
+    if len(product_ids) > 1:
+        # Sum demand for all product_ids
+        demand_data = {}
+        for pid in product_ids:
+            if combine_clients and client_ids:
+                for cid in client_ids:
+                    product_demand = get_demand(
+                        line_ids, start_date, end_date, cid, category_id, pid
+                    )
+                    for period, val in product_demand.items():
+                        demand_data[period] = demand_data.get(period, Decimal('0')) + val
+            else:
+                product_demand = get_demand(
+                    line_ids, start_date, end_date, client_id, category_id, pid
+                )
+                for period, val in product_demand.items():
+                    demand_data[period] = demand_data.get(period, Decimal('0')) + val
+        return demand_data
+    if combine_clients and client_ids:
+        # Sum demand for all client_ids
+        demand_data = {}
+        for cid in client_ids:
+            client_demand = get_demand(
+                line_ids, start_date, end_date, cid, category_id, product_id
+            )
+            for period, val in client_demand.items():
+                demand_data[period] = demand_data.get(period, Decimal('0')) + val
+        return demand_data
+    return get_demand(
+        line_ids, start_date, end_date,
+        client_id, category_id, product_id
+    )
+
+
+def _modification_product_ids(line_ids: list, global_product_ids: list = None) -> Set[int]:
+    """Products a line simulation's demand modifications may touch"""
+    # Get products for the lines (cached)
+    valid_product_ids = _get_product_ids_for_lines(line_ids)
+    
+    # If global product filter is applied, restrict to those products
+    if global_product_ids:
+        index = _get_product_index()
+        valid_product_ids = index.ids(index.lines(line_ids) & index.products(global_product_ids))
+    return valid_product_ids
+
+
+def _modification_dates(mod: dict) -> tuple:
+    """(start_date, end_date) of a demand modification, parsing string dates"""
+    mod_start = mod.get('start_date')
+    mod_end = mod.get('end_date')
+    if isinstance(mod_start, str):
+        mod_start = datetime.strptime(mod_start, '%Y-%m-%d').date()
+    if isinstance(mod_end, str):
+        mod_end = datetime.strptime(mod_end, '%Y-%m-%d').date()
+    return mod_start, mod_end
+
+
+def _modification_totals(mod: dict, product_ids) -> dict:
+    """
+    Weekly forecast totals a demand modification applies to.
+    A modification targets its product_id, or all of product_ids when it has none.
+    
+    Returns:
+        Dict mapping week_start_date -> total forecast of the targeted client/products
+    """
+    mod_start, mod_end = _modification_dates(mod)
+    
+    # Weeks overlapping the modification period (archived weeks included)
+    return _sum_demand_by_week(
+        [mod['product_id']] if mod.get('product_id') else product_ids,
+        get_week_start(mod_start), mod_end, mod['client_id']
+    )
+
+
+def _modification_totals_by_line(mod: dict, product_lines: dict) -> dict:
+    """
+    _modification_totals grouped by the products' default line (one aggregation)
+    
+    Args:
+        mod: Demand modification
+        product_lines: Dict mapping product_id -> default line ID of the targeted products
+    
+    Returns:
+        Dict mapping line_id -> {week_start_date -> total forecast of the targeted client/products}
+    """
+    mod_start, mod_end = _modification_dates(mod)
+    if mod.get('product_id'):
+        product_lines = {mod['product_id']: product_lines.get(mod['product_id'])}
+    return _sum_demand_by_line_and_week(
+        product_lines, get_week_start(mod_start), mod_end, mod['client_id']
+    )
+
+
+def _merge_line_demand(demand_by_line: dict) -> dict:
+    """Sum per-line {period -> demand} dicts into one {period -> demand} dict"""
+    demand_data = {}
+    for line_demand in demand_by_line.values():
+        for period, value in line_demand.items():
+            demand_data[period] = demand_data.get(period, Decimal('0')) + value
+    return demand_data
+
+
+def apply_demand_modifications_weekly(demand_data: dict, modifications: list, 
+                                      line_ids: list, weeks: list,
+                                      global_product_ids: list = None,
+                                      modification_totals: list = None) -> dict:
+    """
+    Apply demand modifications (percentage adjustments) to weekly demand data.
+    Optimized: Uses cached product IDs.
+    
+    Args:
+        demand_data: Dict mapping week_start -> demand value
+        modifications: List of modification dicts with keys:
+            - client_id: int
+            - product_id: int (optional, if None applies to all client products)
+            - start_date: date string (YYYY-MM-DD)
+            - end_date: date string (YYYY-MM-DD)
+            - percentage: float (-100 to +infinity, e.g., -50 means reduce by 50%, +20 means increase by 20%)
+        line_ids: List of production line IDs to filter products
         weeks: List of week start dates
         global_product_ids: Optional list of product IDs to restrict modifications to (from product filter)
     
@@ -603,61 +1150,30 @@ def apply_demand_modifications_weekly(demand_data: dict, modifications: list,
     if not modifications:
         return demand_data
     
-    # Get products for the lines (cached)
-    valid_product_ids = _get_product_ids_for_lines(line_ids)
-    
-    # If global product filter is applied, restrict to those products
-    if global_product_ids:
-        valid_product_ids = set(valid_product_ids) & set(global_product_ids)
+    if modification_totals is None:
+        valid_product_ids = _modification_product_ids(line_ids, global_product_ids)
     
     weeks_set = set(weeks)
     
-    for mod in modifications:
-        client_id = mod.get('client_id')
-        product_id = mod.get('product_id')  # Can be None for all client products
-        mod_start = mod.get('start_date')
-        mod_end = mod.get('end_date')
+    for mod_index, mod in enumerate(modifications):
         percentage = Decimal(str(mod.get('percentage', 0)))
         
-        # Parse dates if they're strings
-        if isinstance(mod_start, str):
-            mod_start = datetime.strptime(mod_start, '%Y-%m-%d').date()
-        if isinstance(mod_end, str):
-            mod_end = datetime.strptime(mod_end, '%Y-%m-%d').date()
-        
         # Calculate the modification factor (percentage/100)
         # e.g., -100% -> factor = -1 (remove all), +50% -> factor = 0.5 (add 50%)
         factor = percentage / Decimal('100')
         
-        # Get affected forecasts for this client/product within the modification date range
-        # First, find which weeks overlap with the modification period
-        mod_start_week = get_week_start(mod_start)
-        
-        forecast_filter = Q(
-            client_id=client_id,
-            week_start_date__gte=mod_start_week,
-            week_start_date__lte=mod_end
-        )
-        
-        if product_id:
-            forecast_filter &= Q(product_id=product_id)
+        # Weekly forecast totals the modification applies to (possibly preloaded)
+        if modification_totals is not None:
+            totals = modification_totals[mod_index]
         else:
-            # Only products valid for these lines
-            forecast_filter &= Q(product_id__in=valid_product_ids)
-        
-        affected_forecasts = DemandForecast.objects.filter(forecast_filter).values(
-            'week_start_date'
-        ).annotate(
-            total_demand=Sum('forecast_quantity')
-        )
+            totals = _modification_totals(mod, valid_product_ids)
         
         # Apply modification to demand_data
-        for forecast in affected_forecasts:
-            week_start = forecast['week_start_date']
+        for week_start, total_demand in totals.items():
             # Only process weeks that are in our simulation range
             if week_start in weeks_set:
                 # Calculate modification amount
-                modification_amount = forecast['total_demand'] * factor
+                modification_amount = total_demand * factor
                 
                 # Initialize the week if it doesn't exist in demand_data
                 if week_start not in demand_data:
@@ -673,7 +1189,8 @@ def apply_demand_modifications_weekly(demand_data: dict, modifications: list,
 
 def apply_demand_modifications_daily(demand_data: dict, modifications: list,
                                      line_ids: list, days: list,
-                                     global_product_ids: list = None) -> dict:
+                                     global_product_ids: list = None,
+                                     modification_totals: list = None) -> dict:
     """
     Apply demand modifications (percentage adjustments) to daily demand data.
     Optimized: Uses cached product IDs.
@@ -691,16 +1208,10 @@ def apply_demand_modifications_daily(demand_data: dict, modifications: list,
     if not modifications:
         return demand_data
     
-    # Get products for the lines (cached)
-    valid_product_ids = _get_product_ids_for_lines(line_ids)
+    if modification_totals is None:
+        valid_product_ids = _modification_product_ids(line_ids, global_product_ids)
     
-    # If global product filter is applied, restrict to those products
-    if global_product_ids:
-        valid_product_ids = set(valid_product_ids) & set(global_product_ids)
-    
-    for mod in modifications:
-        client_id = mod.get('client_id')
-        product_id = mod.get('product_id')
+    for mod_index, mod in enumerate(modifications):
         mod_start = mod.get('start_date')
         mod_end = mod.get('end_date')
         percentage = Decimal(str(mod.get('percentage', 0)))
@@ -713,28 +1224,15 @@ def apply_demand_modifications_daily(demand_data: dict, modifications: list,
         
         factor = percentage / Decimal('100')
         
-        # Get affected weekly forecasts
-        forecast_filter = Q(
-            client_id=client_id,
-            week_start_date__gte=get_week_start(mod_start),
-            week_start_date__lte=mod_end
-        )
-        
-        if product_id:
-            forecast_filter &= Q(product_id=product_id)
+        # Weekly forecast totals the modification applies to (possibly preloaded)
+        if modification_totals is not None:
+            totals = modification_totals[mod_index]
         else:
-            forecast_filter &= Q(product_id__in=valid_product_ids)
-        
-        affected_forecasts = DemandForecast.objects.filter(forecast_filter).values(
-            'week_start_date'
-        ).annotate(
-            total_demand=Sum('forecast_quantity')
-        )
+            totals = _modification_totals(mod, valid_product_ids)
         
         # Distribute weekly modification to daily
-        for forecast in affected_forecasts:
-            week_start = forecast['week_start_date']
-            weekly_modification = forecast['total_demand'] * factor
+        for week_start, total_demand in totals.items():
+            weekly_modification = total_demand * factor
             daily_modification = weekly_modification / Decimal('5')  # Distribute to 5 working days
             
             # Apply to Mon-Fri of that week
@@ -748,6 +1246,552 @@ def apply_demand_modifications_daily(demand_data: dict, modifications: list,
     return demand_data
 
 
+def _line_demand_daily_sql(line_ids: list, start_date, end_date, client_ids: list,
+                           category_id: Optional[int], product_ids: list,
+                           modifications: list) -> dict:
+    """
+    Daily demand of a line simulation with demand modifications applied,
+    computed by the database in one query (see sql_demand.daily_demand_rows).
+    Same result as _combined_line_demand followed by apply_demand_modifications_daily.
+    
+    Returns:
+        Dict mapping date -> daily_demand
+    """
+    base_product_ids = _get_product_ids_for_lines(line_ids)
+    if category_id:
+        index = _get_product_index()
+        base_product_ids = index.ids(index.lines(line_ids) & index.category(category_id))
+    if product_ids:
+        base_product_ids = base_product_ids & set(product_ids)
+    if not base_product_ids:
+        return {}
+    
+    windows = []
+    if modifications:
+        valid_product_ids = _modification_product_ids(line_ids, product_ids if product_ids else None)
+        for mod in modifications:
+            mod_start, mod_end = _modification_dates(mod)
+            windows.append({
+                'client_id': mod.get('client_id'),
+                'product_ids': [mod['product_id']] if mod.get('product_id') else valid_product_ids,
+                'start_date': mod_start,
+                'end_date': mod_end,
+                'factor': Decimal(str(mod.get('percentage', 0))) / Decimal('100'),
+            })
+    
+    demand_data = {}
+    for day, daily_demand, *deltas in daily_demand_rows(
+        base_product_ids, client_ids, start_date, end_date, windows
+    ):
+        # Modifications are applied in order, each clamped at zero
+        for delta in deltas:
+            if delta is not None:
+                daily_demand += delta
+                if daily_demand < 0:
+                    daily_demand = Decimal('0')
+        demand_data[day] = daily_demand
+    return demand_data
+
+
+def _demand_state_fingerprint(granularity: str, line_ids: list, start_date, end_date,
+                              client_ids: list, category_id: Optional[int],
+                              product_ids: list, forecast_version_id: Optional[int] = None) -> tuple:
+    """Everything the (unmodified) demand of a line simulation depends on"""
+    versions = DataVersion.get_versions(['demandforecast', 'product', 'simulationcategory'])
+    return (
+        granularity, tuple(line_ids), start_date, end_date, tuple(client_ids),
+        category_id, tuple(product_ids), tuple(sorted(versions.items())), forecast_version_id,
+    )
+
+
+def _save_demand_state(fingerprint: tuple, demand_data: dict, overlay_demand: dict,
+                       modifications: list) -> str:
+    """Keep a result's demand so later modifications can be applied as a delta"""
+    token = uuid.uuid4().hex
+    cache.set(f'demand_state:{token}', {
+        'fingerprint': fingerprint,
+        'demand_data': demand_data,
+        'overlay_demand': overlay_demand,
+        'modifications': modifications,
+    }, DEMAND_STATE_TIMEOUT)
+    return token
+
+
+def _load_demand_state(token: str, fingerprint: tuple) -> Optional[dict]:
+    """State saved under token, None if expired or computed for other inputs/data"""
+    state = cache.get(f'demand_state:{token}')
+    if state is None or state['fingerprint'] != fingerprint:
+        return None
+    return state
+
+
+def _has_override_on(line_ids: list, lines_dict: dict, for_date) -> bool:
+    """Whether any of the lines runs on a LineConfigOverride on the given date (pre-loaded data)"""
+    for line_id in line_ids:
+        line = lines_dict.get(line_id)
+        if line:
+            config = _get_config_for_date_from_prefetched(
+                line, for_date, getattr(line, 'prefetched_overrides', [])
+            )
+            if config and config['type'] == 'override':
+                return True
+    return False
+
+
+def _iter_period_values(periods: list, demand_data: dict, capacity_by_period: dict,
+                       line_ids: list, lines_dict: dict, override_offset: int = 0,
+                       flag_missing_capacity: bool = False):
+    """
+    Yield (period, demand, capacity, utilization, over_capacity, has_override)
+    tuples, computed one period at a time.
+    
+    Args:
+        periods: Week start dates or days
+        demand_data: Dict mapping period -> demand
+        capacity_by_period: Dict mapping period -> capacity
+        line_ids: Lines used for the override check
+        lines_dict: Pre-loaded lines (see _get_lines_with_configs)
+        override_offset: Days added to the period start for the override check (3 = mid-week)
+        flag_missing_capacity: Set utilization to 999 when there is demand but no capacity
+    """
+    for period in periods:
+        demand = demand_data.get(period, Decimal('0'))
+        capacity = capacity_by_period.get(period, Decimal('0'))
+        
+        if capacity > 0:
+            utilization = (demand / capacity) * 100
+        elif flag_missing_capacity and demand != 0:
+            utilization = Decimal('999')  # No capacity but has demand
+        else:
+            utilization = Decimal('0')
+        
+        yield (period, demand, capacity, utilization, utilization > 100,
+               _has_override_on(line_ids, lines_dict, period + timedelta(days=override_offset)))
+
+
+def _build_period_series(periods: list, demand_data: dict, capacity_by_period: dict,
+                         line_ids: list, lines_dict: dict, override_offset: int = 0,
+                         flag_missing_capacity: bool = False) -> dict:
+    """
+    Compute the simulation series as parallel lists, one entry per period.
+    Row (data_points) and columnar outputs are both built from these lists.
+    Arguments are those of _iter_period_values.
+    
+    Returns:
+        Dict of lists: period, demand, capacity, utilization, over_capacity, has_override
+    """
+    series = {
+        'period': periods,
+        'demand': [],
+        'capacity': [],
+        'utilization': [],
+        'over_capacity': [],
+        'has_override': [],
+        'flag_missing_capacity': flag_missing_capacity,
+    }
+    
+    for _, demand, capacity, utilization, over_capacity, has_override in _iter_period_values(
+            periods, demand_data, capacity_by_period, line_ids, lines_dict,
+            override_offset, flag_missing_capacity):
+        series['demand'].append(demand)
+        series['capacity'].append(capacity)
+        series['utilization'].append(utilization)
+        series['over_capacity'].append(over_capacity)
+        series['has_override'].append(has_override)
+    
+    return series
+
+
+def _iter_series(series: dict):
+    """Iterate (period, demand, capacity, utilization, over_capacity, has_override) tuples"""
+    return zip(series['period'], series['demand'], series['capacity'],
+               series['utilization'], series['over_capacity'], series['has_override'])
+
+
+def _summarize_series(series: dict) -> dict:
+    """Summary stats of a period series (see _summarize_values)"""
+    return _summarize_values(_iter_series(series), series['flag_missing_capacity'])
+
+
+def _summarize_values(values, flag_missing_capacity: bool = False) -> dict:
+    """
+    Summary stats in a single pass over (period, demand, capacity, utilization,
+    over_capacity, has_override) tuples. Periods flagged 999% are excluded from avg/peak.
+    """
+    utilization_sum = 0
+    utilization_count = 0
+    peak_utilization = 0
+    over_capacity_periods = 0
+    total_capacity = Decimal('0')
+    total_demand = Decimal('0')
+    for _, demand, capacity, utilization, over_capacity, _ in values:
+        total_demand += demand
+        total_capacity += capacity
+        over_capacity_periods += over_capacity
+        utilization = float(utilization)
+        if flag_missing_capacity and utilization >= 999:
+            continue
+        utilization_sum += utilization
+        peak_utilization = utilization if not utilization_count else max(peak_utilization, utilization)
+        utilization_count += 1
+    
+    avg_utilization = utilization_sum / utilization_count if utilization_count else 0
+    
+    return {
+        'average_utilization': round(avg_utilization, 1),
+        'peak_utilization': round(peak_utilization, 1),
+        'over_capacity_periods': over_capacity_periods,
+        'total_capacity': total_capacity,
+        'total_demand': total_demand,
+    }
+
+
+def _period_label(period, granularity: str) -> str:
+    """Chart label of a period: 'W5/2026' for weeks, ISO date for days"""
+    if granularity == 'week':
+        return f"W{period.isocalendar()[1]}/{period.year}"
+    return period.strftime('%Y-%m-%d')
+
+
+def _weekly_data_points(series: dict, overlay_demand: dict = None) -> list:
+    """Weekly data points (row format)"""
+    data_points = []
+    for week_start, demand, capacity, utilization, over_capacity, has_override in _iter_series(series):
+        data_point = {
+            'date': _period_label(week_start, 'week'),
+            'week_start': week_start,
+            'demand': demand,
+            'capacity': capacity,
+            'utilization_percent': round(utilization, 1),
+            'over_capacity': over_capacity,
+            'has_override': has_override
+        }
+        
+        if overlay_demand:
+            data_point['overlay_demand'] = overlay_demand.get(week_start, Decimal('0'))
+        
+        data_points.append(data_point)
+    return data_points
+
+
+def _iter_line_daily_points(values, overlay_demand: dict = None):
+    """Yield daily data points of a line simulation (row format) from period value tuples"""
+    for day, demand, capacity, utilization, over_capacity, has_override in values:
+        # Get day name for display
+        day_name = day.strftime('%a')  # Mon, Tue, etc.
+        
+        data_point = {
+            'date': day.strftime('%Y-%m-%d'),
+            'date_display': f"{day_name} {day.strftime('%d/%m')}",
+            'day': day,
+            'demand': demand,
+            'capacity': capacity,
+            'utilization_percent': round(utilization, 1) if utilization < 999 else 'N/A',
+            'over_capacity': over_capacity,
+            'has_override': has_override,
+            'is_weekend': day.weekday() >= 5
+        }
+        
+        if overlay_demand:
+            data_point['overlay_demand'] = overlay_demand.get(day, Decimal('0'))
+        
+        yield data_point
+
+
+def _iter_category_daily_points(values):
+    """Yield daily data points of a category simulation (row format) from period value tuples"""
+    for day, demand, capacity, utilization, over_capacity, has_override in values:
+        yield {
+            'date': day.strftime('%Y-%m-%d'),
+            'day_date': day,
+            'demand': demand,
+            'capacity': capacity,
+            'utilization_percent': round(utilization, 1),
+            'over_capacity': over_capacity,
+            'has_override': has_override,
+            'day_name': day.strftime('%A')
+        }
+
+
+def _series_columns(series: dict, granularity: str, overlay_demand: dict = None) -> dict:
+    """
+    Columnar format: one array per field instead of one dict per period.
+    Quantities are sent as floats; utilization is null where the row format shows 'N/A'.
+    """
+    flag_missing_capacity = series['flag_missing_capacity']
+    columns = {
+        'date': [_period_label(period, granularity) for period in series['period']],
+        'period_start': series['period'],
+        'demand': [float(value) for value in series['demand']],
+        'capacity': [float(value) for value in series['capacity']],
+        'utilization_percent': [
+            None if flag_missing_capacity and utilization >= 999 else float(round(utilization, 1))
+            for utilization in series['utilization']
+        ],
+        'over_capacity': series['over_capacity'],
+        'has_override': series['has_override'],
+    }
+    if granularity == 'day':
+        columns['is_weekend'] = [period.weekday() >= 5 for period in series['period']]
+    for name, values in (series.get('buckets') or {}).items():
+        columns[name] = [float(value) if isinstance(value, Decimal) else value for value in values]
+    if overlay_demand:
+        columns['overlay_demand'] = [
+            float(overlay_demand.get(period, Decimal('0'))) for period in series['period']
+        ]
+    return columns
+
+
+def _client_overlay(client, client_demand: dict, periods: list, granularity: str,
+                    response_format: str = 'rows', groups: list = None) -> dict:
+    """
+    Overlay curve of one client: data points, or in columnar format a demand array
+    aligned with the result's columns. total_demand is computed on full resolution.
+    """
+    demands = [client_demand.get(period, Decimal('0')) for period in periods]
+    total_demand = sum(demands)
+    if groups:
+        periods = [periods[start] for start, _ in groups]
+        demands = _downsample_values(demands, groups)
+    
+    overlay = {
+        'client_name': client.name,
+        'client_id': client.id,
+    }
+    if response_format == 'columnar':
+        overlay['demand'] = [float(demand) for demand in demands]
+    else:
+        period_key = 'week_start' if granularity == 'week' else 'day'
+        overlay['data_points'] = [{
+            'date': _period_label(period, granularity),
+            period_key: period,
+            'demand': demand
+        } for period, demand in zip(periods, demands)]
+    overlay['total_demand'] = total_demand
+    return overlay
+
+
+def _iter_client_overlay_points_daily(overlay: dict, client_id: int, line_ids: list,
+                                      start_date, end_date, days: list, groups: list = None,
+                                      client_demand: dict = None,
+                                      caches: Optional[_RequestCaches] = None):
+    """
+    Yield daily overlay data points for a client; sets overlay['total_demand'] at the end.
+    The client's demand is loaded on first iteration unless already given, with the
+    caches (forecast version) of the request that created the generator.
+    """
+    if client_demand is None:
+        # Consumed after run_line_simulation returned, possibly in another context,
+        # so the read routing and the request's caches are set again
+        with simulation_reads(), _request_context(caches or _caches()):
+            client_demand = get_client_demand_daily(client_id, line_ids, start_date, end_date)
+    demands = [client_demand.get(day, Decimal('0')) for day in days]
+    total_demand = sum(demands)
+    if groups:
+        days = [days[start] for start, _ in groups]
+        demands = _downsample_values(demands, groups)
+    for day, demand in zip(days, demands):
+        yield {
+            'date': day.strftime('%Y-%m-%d'),
+            'day': day,
+            'demand': demand
+        }
+    overlay['total_demand'] = total_demand
+
+
+def _lttb_indices(values: list, max_points: int) -> list:
+    """
+    Largest-Triangle-Three-Buckets: indices of the max_points values that best
+    preserve the visual shape of the series (first and last are always kept).
+    """
+    count = len(values)
+    if max_points >= count:
+        return list(range(count))
+    if max_points < 3:
+        return [0, count - 1][:max_points]
+    
+    bucket_size = (count - 2) / (max_points - 2)
+    indices = [0]
+    previous = 0
+    for bucket in range(max_points - 2):
+        # Average point of the next bucket
+        next_start = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        next_x = (next_start + next_end - 1) / 2
+        next_y = sum(values[next_start:next_end]) / (next_end - next_start)
+        
+        # Point of the current bucket forming the largest triangle
+        best_index, best_area = None, -1
+        for index in range(int(bucket * bucket_size) + 1, int((bucket + 1) * bucket_size) + 1):
+            area = abs(
+                (previous - next_x) * (values[index] - values[previous])
+                - (previous - index) * (next_y - values[previous])
+            )
+            if area > best_area:
+                best_index, best_area = index, area
+        indices.append(best_index)
+        previous = best_index
+    indices.append(count - 1)
+    return indices
+
+
+def _downsample_values(values: list, groups: list) -> list:
+    """Mean of each (start, stop) group of values"""
+    return [sum(values[start:stop], Decimal('0')) / (stop - start) for start, stop in groups]
+
+
+def _downsample_series(series: dict, max_points: Optional[int], bucket: str = 'minmax',
+                       groups: list = None):
+    """
+    Reduce a period series to at most max_points for charting.
+    'minmax' averages consecutive periods into buckets and keeps each bucket's
+    min/max; 'lttb' keeps the actual periods picked by LTTB on utilization.
+    Summary stats must be computed on the full series beforehand.
+    Passing the groups of another series aligns this one with it.
+    
+    Returns:
+        (series, groups) - groups is None when the series already fits, otherwise the
+        (start, stop) index range behind each output point, used to align overlays
+    """
+    count = len(series['period'])
+    if groups is None:
+        if not max_points or count <= max_points:
+            return series, None
+        
+        if bucket == 'lttb':
+            utilizations = [float(u) for u in series['utilization']]
+            groups = [(index, index + 1) for index in _lttb_indices(utilizations, max_points)]
+        else:
+            bounds = [round(k * count / max_points) for k in range(max_points + 1)]
+            groups = [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+    
+    flag_missing_capacity = series['flag_missing_capacity']
+    downsampled = {
+        'period': [series['period'][start] for start, _ in groups],
+        'demand': _downsample_values(series['demand'], groups),
+        'capacity': _downsample_values(series['capacity'], groups),
+        'utilization': [],
+        'over_capacity': [any(series['over_capacity'][start:stop]) for start, stop in groups],
+        'has_override': [any(series['has_override'][start:stop]) for start, stop in groups],
+        'flag_missing_capacity': flag_missing_capacity,
+    }
+    if bucket != 'lttb':
+        downsampled['buckets'] = {
+            'period_end': [], 'demand_min': [], 'demand_max': [],
+            'utilization_min': [], 'utilization_max': [],
+        }
+    
+    for (start, stop), demand, capacity in zip(groups, downsampled['demand'], downsampled['capacity']):
+        if stop - start == 1:
+            utilization = series['utilization'][start]
+        elif capacity > 0:
+            # Bucket utilization is total demand over total capacity
+            utilization = (demand / capacity) * 100
+        elif flag_missing_capacity and demand != 0:
+            utilization = Decimal('999')
+        else:
+            utilization = Decimal('0')
+        downsampled['utilization'].append(utilization)
+        
+        if bucket != 'lttb':
+            utilizations = [
+                u for u in series['utilization'][start:stop]
+                if not (flag_missing_capacity and u >= 999)
+            ] or [utilization]
+            buckets = downsampled['buckets']
+            buckets['period_end'].append(series['period'][stop - 1])
+            buckets['demand_min'].append(min(series['demand'][start:stop]))
+            buckets['demand_max'].append(max(series['demand'][start:stop]))
+            buckets['utilization_min'].append(round(min(utilizations), 1))
+            buckets['utilization_max'].append(round(max(utilizations), 1))
+    
+    return downsampled, groups
+
+
+def _downsample_by_period(values_by_period: dict, periods: list, groups: list) -> dict:
+    """Downsample a period -> value dict onto the first period of each group"""
+    values = [values_by_period.get(period, Decimal('0')) for period in periods]
+    return {
+        periods[start]: value
+        for (start, _), value in zip(groups, _downsample_values(values, groups))
+    }
+
+
+def _build_ahead_result(series: dict, groups: list, response_format: str = 'rows',
+                        max_stock_weeks: Optional[int] = None,
+                        shelf_life_weeks: Optional[int] = None) -> dict:
+    """
+    Build-ahead plan of a full-resolution weekly series (see
+    build_ahead.smooth_build_ahead). Totals use every week; the weekly plan is
+    aligned with the result's data points or columns (downsampled with groups).
+    """
+    plan = smooth_build_ahead(series['demand'], series['capacity'], max_stock_weeks, shelf_life_weeks)
+    result = {
+        'max_stock_weeks': max_stock_weeks,
+        'shelf_life_weeks': shelf_life_weeks,
+        'over_capacity_periods': sum(1 for shortfall in plan['shortfall'] if shortfall > 0),
+        'resolved_periods': sum(
+            1 for over_capacity, shortfall in zip(series['over_capacity'], plan['shortfall'])
+            if over_capacity and not shortfall
+        ),
+        'total_built_ahead': sum(plan['built_ahead'], Decimal('0')),
+        'total_shortfall': sum(plan['shortfall'], Decimal('0')),
+        'peak_inventory': max(plan['inventory'], default=Decimal('0')),
+    }
+    
+    weeks = series['period']
+    if groups:
+        weeks = [weeks[start] for start, _ in groups]
+        plan = {name: _downsample_values(values, groups) for name, values in plan.items()}
+    
+    if response_format == 'columnar':
+        result['columns'] = {name: [float(value) for value in values] for name, values in plan.items()}
+    else:
+        result['data_points'] = [{
+            'date': _period_label(week_start, 'week'),
+            'week_start': week_start,
+            'production': production,
+            'built_ahead': built_ahead,
+            'inventory': inventory,
+            'shortfall': shortfall,
+        } for week_start, production, built_ahead, inventory, shortfall in zip(
+            weeks, plan['production'], plan['built_ahead'], plan['inventory'], plan['shortfall']
+        )]
+    return result
+
+
+def _attach_bucket_fields(data_points, series: dict):
+    """Add the bucket fields (period_end, min/max) of a downsampled series to its data points"""
+    buckets = series.get('buckets')
+    if not buckets:
+        yield from data_points
+        return
+    names = list(buckets)
+    for data_point, values in zip(data_points, zip(*buckets.values())):
+        data_point.update(zip(names, values))
+        yield data_point
+
+
+def _streams_lazily(stream: bool, response_format: str, max_points: Optional[int], periods: list) -> bool:
+    """
+    Whether streamed data points can be computed while they are encoded instead of
+    from a built series: row format only, and only when there is nothing to downsample.
+    Summary stats then take a separate pass over the period values.
+    """
+    return stream and response_format != 'columnar' and (not max_points or len(periods) <= max_points)
+
+
+def _materialize_data_points(result: dict) -> dict:
+    """Consume data point generators (main and overlays) into lists, in place"""
+    if 'data_points' in result:
+        result['data_points'] = list(result['data_points'])
+    for overlay in (result.get('client_overlays') or {}).values():
+        if 'data_points' in overlay:
+            overlay['data_points'] = list(overlay['data_points'])
+    return result
+
+
+@reads_from_read_database
 def run_line_simulation(line_ids: list, shift_configs: list,
                         start_date, end_date,
                         client_codes: list = None,
@@ -756,7 +1800,18 @@ def run_line_simulation(line_ids: list, shift_configs: list,
                         product_codes: list = None,
                         overlay_client_codes: list = None,
                         granularity: str = 'week',
-                        demand_modifications: list = None) -> dict:
+                        demand_modifications: list = None,
+                        stream: bool = False,
+                        response_format: str = 'rows',
+                        max_points: Optional[int] = None,
+                        bucket: str = 'minmax',
+                        base_token: Optional[str] = None,
+                        keep_state: bool = False,
+                        concurrent_loads: bool = False,
+                        forecast_version_id: Optional[int] = None,
+                        build_ahead: bool = False,
+                        max_stock_weeks: Optional[int] = None,
+                        shelf_life_weeks: Optional[int] = None) -> dict:
     """
     Run line simulation (Dashboard 1)
     Analyze demand vs capacity for selected lines
@@ -764,34 +1819,41 @@ def run_line_simulation(line_ids: list, shift_configs: list,
     Supports client demand overlays by code
     Supports both weekly and daily granularity
     Supports demand modifications (percentage adjustments per client/product)
+    With stream=True, daily data points are produced lazily for streamed responses
+    (computed day by day unless they are downsampled, see _streams_lazily)
+    With response_format='columnar', series are returned as parallel arrays (see _series_columns)
+    With max_points, charted series are downsampled (see _downsample_series)
+    With keep_state, the result carries a result_token; passing it back as
+    base_token applies demand_modifications on top of that result without
+    reloading base demand (see DEMAND_STATE_TIMEOUT for the cache it needs)
+    With concurrent_loads, independent data loads run on a thread pool (see _run_loads)
+    With forecast_version_id, demand is read from that ForecastVersion instead
+    of the current forecasts
+    With build_ahead (weekly only), over-capacity weeks are pre-built in earlier
+    weeks with slack, within max_stock_weeks of cover and shelf_life_weeks
+    (see _build_ahead_result)
     """
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    if build_ahead and granularity == 'day':
+        return {'error': 'build_ahead is only available with weekly granularity'}
     if overlay_client_codes is None:
         overlay_client_codes = []
     if demand_modifications is None:
         demand_modifications = []
 
-    # Resolve product_ids from product_codes or single product_code
-    product_ids = []
-    if product_codes:
-        for code in product_codes:
-            product = Product.objects.filter(code__iexact=code).first()
-            if product:
-                product_ids.append(product.id)
-    elif product_code:
-        product = Product.objects.filter(code__iexact=product_code).first()
-        if product:
-            product_ids.append(product.id)
+    # Resolve product_ids from product_codes or single product_code (one query)
+    resolved_products, not_found_products = resolve_codes(
+        Product, product_codes or ([product_code] if product_code else [])
+    )
+    product_ids = [p.id for p in resolved_products.values()]
     
     # For backward compatibility - single product_id
     product_id = product_ids[0] if len(product_ids) == 1 else None
 
-    # Resolve client_ids from client_codes if provided
-    client_ids = []
-    if client_codes:
-        for code in client_codes:
-            client = Client.objects.filter(code__iexact=code).first()
-            if client:
-                client_ids.append(client.id)
+    # Resolve client_ids from client_codes if provided (one query)
+    resolved_clients, not_found_clients = resolve_codes(Client, client_codes)
+    client_ids = [c.id for c in resolved_clients.values()]
 
     # If multiple client_ids, combine their demand
     client_id = None
@@ -818,17 +1880,41 @@ def run_line_simulation(line_ids: list, shift_configs: list,
         else:
             config_dict[sc['line_id']] = sc.get('shift_config_id')
     
+    # Resume from a previous result: only the new modifications are applied
+    fingerprint = None
+    if keep_state or base_token:
+        fingerprint = _demand_state_fingerprint(
+            granularity, line_ids, start_date, end_date, client_ids, category_id, product_ids,
+            forecast_version_id
+        )
+    base_state = None
+    if base_token:
+        base_state = _load_demand_state(base_token, fingerprint)
+        if base_state is None:
+            return {
+                'error': 'base_token has expired or does not match this request, '
+                         'resend all demand modifications without it',
+                'stale_base_token': True,
+            }
+    
     # Get overlay data if filters are applied
     overlay_data = {}
 
     if client_ids:
         overlay_data['client_codes'] = client_codes
+    if forecast_version_id:
+        overlay_data['forecast_version_id'] = forecast_version_id
     if product_codes:
         overlay_data['product_codes'] = product_codes
     elif product_code:
         overlay_data['product_code'] = product_code
-    if demand_modifications:
-        overlay_data['demand_modifications'] = demand_modifications
+    all_modifications = (base_state['modifications'] if base_state else []) + list(demand_modifications)
+    if all_modifications:
+        overlay_data['demand_modifications'] = all_modifications
+    if not_found_products:
+        overlay_data['product_filter_warnings'] = [f"{code} (not found)" for code in not_found_products]
+    if not_found_clients:
+        overlay_data['client_filter_warnings'] = [f"{code} (not found)" for code in not_found_clients]
     
     # Process based on granularity
     if granularity == 'day':
@@ -839,7 +1925,14 @@ def run_line_simulation(line_ids: list, shift_configs: list,
             combine_clients=combine_clients, client_ids=client_ids,
             demand_modifications=demand_modifications,
             product_ids=product_ids,
-            override_dict=override_dict
+            override_dict=override_dict,
+            stream=stream,
+            response_format=response_format,
+            max_points=max_points,
+            bucket=bucket,
+            base_state=base_state,
+            fingerprint=fingerprint if keep_state else None,
+            concurrent_loads=concurrent_loads
         )
     else:
         return _run_line_simulation_weekly(
@@ -849,7 +1942,16 @@ def run_line_simulation(line_ids: list, shift_configs: list,
             combine_clients=combine_clients, client_ids=client_ids,
             demand_modifications=demand_modifications,
             product_ids=product_ids,
-            override_dict=override_dict
+            override_dict=override_dict,
+            response_format=response_format,
+            max_points=max_points,
+            bucket=bucket,
+            base_state=base_state,
+            fingerprint=fingerprint if keep_state else None,
+            concurrent_loads=concurrent_loads,
+            build_ahead=build_ahead,
+            max_stock_weeks=max_stock_weeks,
+            shelf_life_weeks=shelf_life_weeks
         )
 
 
@@ -859,165 +1961,116 @@ def _run_line_simulation_weekly(line_ids, config_dict, start_date, end_date,
                                  combine_clients=False, client_ids=None,
                                  demand_modifications=None,
                                  product_ids=None,
-                                 override_dict=None):
-    """Weekly granularity simulation. Optimized with batch loading."""
-    if product_ids is None:
-        product_ids = []
-    if override_dict is None:
-        override_dict = {}
-    
-    # Get weeks in range
-    weeks = get_weeks_in_range(start_date, end_date)
-    
-    # Pre-load all lines with configs for the entire date range
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date + timedelta(days=6))
-    
-    # Calculate capacity per week (considers overrides)
-    capacity_by_week = calculate_capacity_per_week(line_ids, config_dict, weeks, override_dict=override_dict)
-    
-    # Get demand data - handle multiple product_ids
-    if len(product_ids) > 1:
-        # Sum demand for all product_ids
-        demand_data = {}
-        for pid in product_ids:
-            if combine_clients and client_ids:
-                for cid in client_ids:
-                    product_demand = get_demand_for_lines(
-                        line_ids, start_date, end_date, cid, category_id, pid
-                    )
-                    for week, val in product_demand.items():
-                        demand_data[week] = demand_data.get(week, Decimal('0')) + val
-            else:
-                product_demand = get_demand_for_lines(
-                    line_ids, start_date, end_date, client_id, category_id, pid
-                )
-                for week, val in product_demand.items():
-                    demand_data[week] = demand_data.get(week, Decimal('0')) + val
-    elif combine_clients and client_ids:
-        # Sum demand for all client_ids
-        demand_data = {}
-        for cid in client_ids:
-            client_demand = get_demand_for_lines(
-                line_ids, start_date, end_date, cid, category_id, product_id
-            )
-            for week, val in client_demand.items():
-                demand_data[week] = demand_data.get(week, Decimal('0')) + val
-    else:
-        demand_data = get_demand_for_lines(
-            line_ids, start_date, end_date,
-            client_id, category_id, product_id
-        )
-    
-    # Apply demand modifications if any
-    if demand_modifications:
-        demand_data = apply_demand_modifications_weekly(
-            demand_data, demand_modifications, line_ids, weeks,
-            global_product_ids=product_ids if product_ids else None
-        )
-    
-    # Get overlay demand if client filter is applied
-    overlay_demand = {}
-    if client_id:
-        overlay_demand = get_client_demand(client_id, line_ids, start_date, end_date)
-    
-    # Pre-fetch all overlay clients in one query
-    client_overlays = {}
-    if overlay_client_codes:
-        # Use code__in for matching (case-sensitive, but codes should match)
-        upper_codes = [code.upper() for code in overlay_client_codes]
-        overlay_clients = Client.objects.filter(code__in=overlay_client_codes)
-        # Fallback: fetch all and filter in Python for case-insensitive match
-        if not overlay_clients.exists():
-            all_clients = Client.objects.filter(is_active=True)
-            overlay_clients = [c for c in all_clients if c.code.upper() in upper_codes]
-        overlay_client_map = {c.code.upper(): c for c in overlay_clients}
-        
-        for client_code in overlay_client_codes:
-            client = overlay_client_map.get(client_code.upper())
-            if client:
-                client_demand = get_client_demand(client.id, line_ids, start_date, end_date)
-                # Build data points for this client
-                client_data_points = []
-                for week_start in weeks:
-                    demand = client_demand.get(week_start, Decimal('0'))
-                    client_data_points.append({
-                        'date': f"W{week_start.isocalendar()[1]}/{week_start.year}",
-                        'week_start': week_start,
-                        'demand': demand
-                    })
-                client_overlays[client.code] = {
-                    'client_name': client.name,
-                    'client_id': client.id,
-                    'data_points': client_data_points,
-                    'total_demand': sum(dp['demand'] for dp in client_data_points)
-                }
-    
-    # Build data points - calculate override status once per week using pre-loaded data
-    data_points = []
-    total_demand = Decimal('0')
-    total_capacity = Decimal('0')
-    utilizations = []
-    over_capacity_count = 0
-    
-    for week_start in weeks:
-        demand = demand_data.get(week_start, Decimal('0'))
-        weekly_capacity = capacity_by_week.get(week_start, Decimal('0'))
-        
-        total_demand += demand
-        total_capacity += weekly_capacity
-        
-        if weekly_capacity > 0:
-            utilization = (demand / weekly_capacity) * 100
-        else:
-            utilization = Decimal('0')
-        
-        utilizations.append(float(utilization))
-        over_capacity = utilization > 100
-        if over_capacity:
-            over_capacity_count += 1
-        
-        # Check for overrides using pre-loaded data
-        week_date = week_start + timedelta(days=3)
-        has_override = False
-        for line_id in line_ids:
-            line = lines_dict.get(line_id)
-            if line:
-                config = _get_config_for_date_from_prefetched(
-                    line, week_date, getattr(line, 'prefetched_overrides', [])
-                )
-                if config and config['type'] == 'override':
-                    has_override = True
-                    break
-        
-        data_point = {
-            'date': f"W{week_start.isocalendar()[1]}/{week_start.year}",
-            'week_start': week_start,
-            'demand': demand,
-            'capacity': weekly_capacity,
-            'utilization_percent': round(utilization, 1),
-            'over_capacity': over_capacity,
-            'has_override': has_override
-        }
-        
-        if overlay_demand:
-            data_point['overlay_demand'] = overlay_demand.get(week_start, Decimal('0'))
-        
-        data_points.append(data_point)
+                                 override_dict=None,
+                                 response_format='rows',
+                                 max_points=None, bucket='minmax',
+                                 base_state=None, fingerprint=None,
+                                 concurrent_loads=False,
+                                 build_ahead=False, max_stock_weeks=None,
+                                 shelf_life_weeks=None):
+    """
+    Weekly granularity simulation. Optimized with batch loading.
+    With base_state (see _load_demand_state), demand_modifications are applied
+    to the saved demand instead of reloading it.
+    With build_ahead, result['build_ahead'] holds the smoothed production plan.
+    """
+    if product_ids is None:
+        product_ids = []
+    if override_dict is None:
+        override_dict = {}
     
-    # Calculate summary stats
-    avg_utilization = sum(utilizations) / len(utilizations) if utilizations else 0
-    peak_utilization = max(utilizations) if utilizations else 0
+    # Get weeks in range
+    weeks = get_weeks_in_range(start_date, end_date)
     
-    result = {
-        'granularity': 'week',
-        'average_utilization': round(avg_utilization, 1),
-        'peak_utilization': round(peak_utilization, 1),
-        'over_capacity_periods': over_capacity_count,
-        'total_capacity': total_capacity,
-        'total_demand': total_demand,
-        'data_points': data_points,
-        'overlay_data': overlay_data if overlay_data else None
+    # Pre-fetch all overlay clients in one query
+    overlay_clients = []
+    if overlay_client_codes:
+        overlay_clients = list(resolve_codes(Client, overlay_client_codes)[0].values())
+    
+    # Independent loads: line configs for the entire date range, capacity per week
+    # (considers overrides), demand, overlays and modification aggregates
+    loads = {
+        'lines': partial(_get_lines_with_configs, line_ids, start_date, end_date + timedelta(days=6)),
+        'capacity': partial(calculate_capacity_per_week, line_ids, config_dict, weeks,
+                            override_dict=override_dict),
     }
+    if base_state is None:
+        loads['demand'] = partial(
+            _combined_line_demand, get_demand_for_lines, line_ids, start_date, end_date,
+            client_id, category_id, product_id, product_ids, combine_clients, client_ids
+        )
+        if client_id:
+            loads['overlay'] = partial(get_client_demand, client_id, line_ids, start_date, end_date)
+    if demand_modifications:
+        valid_product_ids = _modification_product_ids(line_ids, product_ids if product_ids else None)
+        for mod_index, mod in enumerate(demand_modifications):
+            loads[('modification', mod_index)] = partial(_modification_totals, mod, valid_product_ids)
+    for client in overlay_clients:
+        loads[('client', client.id)] = partial(get_client_demand, client.id, line_ids, start_date, end_date)
+    loaded = _run_loads(loads, concurrent_loads)
+    lines_dict = loaded['lines']
+    capacity_by_week = loaded['capacity']
+    
+    if base_state is not None:
+        # Resume from a previous result's (already modified) demand
+        demand_data = dict(base_state['demand_data'])
+    else:
+        demand_data = loaded['demand']
+    
+    # Apply demand modifications if any
+    if demand_modifications:
+        demand_data = apply_demand_modifications_weekly(
+            demand_data, demand_modifications, line_ids, weeks,
+            global_product_ids=product_ids if product_ids else None,
+            modification_totals=[loaded[('modification', i)] for i in range(len(demand_modifications))]
+        )
+    
+    # Get overlay demand if client filter is applied
+    overlay_demand = {}
+    if base_state is not None:
+        overlay_demand = base_state['overlay_demand']
+    elif client_id:
+        overlay_demand = loaded['overlay']
+    
+    # Keep this result's demand so the next modification can be applied as a delta
+    result_token = None
+    if fingerprint is not None:
+        result_token = _save_demand_state(
+            fingerprint, demand_data, overlay_demand,
+            (base_state['modifications'] if base_state else []) + list(demand_modifications or [])
+        )
+    
+    # Per-week series - override status is checked mid-week using pre-loaded data
+    series = _build_period_series(weeks, demand_data, capacity_by_week, line_ids, lines_dict,
+                                  override_offset=3)
+    
+    # Summary stats always use the full resolution, charts may get fewer points
+    result = {'granularity': 'week'}
+    result.update(_summarize_series(series))
+    full_series = series
+    series, groups = _downsample_series(series, max_points, bucket)
+    if groups:
+        result['downsampling'] = {'bucket': bucket, 'source_points': len(weeks), 'points': len(groups)}
+        overlay_demand = _downsample_by_period(overlay_demand, weeks, groups) if overlay_demand else {}
+    
+    if response_format == 'columnar':
+        result['format'] = 'columnar'
+        result['columns'] = _series_columns(series, 'week', overlay_demand)
+    else:
+        result['data_points'] = list(_attach_bucket_fields(_weekly_data_points(series, overlay_demand), series))
+    if build_ahead:
+        result['build_ahead'] = _build_ahead_result(
+            full_series, groups, response_format, max_stock_weeks, shelf_life_weeks
+        )
+    result['overlay_data'] = overlay_data if overlay_data else None
+    if result_token:
+        result['result_token'] = result_token
+    
+    client_overlays = {}
+    for client in overlay_clients:
+        client_overlays[client.code] = _client_overlay(
+            client, loaded[('client', client.id)], weeks, 'week', response_format, groups
+        )
     
     # Add client overlays if any
     if client_overlays:
@@ -1032,8 +2085,21 @@ def _run_line_simulation_daily(line_ids, config_dict, start_date, end_date,
                                 combine_clients=False, client_ids=None,
                                 demand_modifications=None,
                                 product_ids=None,
-                                override_dict=None):
-    """Daily granularity simulation. Optimized with batch loading."""
+                                override_dict=None,
+                                stream=False,
+                                response_format='rows',
+                                max_points=None, bucket='minmax',
+                                base_state=None, fingerprint=None,
+                                concurrent_loads=False):
+    """
+    Daily granularity simulation. Optimized with batch loading.
+    With stream=True, data points (main and overlays) are returned as generators
+    so they can be encoded while being produced. Row data points that are not
+    downsampled are then computed day by day (see _streams_lazily); otherwise
+    they are generated from the built series.
+    With base_state (see _load_demand_state), demand_modifications are applied
+    to the saved demand instead of reloading it.
+    """
     if product_ids is None:
         product_ids = []
     if override_dict is None:
@@ -1042,175 +2108,241 @@ def _run_line_simulation_daily(line_ids, config_dict, start_date, end_date,
     # Get days in range
     days = get_days_in_range(start_date, end_date)
     
-    # Pre-load all lines with configs for the entire date range
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date)
-    
-    # Calculate capacity per day (considers overrides)
-    capacity_by_day = calculate_capacity_per_day(line_ids, config_dict, days, override_dict=override_dict)
-    
-    # Get demand data (distributed daily) - handle multiple product_ids
-    if len(product_ids) > 1:
-        demand_data = {}
-        for pid in product_ids:
-            if combine_clients and client_ids:
-                for cid in client_ids:
-                    product_demand = get_demand_for_lines_daily(
-                        line_ids, start_date, end_date, cid, category_id, pid
-                    )
-                    for day, val in product_demand.items():
-                        demand_data[day] = demand_data.get(day, Decimal('0')) + val
-            else:
-                product_demand = get_demand_for_lines_daily(
-                    line_ids, start_date, end_date, client_id, category_id, pid
-                )
-                for day, val in product_demand.items():
-                    demand_data[day] = demand_data.get(day, Decimal('0')) + val
-    elif combine_clients and client_ids:
-        demand_data = {}
-        for cid in client_ids:
-            client_demand = get_demand_for_lines_daily(
-                line_ids, start_date, end_date, cid, category_id, product_id
+    # Pre-fetch all overlay clients in one query
+    overlay_clients = []
+    if overlay_client_codes:
+        overlay_clients = list(resolve_codes(Client, overlay_client_codes)[0].values())
+    
+    # Independent loads: line configs for the entire date range, capacity per day
+    # (considers overrides), demand (distributed daily), overlays and modification aggregates
+    loads = {
+        'lines': partial(_get_lines_with_configs, line_ids, start_date, end_date),
+        'capacity': partial(calculate_capacity_per_day, line_ids, config_dict, days,
+                            override_dict=override_dict),
+    }
+    # On PostgreSQL the modified demand can be computed by the database in one query
+    # (live forecasts only, so not for forecast versions or ranges reaching into the archive)
+    archive_cutoff = _get_archive_cutoff()
+    pushdown = (base_state is None and _forecast_snapshot() is None and sql_pushdown_enabled()
+                and (archive_cutoff is None or start_date > archive_cutoff))
+    if pushdown:
+        loads['demand'] = partial(
+            _line_demand_daily_sql, line_ids, start_date, end_date,
+            client_ids if combine_clients else ([client_id] if client_id else []),
+            category_id, product_ids, demand_modifications or []
+        )
+    elif base_state is None:
+        loads['demand'] = partial(
+            _combined_line_demand, get_demand_for_lines_daily, line_ids, start_date, end_date,
+            client_id, category_id, product_id, product_ids, combine_clients, client_ids
+        )
+    if base_state is None and client_id:
+        loads['overlay'] = partial(get_client_demand_daily, client_id, line_ids, start_date, end_date)
+    if demand_modifications and not pushdown:
+        valid_product_ids = _modification_product_ids(line_ids, product_ids if product_ids else None)
+        for mod_index, mod in enumerate(demand_modifications):
+            loads[('modification', mod_index)] = partial(_modification_totals, mod, valid_product_ids)
+    # Streamed row overlays are loaded lazily, once their data points are consumed
+    if response_format == 'columnar' or not stream:
+        for client in overlay_clients:
+            loads[('client', client.id)] = partial(
+                get_client_demand_daily, client.id, line_ids, start_date, end_date
             )
-            for day, val in client_demand.items():
-                demand_data[day] = demand_data.get(day, Decimal('0')) + val
+    loaded = _run_loads(loads, concurrent_loads)
+    lines_dict = loaded['lines']
+    capacity_by_day = loaded['capacity']
+    
+    if base_state is not None:
+        # Resume from a previous result's (already modified) demand
+        demand_data = dict(base_state['demand_data'])
     else:
-        demand_data = get_demand_for_lines_daily(
-            line_ids, start_date, end_date,
-            client_id, category_id, product_id
-        )
+        demand_data = loaded['demand']
     
     # Apply demand modifications if any
-    if demand_modifications:
+    if demand_modifications and not pushdown:
         demand_data = apply_demand_modifications_daily(
             demand_data, demand_modifications, line_ids, days,
-            global_product_ids=product_ids if product_ids else None
+            global_product_ids=product_ids if product_ids else None,
+            modification_totals=[loaded[('modification', i)] for i in range(len(demand_modifications))]
         )
     
     # Get overlay demand if client filter is applied
     overlay_demand = {}
-    if client_id:
-        overlay_demand = get_client_demand_daily(client_id, line_ids, start_date, end_date)
-    
-    # Pre-fetch all overlay clients in one query
-    client_overlays = {}
-    if overlay_client_codes:
-        # Use code__in with uppercase codes for case-insensitive matching
-        upper_codes = [code.upper() for code in overlay_client_codes]
-        overlay_clients = Client.objects.filter(code__in=overlay_client_codes)
-        # Fallback: fetch all and filter in Python for case-insensitive match
-        if not overlay_clients.exists():
-            all_clients = Client.objects.filter(is_active=True)
-            overlay_clients = [c for c in all_clients if c.code.upper() in upper_codes]
-        overlay_client_map = {c.code.upper(): c for c in overlay_clients}
-        
-        for client_code in overlay_client_codes:
-            client = overlay_client_map.get(client_code.upper())
-            if client:
-                client_demand = get_client_demand_daily(client.id, line_ids, start_date, end_date)
-                # Build data points for this client
-                client_data_points = []
-                for day in days:
-                    demand = client_demand.get(day, Decimal('0'))
-                    client_data_points.append({
-                        'date': day.strftime('%Y-%m-%d'),
-                        'day': day,
-                        'demand': demand
-                    })
-                client_overlays[client.code] = {
-                    'client_name': client.name,
-                    'client_id': client.id,
-                    'data_points': client_data_points,
-                    'total_demand': sum(dp['demand'] for dp in client_data_points)
-                }
-    
-    # Build data points
-    data_points = []
-    total_demand = Decimal('0')
-    total_capacity = Decimal('0')
-    utilizations = []
-    over_capacity_count = 0
+    if base_state is not None:
+        overlay_demand = base_state['overlay_demand']
+    elif client_id:
+        overlay_demand = loaded['overlay']
+    
+    # Keep this result's demand so the next modification can be applied as a delta
+    result_token = None
+    if fingerprint is not None:
+        result_token = _save_demand_state(
+            fingerprint, demand_data, overlay_demand,
+            (base_state['modifications'] if base_state else []) + list(demand_modifications or [])
+        )
     
-    for day in days:
-        demand = demand_data.get(day, Decimal('0'))
-        daily_capacity = capacity_by_day.get(day, Decimal('0'))
-        
-        total_demand += demand
-        total_capacity += daily_capacity
-        
-        if daily_capacity > 0:
-            utilization = (demand / daily_capacity) * 100
+    # Summary stats always use the full resolution, charts may get fewer points
+    # (days with demand but no capacity are flagged as 999%)
+    result = {'granularity': 'day'}
+    groups = None
+    if _streams_lazily(stream, response_format, max_points, days):
+        period_values = partial(_iter_period_values, days, demand_data, capacity_by_day, line_ids, lines_dict,
+                                flag_missing_capacity=True)
+        result.update(_summarize_values(period_values(), flag_missing_capacity=True))
+        result['data_points'] = _iter_line_daily_points(period_values(), overlay_demand)
+    else:
+        series = _build_period_series(days, demand_data, capacity_by_day, line_ids, lines_dict,
+                                      flag_missing_capacity=True)
+        result.update(_summarize_series(series))
+        series, groups = _downsample_series(series, max_points, bucket)
+        if groups:
+            result['downsampling'] = {'bucket': bucket, 'source_points': len(days), 'points': len(groups)}
+            overlay_demand = _downsample_by_period(overlay_demand, days, groups) if overlay_demand else {}
+        
+        if response_format == 'columnar':
+            result['format'] = 'columnar'
+            result['columns'] = _series_columns(series, 'day', overlay_demand)
         else:
-            utilization = Decimal('0') if demand == 0 else Decimal('999')  # No capacity but has demand
-        
-        utilizations.append(float(utilization))
-        over_capacity = utilization > 100
-        if over_capacity:
-            over_capacity_count += 1
-        
-        # Check for overrides using pre-loaded data
-        has_override = False
-        for line_id in line_ids:
-            line = lines_dict.get(line_id)
-            if line:
-                config = _get_config_for_date_from_prefetched(
-                    line, day, getattr(line, 'prefetched_overrides', [])
-                )
-                if config and config['type'] == 'override':
-                    has_override = True
-                    break
-        
-        # Get day name for display
-        day_name = day.strftime('%a')  # Mon, Tue, etc.
-        
-        data_point = {
-            'date': day.strftime('%Y-%m-%d'),
-            'date_display': f"{day_name} {day.strftime('%d/%m')}",
-            'day': day,
-            'demand': demand,
-            'capacity': daily_capacity,
-            'utilization_percent': round(utilization, 1) if utilization < 999 else 'N/A',
-            'over_capacity': over_capacity,
-            'has_override': has_override,
-            'is_weekend': day.weekday() >= 5
-        }
-        
-        if overlay_demand:
-            data_point['overlay_demand'] = overlay_demand.get(day, Decimal('0'))
-        
-        data_points.append(data_point)
-    
-    # Calculate summary stats (exclude days with no capacity for avg)
-    valid_utilizations = [u for u in utilizations if u < 999]
-    avg_utilization = sum(valid_utilizations) / len(valid_utilizations) if valid_utilizations else 0
-    peak_utilization = max(valid_utilizations) if valid_utilizations else 0
+            result['data_points'] = _attach_bucket_fields(
+                _iter_line_daily_points(_iter_series(series), overlay_demand), series
+            )
+    result['overlay_data'] = overlay_data if overlay_data else None
+    if result_token:
+        result['result_token'] = result_token
     
-    result = {
-        'granularity': 'day',
-        'average_utilization': round(avg_utilization, 1),
-        'peak_utilization': round(peak_utilization, 1),
-        'over_capacity_periods': over_capacity_count,
-        'total_capacity': total_capacity,
-        'total_demand': total_demand,
-        'data_points': data_points,
-        'overlay_data': overlay_data if overlay_data else None
-    }
+    client_overlays = {}
+    for client in overlay_clients:
+        if response_format == 'columnar':
+            client_overlays[client.code] = _client_overlay(
+                client, loaded[('client', client.id)], days, 'day', response_format, groups
+            )
+            continue
+        overlay = {
+            'client_name': client.name,
+            'client_id': client.id,
+        }
+        overlay['data_points'] = _iter_client_overlay_points_daily(
+            overlay, client.id, line_ids, start_date, end_date, days, groups,
+            client_demand=loaded.get(('client', client.id)), caches=_caches()
+        )
+        client_overlays[client.code] = overlay
     
     # Add client overlays if any
     if client_overlays:
         result['client_overlays'] = client_overlays
     
+    if not stream:
+        _materialize_data_points(result)
+    
     return result
 
 
+def _new_client_mix_demand(product_lines: dict, start_date, end_date,
+                           new_client_demand: Decimal,
+                           profile_client_id: Optional[int] = None,
+                           profile_scale: Decimal = Decimal('1'),
+                           product_shares: list = None):
+    """
+    Weekly demand of a new client described as a product mix, routed to the
+    products' default lines.
+    
+    Args:
+        product_lines: Dict mapping product_id -> default line of the selected lines' products
+        start_date, end_date: Simulated range
+        new_client_demand: Weekly demand split by product_shares
+        profile_client_id: Copy this client's forecasts on the selected lines...
+        profile_scale: ...multiplied by this factor
+        product_shares: ...or split new_client_demand by shares, each with a
+            'product_code' or an 'attribute'/'value' pair (spread evenly over the
+            active products having it) and a 'share' weight
+    
+    Returns:
+        (Dict mapping line_id -> {week_start_date -> added demand}, mix description),
+        or (None, error message)
+    """
+    if profile_client_id:
+        client = Client.objects.filter(id=profile_client_id).first()
+        if client is None:
+            return None, f'Profile client {profile_client_id} not found'
+        profile = _sum_demand_by_line_and_week(product_lines, start_date, end_date, profile_client_id)
+        added_by_line = {
+            line_id: {week: value * profile_scale for week, value in weekly.items()}
+            for line_id, weekly in profile.items()
+        }
+        return added_by_line, {
+            'profile_client_name': client.name,
+            'profile_scale': float(profile_scale),
+        }
+    
+    # Line weights of the shares: a product share goes to its default line, an
+    # attribute share to the lines of the matching products, pro rata to their number
+    index = _get_product_index()
+    resolved_products, _ = resolve_codes(
+        Product, [share['product_code'] for share in product_shares if share.get('product_code')]
+    )
+    line_weights = {}
+    described = []
+    total_share = Decimal('0')
+    for share in product_shares:
+        weight = Decimal(str(share['share']))
+        if share.get('product_code'):
+            label = share['product_code']
+            product = resolved_products.get(share['product_code'].upper())
+            if product is None:
+                return None, f"Product {share['product_code']} not found"
+            product_ids = [product.id]
+        elif share.get('attribute') and share.get('value'):
+            label = f"{share['attribute']}={share['value']}"
+            product_ids = sorted(index.ids(index.attribute(share['attribute'], [share['value']])))
+            if not product_ids:
+                return None, f'No active products with {label}'
+        else:
+            return None, 'Each product share needs a product_code or an attribute and value'
+        
+        routed = [product_id for product_id in product_ids if product_id in product_lines]
+        for product_id in routed:
+            line_id = product_lines[product_id]
+            line_weights[line_id] = line_weights.get(line_id, Decimal('0')) + weight / len(product_ids)
+        total_share += weight
+        described.append({
+            'label': label,
+            'share': float(weight),
+            'routed_percent': round(len(routed) * 100 / len(product_ids), 1),
+        })
+    
+    weeks = get_weeks_in_range(start_date, end_date)
+    added_by_line = {}
+    for line_id, weight in line_weights.items():
+        weekly = (new_client_demand * weight / total_share).quantize(Decimal('0.01'))
+        added_by_line[line_id] = {week_start: weekly for week_start in weeks}
+    routed_share = sum(line_weights.values(), Decimal('0'))
+    return added_by_line, {
+        'shares': described,
+        # Demand of products made on lines outside the selection
+        'unrouted_percent': round(float((total_share - routed_share) * 100 / total_share), 1),
+    }
+
+
+@reads_from_read_database
 def run_new_client_simulation(line_ids: list, shift_configs: list,
                               start_date, end_date,
-                              new_client_demand: Decimal,
-                              remove_client_id: Optional[int] = None) -> dict:
+                              new_client_demand: Decimal = Decimal('0'),
+                              remove_client_id: Optional[int] = None,
+                              profile_client_id: Optional[int] = None,
+                              profile_scale: Decimal = Decimal('1'),
+                              product_shares: list = None) -> dict:
     """
     Run new client simulation (Dashboard 3)
     Analyze impact of adding a new client and optionally removing an existing one
     Considers LineConfigOverrides for date-specific capacity
+    
+    By default the new client adds new_client_demand to the selected lines every
+    week. With profile_client_id or product_shares the new client is a product
+    mix (see _new_client_mix_demand) routed to the products' default lines, and
+    the result adds the impact on each line's own capacity ('lines').
     """
+    _use_forecast_version(None)
+    
     # Convert shift_configs to dict - handle use_override flag
     config_dict = {}
     override_dict = {}
@@ -1223,21 +2355,42 @@ def run_new_client_simulation(line_ids: list, shift_configs: list,
             config_dict[sc['line_id']] = sc.get('shift_config_id')
     
     weeks = get_weeks_in_range(start_date, end_date)
-    
-    # Calculate capacity per week (considers overrides)
-    capacity_by_week = calculate_capacity_per_week(line_ids, config_dict, weeks, override_dict=override_dict)
-    
-    # Get base demand (all current demand)
-    base_demand_data = get_demand_for_lines(line_ids, start_date, end_date)
+    mix = bool(profile_client_id or product_shares)
+    
+    if mix:
+        # Per-line demand and capacity, summed for the aggregate curve
+        product_lines = _get_product_index().product_lines(line_ids)
+        added_by_line, mix_info = _new_client_mix_demand(
+            product_lines, start_date, end_date, new_client_demand,
+            profile_client_id, profile_scale, product_shares
+        )
+        if added_by_line is None:
+            return {'error': mix_info}
+        capacity_by_line = _capacity_by_line(line_ids, config_dict, weeks, 'week', override_dict)
+        capacity_by_week = _merge_line_demand(capacity_by_line)
+        base_by_line = _sum_demand_by_line_and_week(product_lines, start_date, end_date)
+        base_demand_data = _merge_line_demand(base_by_line)
+        added_demand_data = _merge_line_demand(added_by_line)
+    else:
+        # Calculate capacity per week (considers overrides)
+        capacity_by_week = calculate_capacity_per_week(line_ids, config_dict, weeks, override_dict=override_dict)
+        
+        # Get base demand (all current demand)
+        base_demand_data = get_demand_for_lines(line_ids, start_date, end_date)
     
     # Get demand to remove if specified
     removed_demand_data = {}
+    removed_by_line = {}
     overlay_data = {'new_client_weekly_demand': float(new_client_demand)}
     
     if remove_client_id:
-        removed_demand_data = get_client_demand(
-            remove_client_id, line_ids, start_date, end_date
-        )
+        if mix:
+            removed_by_line = _sum_demand_by_line_and_week(product_lines, start_date, end_date, remove_client_id)
+            removed_demand_data = _merge_line_demand(removed_by_line)
+        else:
+            removed_demand_data = get_client_demand(
+                remove_client_id, line_ids, start_date, end_date
+            )
         client = Client.objects.filter(id=remove_client_id).first()
         if client:
             overlay_data['removed_client_name'] = client.name
@@ -1253,9 +2406,10 @@ def run_new_client_simulation(line_ids: list, shift_configs: list,
         base_demand = base_demand_data.get(week_start, Decimal('0'))
         removed_demand = removed_demand_data.get(week_start, Decimal('0'))
         weekly_capacity = capacity_by_week.get(week_start, Decimal('0'))
+        added_demand = added_demand_data.get(week_start, Decimal('0')) if mix else new_client_demand
         
         # New demand = base + new client - removed client
-        demand = base_demand + new_client_demand - removed_demand
+        demand = base_demand + added_demand - removed_demand
         total_demand += demand
         total_capacity += weekly_capacity
         
@@ -1278,7 +2432,7 @@ def run_new_client_simulation(line_ids: list, shift_configs: list,
             'date': f"W{week_start.isocalendar()[1]}/{week_start.year}",
             'week_start': week_start,
             'base_demand': base_demand,
-            'new_client_demand': new_client_demand,
+            'new_client_demand': added_demand,
             'removed_demand': removed_demand,
             'demand': demand,
             'capacity': weekly_capacity,
@@ -1290,7 +2444,7 @@ def run_new_client_simulation(line_ids: list, shift_configs: list,
     avg_utilization = sum(utilizations) / len(utilizations) if utilizations else 0
     peak_utilization = max(utilizations) if utilizations else 0
     
-    return {
+    result = {
         'average_utilization': round(avg_utilization, 1),
         'peak_utilization': round(peak_utilization, 1),
         'over_capacity_periods': over_capacity_count,
@@ -1299,8 +2453,59 @@ def run_new_client_simulation(line_ids: list, shift_configs: list,
         'data_points': data_points,
         'overlay_data': overlay_data
     }
+    if mix:
+        total_added = sum(added_demand_data.values(), Decimal('0'))
+        overlay_data['new_client_weekly_demand'] = float(total_added / len(weeks)) if weeks else 0
+        overlay_data['new_client_total_demand'] = float(total_added)
+        overlay_data['new_client_mix'] = mix_info
+        lines_dict = _get_lines_with_configs(line_ids, weeks[0], weeks[-1] + timedelta(days=6)) if weeks else {}
+        result['lines'] = _new_client_line_impacts(
+            weeks, list(capacity_by_line), base_by_line, added_by_line, removed_by_line,
+            capacity_by_line, lines_dict
+        )
+    return result
+
+
+def _new_client_line_impacts(weeks: list, line_ids: list, base_by_line: dict, added_by_line: dict,
+                             removed_by_line: dict, capacity_by_line: dict, lines_dict: dict) -> list:
+    """
+    Per-line rows of a new client mix simulation, evaluated on line x week
+    matrices (see client_impact.line_impacts)
+    
+    Returns:
+        One row per line: stats before/after, added demand and weekly utilization
+    """
+    added = period_matrix(added_by_line, line_ids, weeks)
+    impacts = line_impacts(
+        period_matrix(base_by_line, line_ids, weeks), added,
+        period_matrix(removed_by_line, line_ids, weeks),
+        period_matrix(capacity_by_line, line_ids, weeks)
+    )
+    added_totals = added.sum(axis=1).tolist()
+    
+    rows = []
+    for position, line_id in enumerate(line_ids):
+        line = lines_dict[line_id]
+        row = {
+            'line_id': line.id,
+            'line_name': line.name,
+            'line_code': line.code,
+            'site_code': line.site.code,
+            'added_demand': round(added_totals[position], 2),
+        }
+        for name in ('average_utilization', 'peak_utilization', 'over_capacity_periods'):
+            before = impacts['before'][name][position]
+            after = impacts['after'][name][position]
+            if name == 'over_capacity_periods':
+                row[f'{name}_before'], row[name] = int(before), int(after)
+            else:
+                row[f'{name}_before'], row[name] = round(float(before), 1), round(float(after), 1)
+        row['utilization_percent'] = [round(u, 1) for u in impacts['utilization'][position].tolist()]
+        rows.append(row)
+    return rows
 
 
+@reads_from_read_database
 def run_lost_client_simulation(line_ids: list, shift_configs: list,
                                start_date, end_date,
                                lost_client_id: int) -> dict:
@@ -1309,6 +2514,8 @@ def run_lost_client_simulation(line_ids: list, shift_configs: list,
     Analyze how capacity changes if a client leaves
     Considers LineConfigOverrides for date-specific capacity
     """
+    _use_forecast_version(None)
+    
     # Convert shift_configs to dict - handle use_override flag
     config_dict = {}
     override_dict = {}
@@ -1400,6 +2607,103 @@ def run_lost_client_simulation(line_ids: list, shift_configs: list,
     }
 
 
+@reads_from_read_database
+def run_client_impact_ranking(line_ids: list, shift_configs: list,
+                              start_date, end_date,
+                              change_percent=Decimal('-100'),
+                              rank_by: str = 'over_capacity_periods',
+                              top_n: int = 10,
+                              forecast_version_id: Optional[int] = None) -> dict:
+    """
+    Rank all clients by how much a change of their demand moves utilization.
+    The (client x week) demand matrix of the lines is loaded once and the
+    scenario is evaluated for every client at once (see client_impact), instead
+    of one run_lost_client_simulation per client.
+    
+    Args:
+        line_ids: List of production line IDs
+        shift_configs: List of shift config overrides per line
+        start_date: Start date for simulation
+        end_date: End date for simulation
+        change_percent: Change applied to one client at a time (-100 = lost client)
+        rank_by: Metric ranked by largest absolute change (see client_impact.RANK_METRICS)
+        top_n: Number of clients returned
+        forecast_version_id: Read demand from this ForecastVersion
+    
+    Returns:
+        Ranking dictionary: 'baseline' stats and the top 'clients', each with
+        their stats under the scenario, changes vs the baseline and weekly
+        utilization
+    """
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    
+    config_dict = {}
+    override_dict = {}
+    for sc in shift_configs:
+        if sc.get('use_override', False):
+            config_dict[sc['line_id']] = None
+            if sc.get('override_id'):
+                override_dict[sc['line_id']] = sc['override_id']
+        else:
+            config_dict[sc['line_id']] = sc.get('shift_config_id')
+    
+    weeks = get_weeks_in_range(start_date, end_date)
+    capacity_by_week = calculate_capacity_per_week(line_ids, config_dict, weeks, override_dict=override_dict)
+    demand_by_client = _sum_demand_by_client_and_week(_get_product_ids_for_lines(line_ids), start_date, end_date)
+    
+    client_ids, client_demand = client_week_matrix(demand_by_client, weeks)
+    capacity = [float(capacity_by_week.get(week_start, Decimal('0'))) for week_start in weeks]
+    ranking = rank_client_impacts(client_demand, capacity, float(change_percent), rank_by, top_n)
+    
+    client_totals = client_demand.sum(axis=1)
+    total_demand = float(client_totals.sum())
+    top_ids = [client_ids[row] for row in ranking['rows'].tolist()]
+    clients = Client.objects.only('id', 'code', 'name').in_bulk(top_ids)
+    
+    ranked = []
+    for position, client_id in enumerate(top_ids):
+        client = clients.get(client_id)
+        row = ranking['rows'][position]
+        entry = {
+            'client_id': client_id,
+            'client_code': client.code if client else None,
+            'client_name': client.name if client else 'Unknown',
+            'total_demand': round(float(client_totals[row]), 2),
+            'demand_share_percent': round(float(client_totals[row]) * 100 / total_demand, 1) if total_demand else 0,
+        }
+        for name in ('average_utilization', 'peak_utilization', 'over_capacity_periods'):
+            value = ranking['stats'][name][position]
+            change = ranking['changes'][name][position]
+            if name == 'over_capacity_periods':
+                entry[name], entry[f'{name}_change'] = int(value), int(change)
+            else:
+                entry[name], entry[f'{name}_change'] = round(float(value), 1), round(float(change), 1)
+        entry['utilization_percent'] = [round(u, 1) for u in ranking['utilization'][position].tolist()]
+        ranked.append(entry)
+    
+    baseline = ranking['baseline']
+    result = {
+        'change_percent': float(change_percent),
+        'rank_by': rank_by,
+        'weeks': [_period_label(week_start, 'week') for week_start in weeks],
+        'baseline': {
+            'average_utilization': round(float(baseline['average_utilization']), 1),
+            'peak_utilization': round(float(baseline['peak_utilization']), 1),
+            'over_capacity_periods': int(baseline['over_capacity_periods']),
+            'total_capacity': round(sum(capacity, 0.0), 2),
+            'total_demand': round(total_demand, 2),
+        },
+        'clients': ranked,
+        'client_count': len(client_ids),
+        'line_count': len(line_ids),
+    }
+    if forecast_version_id:
+        result['forecast_version_id'] = forecast_version_id
+    return result
+
+
+@reads_from_read_database
 def run_category_simulation(simulation_category_id: int, shift_configs: list,
                              start_date, end_date,
                              client_codes: list = None,
@@ -1407,7 +2711,14 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
                              product_codes: list = None,
                              overlay_client_codes: list = None,
                              granularity: str = 'week',
-                             demand_modifications: list = None) -> dict:
+                             demand_modifications: list = None,
+                             stream: bool = False,
+                             response_format: str = 'rows',
+                             max_points: Optional[int] = None,
+                             bucket: str = 'minmax',
+                             concurrent_loads: bool = False,
+                             forecast_version_id: Optional[int] = None,
+                             breakdown: bool = False) -> dict:
     """
     Run simulation using a SimulationCategory (new workflow).
     The category defines which lines and product filters to use.
@@ -1423,12 +2734,24 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
         overlay_client_codes: Client codes for overlay curves
         granularity: 'week' or 'day'
         demand_modifications: List of demand adjustments
+        stream: Produce daily data points lazily for streamed responses
+        response_format: 'rows' (data_points) or 'columnar' (parallel arrays)
+        max_points: Optional cap on charted points (summary stats stay exact)
+        bucket: Downsampling method, 'minmax' buckets or 'lttb'
+        concurrent_loads: Run independent data loads on a thread pool (see _run_loads)
+        forecast_version_id: Read demand from this ForecastVersion instead of
+            the current forecasts
+        breakdown: Add per-line and per-site series and summary stats, sliced
+            from the same loads (see _category_breakdown)
     
     Returns:
         Simulation result dictionary
     """
     from .models import SimulationCategory
     
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    
     # Get the simulation category
     try:
         category = SimulationCategory.objects.prefetch_related('lines', 'site').get(id=simulation_category_id)
@@ -1440,56 +2763,34 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
     if not line_ids:
         return {'error': 'No lines defined in the simulation category'}
     
-    # Get matching products for the category
-    matching_products = category.get_matching_products()
-    matching_product_ids = set(matching_products.values_list('id', flat=True))
+    # Get matching products for the category (membership bitset of the product index)
+    index = _get_product_index()
+    matching_product_ids = index.ids(index.category(category.id))
     
     if not matching_product_ids:
         return {'error': 'No products match the category filters'}
     
     # Resolve product_ids from product_codes or single product_code (must be in matching products)
+    # A single query tells apart codes outside the category from unknown codes
+    requested_codes = product_codes or ([product_code] if product_code else [])
+    resolved_products, _ = resolve_codes(Product, requested_codes)
     product_ids = []
     not_found_products = []  # Track products that weren't found in category
-    if product_codes:
-        for code in product_codes:
-            product = Product.objects.filter(
-                code__iexact=code,
-                id__in=matching_product_ids
-            ).first()
-            if product:
-                product_ids.append(product.id)
-            else:
-                # Check if the product exists at all
-                exists = Product.objects.filter(code__iexact=code).exists()
-                if exists:
-                    not_found_products.append(f"{code} (not in category)")
-                else:
-                    not_found_products.append(f"{code} (not found)")
-    elif product_code:
-        product = Product.objects.filter(
-            code__iexact=product_code,
-            id__in=matching_product_ids
-        ).first()
-        if product:
+    for code in requested_codes:
+        product = resolved_products.get(code.upper())
+        if product is None:
+            not_found_products.append(f"{code} (not found)")
+        elif product.id not in matching_product_ids:
+            not_found_products.append(f"{code} (not in category)")
+        elif product.id not in product_ids:
             product_ids.append(product.id)
-        else:
-            # Check if the product exists at all
-            exists = Product.objects.filter(code__iexact=product_code).exists()
-            if exists:
-                not_found_products.append(f"{product_code} (not in category)")
-            else:
-                not_found_products.append(f"{product_code} (not found)")
     
     # For backward compatibility - single product_id
     product_id = product_ids[0] if len(product_ids) == 1 else None
     
-    # Resolve client_ids from client_codes if provided
-    client_ids = []
-    if client_codes:
-        for code in client_codes:
-            client = Client.objects.filter(code__iexact=code).first()
-            if client:
-                client_ids.append(client.id)
+    # Resolve client_ids from client_codes if provided (one query)
+    resolved_clients, not_found_clients = resolve_codes(Client, client_codes)
+    client_ids = [c.id for c in resolved_clients.values()]
     
     client_id = None
     combine_clients = False
@@ -1517,6 +2818,8 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
     }
     if client_codes:
         overlay_data['client_codes'] = client_codes
+    if forecast_version_id:
+        overlay_data['forecast_version_id'] = forecast_version_id
     if product_codes:
         overlay_data['product_codes'] = product_codes
     elif product_code:
@@ -1525,6 +2828,8 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
         overlay_data['demand_modifications'] = demand_modifications
     if not_found_products:
         overlay_data['product_filter_warnings'] = not_found_products
+    if not_found_clients:
+        overlay_data['client_filter_warnings'] = [f"{code} (not found)" for code in not_found_clients]
     # Track how many products are actually being used in the filter
     overlay_data['filtered_product_count'] = len(product_ids) if product_ids else len(matching_product_ids)
     
@@ -1537,7 +2842,13 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
             combine_clients=combine_clients, client_ids=client_ids,
             demand_modifications=demand_modifications or [],
             product_ids=product_ids,
-            override_dict=override_dict
+            override_dict=override_dict,
+            stream=stream,
+            response_format=response_format,
+            max_points=max_points,
+            bucket=bucket,
+            concurrent_loads=concurrent_loads,
+            breakdown=breakdown
         )
     else:
         return _run_category_simulation_weekly(
@@ -1547,7 +2858,12 @@ def run_category_simulation(simulation_category_id: int, shift_configs: list,
             combine_clients=combine_clients, client_ids=client_ids,
             demand_modifications=demand_modifications or [],
             product_ids=product_ids,
-            override_dict=override_dict
+            override_dict=override_dict,
+            response_format=response_format,
+            max_points=max_points,
+            bucket=bucket,
+            concurrent_loads=concurrent_loads,
+            breakdown=breakdown
         )
 
 
@@ -1556,22 +2872,101 @@ def _get_demand_for_products(product_ids: set, week_start, week_end,
     """
     Get demand forecast for specific product IDs.
     """
-    forecast_filter = Q(
-        product_id__in=product_ids,
-        week_start_date__gte=week_start,
-        week_start_date__lte=week_end
-    )
-    
-    if client_id:
-        forecast_filter &= Q(client_id=client_id)
+    return _sum_demand_by_week(product_ids, week_start, week_end, client_id)
+
+
+def _combined_product_demand(product_ids: set, week_start, week_end, client_id: Optional[int] = None,
+                             combine_clients: bool = False, client_ids: list = None) -> dict:
+    """Weekly demand for specific product IDs, summed over client_ids when combining clients"""
+    if combine_clients and client_ids:
+        demand_data = {}
+        for cid in client_ids:
+            client_demand = _get_demand_for_products(product_ids, week_start, week_end, cid)
+            for week, val in client_demand.items():
+                demand_data[week] = demand_data.get(week, Decimal('0')) + val
+        return demand_data
+    return _get_demand_for_products(product_ids, week_start, week_end, client_id)
+
+
+def _combined_product_demand_by_line(product_lines: dict, week_start, week_end,
+                                     client_id: Optional[int] = None,
+                                     combine_clients: bool = False, client_ids: list = None) -> dict:
+    """_combined_product_demand grouped by the products' default line"""
+    if combine_clients and client_ids:
+        demand_by_line = {}
+        for cid in client_ids:
+            for line_id, client_demand in _sum_demand_by_line_and_week(product_lines, week_start, week_end, cid).items():
+                line_demand = demand_by_line.setdefault(line_id, {})
+                for week, val in client_demand.items():
+                    line_demand[week] = line_demand.get(week, Decimal('0')) + val
+        return demand_by_line
+    return _sum_demand_by_line_and_week(product_lines, week_start, week_end, client_id)
+
+
+def _category_breakdown(periods: list, granularity: str, demand_by_line: dict,
+                        capacity_by_line: dict, lines_dict: dict,
+                        groups: list = None, bucket: str = 'minmax') -> dict:
+    """
+    Per-line and per-site series of a category simulation, sliced from the demand
+    grouped by default line and the per-line capacity calendar already loaded.
     
-    forecasts = DemandForecast.objects.filter(forecast_filter).values(
-        'week_start_date'
-    ).annotate(
-        total_demand=Sum('forecast_quantity')
-    ).order_by('week_start_date')
+    Args:
+        periods: Week start dates or days of the result
+        granularity: 'week' or 'day'
+        demand_by_line: Dict mapping line_id -> {period -> (modified) demand}
+        capacity_by_line: Dict mapping line_id -> {period -> capacity} (see _capacity_by_line)
+        lines_dict: Pre-loaded lines (see _get_lines_with_configs)
+        groups: Downsampling groups of the result's series, if any
+        bucket: Downsampling method of the result
     
-    return {f['week_start_date']: f['total_demand'] for f in forecasts}
+    Returns:
+        Dict with 'lines' and 'sites' lists: summary stats on full resolution and
+        demand/capacity/utilization_percent/over_capacity arrays aligned with the
+        result's periods. Modified demand is floored at zero per line, so with
+        large reductions the lines can add up to more than the category total.
+    """
+    override_offset = 3 if granularity == 'week' else 0
+    
+    def entry(info: dict, series_line_ids: list, demand: dict, capacity: dict) -> dict:
+        series = _build_period_series(periods, demand, capacity, series_line_ids, lines_dict,
+                                      override_offset=override_offset)
+        info.update(_summarize_series(series))
+        if groups:
+            series, _ = _downsample_series(series, None, bucket, groups=groups)
+        columns = _series_columns(series, granularity)
+        for name in ('demand', 'capacity', 'utilization_percent', 'over_capacity'):
+            info[name] = columns[name]
+        return info
+    
+    line_entries = []
+    sites = {}
+    for line_id, capacity in capacity_by_line.items():
+        line = lines_dict[line_id]
+        demand = demand_by_line.get(line_id, {})
+        line_entries.append(entry({
+            'line_id': line.id,
+            'line_name': line.name,
+            'line_code': line.code,
+            'site_id': line.site_id,
+            'site_code': line.site.code,
+        }, [line_id], demand, capacity))
+        
+        site = sites.setdefault(line.site_id, {'site': line.site, 'line_ids': [], 'demand': {}, 'capacity': {}})
+        site['line_ids'].append(line_id)
+        for key, values in (('demand', demand), ('capacity', capacity)):
+            for period, value in values.items():
+                site[key][period] = site[key].get(period, Decimal('0')) + value
+    
+    site_entries = [
+        entry({
+            'site_id': site['site'].id,
+            'site_code': site['site'].code,
+            'site_name': site['site'].name,
+            'line_count': len(site['line_ids']),
+        }, site['line_ids'], site['demand'], site['capacity'])
+        for site in sites.values()
+    ]
+    return {'lines': line_entries, 'sites': site_entries}
 
 
 def _run_category_simulation_weekly(line_ids, config_dict, start_date, end_date,
@@ -1580,8 +2975,16 @@ def _run_category_simulation_weekly(line_ids, config_dict, start_date, end_date,
                                      combine_clients=False, client_ids=None,
                                      demand_modifications=None,
                                      product_ids=None,
-                                     override_dict=None):
-    """Weekly granularity simulation for category-based workflow."""
+                                     override_dict=None,
+                                     response_format='rows',
+                                     max_points=None, bucket='minmax',
+                                     concurrent_loads=False,
+                                     breakdown=False):
+    """
+    Weekly granularity simulation for category-based workflow.
+    With breakdown, demand and modification totals are loaded grouped by default
+    line and per-line/per-site series are added (see _category_breakdown).
+    """
     if product_ids is None:
         product_ids = []
     if override_dict is None:
@@ -1589,9 +2992,6 @@ def _run_category_simulation_weekly(line_ids, config_dict, start_date, end_date,
     
     weeks = get_weeks_in_range(start_date, end_date)
     
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date + timedelta(days=6))
-    capacity_by_week = calculate_capacity_per_week(line_ids, config_dict, weeks, override_dict=override_dict)
-    
     # Determine which product IDs to query
     # If product filter is applied (product_ids has items), use those
     # Otherwise, use all matching products from the category
@@ -1600,114 +3000,101 @@ def _run_category_simulation_weekly(line_ids, config_dict, start_date, end_date,
     else:
         query_product_ids = matching_product_ids
     
-    # Get demand data
-    if combine_clients and client_ids:
-        demand_data = {}
-        for cid in client_ids:
-            client_demand = _get_demand_for_products(query_product_ids, start_date, end_date, cid)
-            for week, val in client_demand.items():
-                demand_data[week] = demand_data.get(week, Decimal('0')) + val
+    overlay_clients = []
+    if overlay_client_codes:
+        overlay_clients = list(resolve_codes(Client, overlay_client_codes)[0].values())
+    
+    # Independent loads (see _run_line_simulation_weekly)
+    loads = {
+        'lines': partial(_get_lines_with_configs, line_ids, start_date, end_date + timedelta(days=6)),
+    }
+    if breakdown:
+        # Products whose default line is outside the category are grouped under None
+        line_of_product = _get_product_index().product_lines(line_ids)
+        product_lines = {product: line_of_product.get(product) for product in query_product_ids}
+        loads['capacity'] = partial(_capacity_by_line, line_ids, config_dict, weeks, 'week', override_dict)
+        loads['demand'] = partial(_combined_product_demand_by_line, product_lines, start_date, end_date,
+                                  client_id, combine_clients, client_ids)
+        for mod_index, mod in enumerate(demand_modifications or []):
+            loads[('modification', mod_index)] = partial(_modification_totals_by_line, mod, product_lines)
+    else:
+        loads['capacity'] = partial(calculate_capacity_per_week, line_ids, config_dict, weeks,
+                                    override_dict=override_dict)
+        loads['demand'] = partial(_combined_product_demand, query_product_ids, start_date, end_date,
+                                  client_id, combine_clients, client_ids)
+        for mod_index, mod in enumerate(demand_modifications or []):
+            loads[('modification', mod_index)] = partial(_modification_totals, mod, query_product_ids)
+    if client_id:
+        loads['overlay'] = partial(_get_demand_for_products, query_product_ids, start_date, end_date, client_id)
+    for client in overlay_clients:
+        loads[('client', client.id)] = partial(
+            _get_demand_for_products, query_product_ids, start_date, end_date, client.id
+        )
+    loaded = _run_loads(loads, concurrent_loads)
+    lines_dict = loaded['lines']
+    modification_totals = [loaded[('modification', i)] for i in range(len(demand_modifications or []))]
+    if breakdown:
+        # Category totals are the sums of the per-line values
+        capacity_by_line = loaded['capacity']
+        capacity_by_week = _merge_line_demand(capacity_by_line)
+        demand_by_line = loaded['demand']
+        demand_data = _merge_line_demand(demand_by_line)
+        modification_totals_by_line = modification_totals
+        modification_totals = [_merge_line_demand(totals) for totals in modification_totals_by_line]
     else:
-        demand_data = _get_demand_for_products(query_product_ids, start_date, end_date, client_id)
+        capacity_by_week = loaded['capacity']
+        demand_data = loaded['demand']
     
     # Apply demand modifications
     if demand_modifications:
         demand_data = _apply_category_demand_modifications(
-            demand_data, demand_modifications, query_product_ids, weeks
+            demand_data, demand_modifications, query_product_ids, weeks,
+            modification_totals=modification_totals
         )
-    
-    # Get overlay demand
-    overlay_demand = {}
-    if client_id:
-        overlay_demand = _get_demand_for_products(query_product_ids, start_date, end_date, client_id)
-    
-    # Process client overlays
-    client_overlays = {}
-    if overlay_client_codes:
-        overlay_clients = Client.objects.filter(code__in=overlay_client_codes)
-        for client in overlay_clients:
-            client_demand = _get_demand_for_products(query_product_ids, start_date, end_date, client.id)
-            client_data_points = []
-            for week_start in weeks:
-                demand = client_demand.get(week_start, Decimal('0'))
-                client_data_points.append({
-                    'date': f"W{week_start.isocalendar()[1]}/{week_start.year}",
-                    'week_start': week_start,
-                    'demand': demand
-                })
-            client_overlays[client.code] = {
-                'client_name': client.name,
-                'client_id': client.id,
-                'data_points': client_data_points,
-                'total_demand': sum(dp['demand'] for dp in client_data_points)
-            }
-    
-    # Build data points
-    data_points = []
-    total_demand = Decimal('0')
-    total_capacity = Decimal('0')
-    utilizations = []
-    over_capacity_count = 0
-    
-    for week_start in weeks:
-        demand = demand_data.get(week_start, Decimal('0'))
-        weekly_capacity = capacity_by_week.get(week_start, Decimal('0'))
-        
-        total_demand += demand
-        total_capacity += weekly_capacity
-        
-        if weekly_capacity > 0:
-            utilization = (demand / weekly_capacity) * 100
-        else:
-            utilization = Decimal('0')
-        
-        utilizations.append(float(utilization))
-        over_capacity = utilization > 100
-        if over_capacity:
-            over_capacity_count += 1
-        
-        week_date = week_start + timedelta(days=3)
-        has_override = False
-        for line_id in line_ids:
-            line = lines_dict.get(line_id)
-            if line:
-                config = _get_config_for_date_from_prefetched(
-                    line, week_date, getattr(line, 'prefetched_overrides', [])
+        if breakdown:
+            demand_by_line = {
+                line_id: _apply_category_demand_modifications(
+                    dict(demand_by_line.get(line_id, {})), demand_modifications, query_product_ids, weeks,
+                    modification_totals=[totals.get(line_id, {}) for totals in modification_totals_by_line]
                 )
-                if config and config['type'] == 'override':
-                    has_override = True
-                    break
-        
-        data_point = {
-            'date': f"W{week_start.isocalendar()[1]}/{week_start.year}",
-            'week_start': week_start,
-            'demand': demand,
-            'capacity': weekly_capacity,
-            'utilization_percent': round(utilization, 1),
-            'over_capacity': over_capacity,
-            'has_override': has_override
-        }
-        
-        if overlay_demand:
-            data_point['overlay_demand'] = overlay_demand.get(week_start, Decimal('0'))
-        
-        data_points.append(data_point)
-    
-    avg_utilization = sum(utilizations) / len(utilizations) if utilizations else 0
-    peak_utilization = max(utilizations) if utilizations else 0
+                for line_id in capacity_by_line
+            }
     
-    result = {
-        'granularity': 'week',
-        'average_utilization': round(avg_utilization, 1),
-        'peak_utilization': round(peak_utilization, 1),
-        'over_capacity_periods': over_capacity_count,
-        'total_capacity': total_capacity,
-        'total_demand': total_demand,
-        'data_points': data_points,
+    # Get overlay demand
+    overlay_demand = loaded.get('overlay', {})
+    
+    series = _build_period_series(weeks, demand_data, capacity_by_week, line_ids, lines_dict,
+                                  override_offset=3)
+    
+    # Summary stats always use the full resolution, charts may get fewer points
+    result = {'granularity': 'week'}
+    result.update(_summarize_series(series))
+    series, groups = _downsample_series(series, max_points, bucket)
+    if groups:
+        result['downsampling'] = {'bucket': bucket, 'source_points': len(weeks), 'points': len(groups)}
+        overlay_demand = _downsample_by_period(overlay_demand, weeks, groups) if overlay_demand else {}
+    
+    if response_format == 'columnar':
+        result['format'] = 'columnar'
+        result['columns'] = _series_columns(series, 'week', overlay_demand)
+    else:
+        result['data_points'] = list(_attach_bucket_fields(_weekly_data_points(series, overlay_demand), series))
+    if breakdown:
+        result['breakdown'] = _category_breakdown(
+            weeks, 'week', demand_by_line, capacity_by_line, lines_dict, groups, bucket
+        )
+    result.update({
         'line_count': len(line_ids),
         'product_count': len(matching_product_ids),
         'overlay_data': overlay_data if overlay_data else None
-    }
+    })
+    
+    # Process client overlays
+    client_overlays = {}
+    for client in overlay_clients:
+        client_overlays[client.code] = _client_overlay(
+            client, loaded[('client', client.id)], weeks, 'week', response_format, groups
+        )
     
     if client_overlays:
         result['client_overlays'] = client_overlays
@@ -1721,8 +3108,17 @@ def _run_category_simulation_daily(line_ids, config_dict, start_date, end_date,
                                     combine_clients=False, client_ids=None,
                                     demand_modifications=None,
                                     product_ids=None,
-                                    override_dict=None):
-    """Daily granularity simulation for category-based workflow."""
+                                    override_dict=None,
+                                    stream=False,
+                                    response_format='rows',
+                                    max_points=None, bucket='minmax',
+                                    concurrent_loads=False,
+                                    breakdown=False):
+    """
+    Daily granularity simulation for category-based workflow.
+    With stream=True, data points are returned as a generator (see _run_line_simulation_daily).
+    With breakdown, per-line/per-site series are added (see _run_category_simulation_weekly).
+    """
     if product_ids is None:
         product_ids = []
     if override_dict is None:
@@ -1730,9 +3126,6 @@ def _run_category_simulation_daily(line_ids, config_dict, start_date, end_date,
     
     days = get_days_in_range(start_date, end_date)
     
-    lines_dict = _get_lines_with_configs(line_ids, start_date, end_date)
-    capacity_by_day = calculate_capacity_per_day(line_ids, config_dict, days, override_dict=override_dict)
-    
     # Determine which product IDs to query
     # If product filter is applied (product_ids has items), use those
     # Otherwise, use all matching products from the category
@@ -1741,133 +3134,124 @@ def _run_category_simulation_daily(line_ids, config_dict, start_date, end_date,
     else:
         query_product_ids = matching_product_ids
     
-    if combine_clients and client_ids:
-        weekly_demand_data = {}
-        for cid in client_ids:
-            client_demand = _get_demand_for_products(query_product_ids, start_date, end_date, cid)
-            for week, val in client_demand.items():
-                weekly_demand_data[week] = weekly_demand_data.get(week, Decimal('0')) + val
+    # Independent loads (see _run_line_simulation_daily)
+    loads = {
+        'lines': partial(_get_lines_with_configs, line_ids, start_date, end_date),
+    }
+    if breakdown:
+        # Products whose default line is outside the category are grouped under None
+        line_of_product = _get_product_index().product_lines(line_ids)
+        product_lines = {product: line_of_product.get(product) for product in query_product_ids}
+        loads['capacity'] = partial(_capacity_by_line, line_ids, config_dict, days, 'day', override_dict)
+        loads['demand'] = partial(_combined_product_demand_by_line, product_lines, start_date, end_date,
+                                  client_id, combine_clients, client_ids)
+        for mod_index, mod in enumerate(demand_modifications or []):
+            loads[('modification', mod_index)] = partial(_modification_totals_by_line, mod, product_lines)
+    else:
+        loads['capacity'] = partial(calculate_capacity_per_day, line_ids, config_dict, days,
+                                    override_dict=override_dict)
+        loads['demand'] = partial(_combined_product_demand, query_product_ids, start_date, end_date,
+                                  client_id, combine_clients, client_ids)
+        for mod_index, mod in enumerate(demand_modifications or []):
+            loads[('modification', mod_index)] = partial(_modification_totals, mod, query_product_ids)
+    loaded = _run_loads(loads, concurrent_loads)
+    lines_dict = loaded['lines']
+    modification_totals = [loaded[('modification', i)] for i in range(len(demand_modifications or []))]
+    if breakdown:
+        # Category totals are the sums of the per-line values
+        capacity_by_line = loaded['capacity']
+        capacity_by_day = _merge_line_demand(capacity_by_line)
+        weekly_demand_by_line = loaded['demand']
+        weekly_demand_data = _merge_line_demand(weekly_demand_by_line)
+        modification_totals_by_line = modification_totals
+        modification_totals = [_merge_line_demand(totals) for totals in modification_totals_by_line]
     else:
-        weekly_demand_data = _get_demand_for_products(query_product_ids, start_date, end_date, client_id)
+        capacity_by_day = loaded['capacity']
+        weekly_demand_data = loaded['demand']
     
-    demand_data = {}
-    for week_start, total_weekly in weekly_demand_data.items():
-        for day_offset in range(5):
-            day = week_start + timedelta(days=day_offset)
-            if start_date <= day <= end_date:
-                demand_data[day] = total_weekly / Decimal('5')
+    def spread_daily(weekly_demand: dict) -> dict:
+        demand_data = {}
+        for week_start, total_weekly in weekly_demand.items():
+            for day_offset in range(5):
+                day = week_start + timedelta(days=day_offset)
+                if start_date <= day <= end_date:
+                    demand_data[day] = total_weekly / Decimal('5')
+        return demand_data
     
+    demand_data = spread_daily(weekly_demand_data)
     if demand_modifications:
         demand_data = _apply_category_demand_modifications_daily(
-            demand_data, demand_modifications, query_product_ids, days
+            demand_data, demand_modifications, query_product_ids, days,
+            modification_totals=modification_totals
         )
     
-    data_points = []
-    total_demand = Decimal('0')
-    total_capacity = Decimal('0')
-    utilizations = []
-    over_capacity_count = 0
-    
-    for day in days:
-        demand = demand_data.get(day, Decimal('0'))
-        daily_capacity = capacity_by_day.get(day, Decimal('0'))
-        
-        total_demand += demand
-        total_capacity += daily_capacity
-        
-        if daily_capacity > 0:
-            utilization = (demand / daily_capacity) * 100
-        else:
-            utilization = Decimal('0')
-        
-        utilizations.append(float(utilization))
-        over_capacity = utilization > 100
-        if over_capacity:
-            over_capacity_count += 1
-        
-        has_override = False
-        for line_id in line_ids:
-            line = lines_dict.get(line_id)
-            if line:
-                config = _get_config_for_date_from_prefetched(
-                    line, day, getattr(line, 'prefetched_overrides', [])
+    if breakdown:
+        demand_by_line = {}
+        for line_id in capacity_by_line:
+            demand_by_line[line_id] = spread_daily(weekly_demand_by_line.get(line_id, {}))
+            if demand_modifications:
+                _apply_category_demand_modifications_daily(
+                    demand_by_line[line_id], demand_modifications, query_product_ids, days,
+                    modification_totals=[totals.get(line_id, {}) for totals in modification_totals_by_line]
                 )
-                if config and config['type'] == 'override':
-                    has_override = True
-                    break
-        
-        data_points.append({
-            'date': day.strftime('%Y-%m-%d'),
-            'day_date': day,
-            'demand': demand,
-            'capacity': daily_capacity,
-            'utilization_percent': round(utilization, 1),
-            'over_capacity': over_capacity,
-            'has_override': has_override,
-            'day_name': day.strftime('%A')
-        })
-    
-    avg_utilization = sum(utilizations) / len(utilizations) if utilizations else 0
-    peak_utilization = max(utilizations) if utilizations else 0
     
-    return {
-        'granularity': 'day',
-        'average_utilization': round(avg_utilization, 1),
-        'peak_utilization': round(peak_utilization, 1),
-        'over_capacity_periods': over_capacity_count,
-        'total_capacity': total_capacity,
-        'total_demand': total_demand,
-        'data_points': data_points,
+    # Summary stats always use the full resolution, charts may get fewer points
+    result = {'granularity': 'day'}
+    groups = None
+    if _streams_lazily(stream, response_format, max_points, days):
+        period_values = partial(_iter_period_values, days, demand_data, capacity_by_day, line_ids, lines_dict)
+        result.update(_summarize_values(period_values()))
+        result['data_points'] = _iter_category_daily_points(period_values())
+    else:
+        series = _build_period_series(days, demand_data, capacity_by_day, line_ids, lines_dict)
+        result.update(_summarize_series(series))
+        series, groups = _downsample_series(series, max_points, bucket)
+        if groups:
+            result['downsampling'] = {'bucket': bucket, 'source_points': len(days), 'points': len(groups)}
+        
+        if response_format == 'columnar':
+            result['format'] = 'columnar'
+            result['columns'] = _series_columns(series, 'day')
+        else:
+            result['data_points'] = _attach_bucket_fields(_iter_category_daily_points(_iter_series(series)), series)
+    if breakdown:
+        result['breakdown'] = _category_breakdown(
+            days, 'day', demand_by_line, capacity_by_line, lines_dict, groups, bucket
+        )
+    result.update({
         'line_count': len(line_ids),
         'product_count': len(matching_product_ids),
         'overlay_data': overlay_data if overlay_data else None
-    }
+    })
+    
+    if not stream:
+        _materialize_data_points(result)
+    
+    return result
 
 
 def _apply_category_demand_modifications(demand_data: dict, modifications: list,
-                                          product_ids: set, weeks: list) -> dict:
+                                          product_ids: set, weeks: list,
+                                          modification_totals: list = None) -> dict:
     """Apply demand modifications for category simulation (weekly)."""
     if not modifications:
         return demand_data
     
     weeks_set = set(weeks)
     
-    for mod in modifications:
-        client_id = mod.get('client_id')
-        product_id = mod.get('product_id')
-        mod_start = mod.get('start_date')
-        mod_end = mod.get('end_date')
+    for mod_index, mod in enumerate(modifications):
         percentage = Decimal(str(mod.get('percentage', 0)))
         
-        if isinstance(mod_start, str):
-            mod_start = datetime.strptime(mod_start, '%Y-%m-%d').date()
-        if isinstance(mod_end, str):
-            mod_end = datetime.strptime(mod_end, '%Y-%m-%d').date()
-        
         factor = percentage / Decimal('100')
-        mod_start_week = get_week_start(mod_start)
-        
-        forecast_filter = Q(
-            client_id=client_id,
-            week_start_date__gte=mod_start_week,
-            week_start_date__lte=mod_end
-        )
-        
-        if product_id:
-            forecast_filter &= Q(product_id=product_id)
+        # Weekly forecast totals the modification applies to (possibly preloaded)
+        if modification_totals is not None:
+            totals = modification_totals[mod_index]
         else:
-            forecast_filter &= Q(product_id__in=product_ids)
-        
-        affected_forecasts = DemandForecast.objects.filter(forecast_filter).values(
-            'week_start_date'
-        ).annotate(
-            total_demand=Sum('forecast_quantity')
-        )
+            totals = _modification_totals(mod, product_ids)
         
-        for forecast in affected_forecasts:
-            week_start = forecast['week_start_date']
+        for week_start, total_demand in totals.items():
             if week_start in weeks_set:
-                modification_amount = forecast['total_demand'] * factor
+                modification_amount = total_demand * factor
                 if week_start not in demand_data:
                     demand_data[week_start] = Decimal('0')
                 demand_data[week_start] += modification_amount
@@ -1878,14 +3262,13 @@ def _apply_category_demand_modifications(demand_data: dict, modifications: list,
 
 
 def _apply_category_demand_modifications_daily(demand_data: dict, modifications: list,
-                                                product_ids: set, days: list) -> dict:
+                                                product_ids: set, days: list,
+                                                modification_totals: list = None) -> dict:
     """Apply demand modifications for category simulation (daily)."""
     if not modifications:
         return demand_data
     
-    for mod in modifications:
-        client_id = mod.get('client_id')
-        product_id = mod.get('product_id')
+    for mod_index, mod in enumerate(modifications):
         mod_start = mod.get('start_date')
         mod_end = mod.get('end_date')
         percentage = Decimal(str(mod.get('percentage', 0)))
@@ -1897,26 +3280,14 @@ def _apply_category_demand_modifications_daily(demand_data: dict, modifications:
         
         factor = percentage / Decimal('100')
         
-        forecast_filter = Q(
-            client_id=client_id,
-            week_start_date__gte=get_week_start(mod_start),
-            week_start_date__lte=mod_end
-        )
-        
-        if product_id:
-            forecast_filter &= Q(product_id=product_id)
+        # Weekly forecast totals the modification applies to (possibly preloaded)
+        if modification_totals is not None:
+            totals = modification_totals[mod_index]
         else:
-            forecast_filter &= Q(product_id__in=product_ids)
-        
-        affected_forecasts = DemandForecast.objects.filter(forecast_filter).values(
-            'week_start_date'
-        ).annotate(
-            total_demand=Sum('forecast_quantity')
-        )
+            totals = _modification_totals(mod, product_ids)
         
-        for forecast in affected_forecasts:
-            week_start = forecast['week_start_date']
-            weekly_modification = forecast['total_demand'] * factor
+        for week_start, total_demand in totals.items():
+            weekly_modification = total_demand * factor
             daily_modification = weekly_modification / Decimal('5')
             
             for day_offset in range(5):
@@ -1927,3 +3298,450 @@ def _apply_category_demand_modifications_daily(demand_data: dict, modifications:
                         demand_data[day] = Decimal('0')
     
     return demand_data
+
+
+def _select_active_lines(site_id: Optional[int] = None, line_ids: list = None) -> list:
+    """Active lines (with their site) of one site and/or among line_ids, all by default"""
+    lines = ProductionLine.objects.filter(is_active=True).select_related('site').order_by('site__name', 'name')
+    if site_id:
+        lines = lines.filter(site_id=site_id)
+    if line_ids:
+        lines = lines.filter(id__in=line_ids)
+    return list(lines.only('id', 'name', 'code', 'site__code', 'site__name'))
+
+
+def _load_line_matrices(start_date, end_date, site_id: Optional[int] = None, line_ids: list = None,
+                        shift_configs: list = None, granularity: str = 'week',
+                        concurrent_loads: bool = False) -> Optional[dict]:
+    """
+    Shared loading of the line x period services (heatmap, capacity gap,
+    sensitivity sweep): the selected active lines, one capacity calendar per
+    line and demand from one aggregation grouped by the products' default line.
+    
+    Args:
+        start_date: Start date for simulation
+        end_date: End date for simulation
+        site_id: Optional site to restrict to
+        line_ids: Optional lines to restrict to
+        shift_configs: Optional shift config overrides per line
+        granularity: 'week' or 'day' (weekly demand spread evenly over Mon-Fri,
+            like get_demand_for_lines_daily)
+        concurrent_loads: Run independent data loads on a thread pool (see _run_loads)
+    
+    Returns:
+        Dict with 'lines' (see _select_active_lines), 'line_ids', 'periods',
+        'lines_dict' (see _get_lines_with_configs), 'capacity_by_line' and
+        'demand_by_line' (line_id -> {period -> value}), or None without active lines
+    """
+    lines = _select_active_lines(site_id, line_ids)
+    if not lines:
+        return None
+    line_ids = [line.id for line in lines]
+    
+    config_dict = {}
+    override_dict = {}
+    for sc in shift_configs or []:
+        if sc.get('use_override', False):
+            config_dict[sc['line_id']] = None
+            if sc.get('override_id'):
+                override_dict[sc['line_id']] = sc['override_id']
+        else:
+            config_dict[sc['line_id']] = sc.get('shift_config_id')
+    
+    if granularity == 'day':
+        periods = get_days_in_range(start_date, end_date)
+    else:
+        periods = get_weeks_in_range(start_date, end_date)
+    # Same range as _capacity_by_line, so the lines come from its cache
+    lines_range = ()
+    if periods:
+        lines_range = (periods[0], periods[-1] + timedelta(days=6 if granularity == 'week' else 0))
+    
+    loaded = _run_loads({
+        'lines': partial(_get_lines_with_configs, line_ids, *lines_range),
+        'capacity': partial(_capacity_by_line, line_ids, config_dict, periods, granularity, override_dict),
+        'demand': partial(_sum_demand_by_line_and_week, _get_product_index().product_lines(line_ids),
+                          start_date, end_date),
+    }, concurrent_loads)
+    demand_by_line = loaded['demand']
+    
+    if granularity == 'day':
+        for line_id, weekly_demand in demand_by_line.items():
+            daily_demand = {}
+            for week_start, total_weekly in weekly_demand.items():
+                for day_offset in range(5):
+                    day = week_start + timedelta(days=day_offset)
+                    if start_date <= day <= end_date:
+                        daily_demand[day] = total_weekly / Decimal('5')
+            demand_by_line[line_id] = daily_demand
+    
+    return {
+        'lines': lines,
+        'line_ids': line_ids,
+        'periods': periods,
+        'lines_dict': loaded['lines'],
+        'capacity_by_line': loaded['capacity'],
+        'demand_by_line': demand_by_line,
+    }
+
+
+@reads_from_read_database
+def run_line_heatmap(start_date, end_date,
+                     site_id: Optional[int] = None,
+                     line_ids: list = None,
+                     shift_configs: list = None,
+                     granularity: str = 'week',
+                     forecast_version_id: Optional[int] = None,
+                     concurrent_loads: bool = False) -> dict:
+    """
+    Line x period utilization heatmap of all active lines (or one site's).
+    Demand comes from one aggregation grouped by the products' default line and
+    capacity from one per-line calendar (see _load_line_matrices), instead of one
+    line simulation per line. Each row matches run_line_simulation for that line.
+    
+    Args:
+        start_date: Start date for simulation
+        end_date: End date for simulation
+        site_id: Optional site to restrict to
+        line_ids: Optional lines to restrict to
+        shift_configs: Optional shift config overrides per line
+        granularity: 'week' or 'day'
+        forecast_version_id: Read demand from this ForecastVersion
+        concurrent_loads: Run independent data loads on a thread pool (see _run_loads)
+    
+    Returns:
+        Heatmap dictionary: 'lines' (one row each, with summary stats) and
+        line x period 'demand', 'capacity', 'utilization_percent' and
+        'over_capacity' matrices
+    """
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    
+    matrices = _load_line_matrices(start_date, end_date, site_id, line_ids, shift_configs,
+                                   granularity, concurrent_loads)
+    if matrices is None:
+        return {'error': 'No active lines to simulate'}
+    lines = matrices['lines']
+    periods = matrices['periods']
+    lines_dict = matrices['lines_dict']
+    capacity_by_line = matrices['capacity_by_line']
+    demand_by_line = matrices['demand_by_line']
+    
+    result = {
+        'granularity': granularity,
+        'periods': [_period_label(period, granularity) for period in periods],
+        'period_starts': periods,
+        'lines': [],
+        'demand': [],
+        'capacity': [],
+        'utilization_percent': [],
+        'over_capacity': [],
+    }
+    for line in lines:
+        series = _build_period_series(
+            periods, demand_by_line.get(line.id, {}), capacity_by_line.get(line.id, {}),
+            [line.id], lines_dict, override_offset=3 if granularity == 'week' else 0,
+            flag_missing_capacity=granularity == 'day'
+        )
+        row = {
+            'line_id': line.id,
+            'line_name': line.name,
+            'line_code': line.code,
+            'site_code': line.site.code,
+            'site_name': line.site.name,
+        }
+        row.update(_summarize_series(series))
+        result['lines'].append(row)
+        columns = _series_columns(series, granularity)
+        for name in ('demand', 'capacity', 'utilization_percent', 'over_capacity'):
+            result[name].append(columns[name])
+    
+    result['overloaded_lines'] = sum(1 for row in result['lines'] if row['over_capacity_periods'])
+    if forecast_version_id:
+        result['forecast_version_id'] = forecast_version_id
+    return result
+
+
+@reads_from_read_database
+def run_capacity_gap(start_date, end_date,
+                     site_id: Optional[int] = None,
+                     line_ids: list = None,
+                     shift_configs: list = None,
+                     target_utilization=Decimal('100'),
+                     forecast_version_id: Optional[int] = None) -> dict:
+    """
+    Minimum extra hours per line and week to keep utilization under a target,
+    and the smallest shift configuration providing them (see capacity_gap).
+    Demand and capacity are loaded like run_line_heatmap (see _load_line_matrices).
+    
+    Args:
+        start_date: Start date for simulation
+        end_date: End date for simulation
+        site_id: Optional site to restrict to
+        line_ids: Optional lines to restrict to
+        shift_configs: Optional shift config overrides per line (the current configuration)
+        target_utilization: Utilization % not to exceed
+        forecast_version_id: Read demand from this ForecastVersion
+    
+    Returns:
+        Dictionary with the candidate 'configs' (ShiftConfiguration and
+        CustomShiftConfiguration, by weekly hours) and one row per line with
+        weekly current/required/extra hours and the index of the smallest
+        covering config for weeks with a gap
+    """
+    from .models import CustomShiftConfiguration
+    
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    
+    matrices = _load_line_matrices(start_date, end_date, site_id, line_ids, shift_configs)
+    if matrices is None:
+        return {'error': 'No active lines to simulate'}
+    lines = matrices['lines']
+    line_ids = matrices['line_ids']
+    weeks = matrices['periods']
+    lines_dict = matrices['lines_dict']
+    capacity_by_line = matrices['capacity_by_line']
+    demand_by_line = matrices['demand_by_line']
+    
+    # Candidate configurations, smallest weekly hours first (presets before custom ones on ties)
+    configs = [
+        {'id': config.id, 'name': config.name, 'source': source, 'weekly_hours': round(config.weekly_hours, 2)}
+        for source, model in (('shift_config', ShiftConfiguration), ('custom_shift_config', CustomShiftConfiguration))
+        for config in model.objects.all()
+    ]
+    configs.sort(key=lambda config: config['weekly_hours'])
+    
+    rates = [
+        float(lines_dict[line.id].base_capacity_per_hour * lines_dict[line.id].efficiency_factor)
+        if line.id in lines_dict else 0.0
+        for line in lines
+    ]
+    gap = solve_capacity_gap(
+        period_matrix(demand_by_line, line_ids, weeks),
+        period_matrix(capacity_by_line, line_ids, weeks),
+        rates, float(target_utilization), [config['weekly_hours'] for config in configs]
+    )
+    
+    def hours(value):
+        return None if value != value else round(value, 2)  # NaN: line without a rate
+    
+    rows = []
+    for position, line in enumerate(lines):
+        horizon_index = int(gap['horizon_config_index'][position])
+        rows.append({
+            'line_id': line.id,
+            'line_name': line.name,
+            'line_code': line.code,
+            'site_code': line.site.code,
+            'units_per_hour': round(rates[position], 2),
+            'gap_weeks': int(gap['gap_weeks'][position]),
+            'uncovered_weeks': int(gap['uncovered_weeks'][position]),
+            'total_extra_hours': round(float(gap['total_extra_hours'][position]), 2),
+            'max_extra_hours': round(float(gap['max_extra_hours'][position]), 2),
+            'peak_required_hours': hours(float(gap['peak_required_hours'][position])),
+            # Smallest config covering every week of the horizon
+            'horizon_config_index': horizon_index if horizon_index >= 0 else None,
+            'current_hours': [hours(value) for value in gap['current_hours'][position].tolist()],
+            'required_hours': [hours(value) for value in gap['required_hours'][position].tolist()],
+            'extra_hours': [hours(value) for value in gap['extra_hours'][position].tolist()],
+            'config_index': [None if index < 0 else index for index in gap['config_index'][position].tolist()],
+        })
+    
+    result = {
+        'target_utilization': float(target_utilization),
+        'weeks': [_period_label(week_start, 'week') for week_start in weeks],
+        'week_starts': weeks,
+        'configs': configs,
+        'lines': rows,
+        'lines_with_gap': sum(1 for row in rows if row['gap_weeks']),
+        'total_extra_hours': round(sum(row['total_extra_hours'] for row in rows), 2),
+    }
+    if forecast_version_id:
+        result['forecast_version_id'] = forecast_version_id
+    return result
+
+
+def _sweep_surfaces(stats: dict, index=()) -> dict:
+    """Utilization surfaces (efficiency x cadence nested lists) of one row of sweep_capacity stats"""
+    def rounded(values):
+        return [[round(value, 1) for value in row] for row in values]
+    
+    return {
+        'average_utilization': rounded(stats['average_utilization'][index].tolist()),
+        'peak_utilization': rounded(stats['peak_utilization'][index].tolist()),
+        'over_capacity_periods': stats['over_capacity_periods'][index].tolist(),
+    }
+
+
+def _sweep_current(stats: dict, index=()) -> dict:
+    """Current (unswept) stats of one row of sweep_capacity stats"""
+    return {
+        'average_utilization': round(float(stats['average_utilization'][index]), 1),
+        'peak_utilization': round(float(stats['peak_utilization'][index]), 1),
+        'over_capacity_periods': int(stats['over_capacity_periods'][index]),
+    }
+
+
+@reads_from_read_database
+def run_sensitivity_sweep(start_date, end_date,
+                          site_id: Optional[int] = None,
+                          line_ids: list = None,
+                          shift_configs: list = None,
+                          efficiency_multipliers: list = None,
+                          cadence_multipliers: list = None,
+                          forecast_version_id: Optional[int] = None) -> dict:
+    """
+    Utilization surfaces over a grid of efficiency_factor and
+    base_capacity_per_hour (cadence) multipliers, per line and for all lines
+    pooled (see sensitivity). Read-only: the lines are never edited, the
+    current capacity calendar is scaled instead. Demand and capacity are
+    loaded like run_line_heatmap (see _load_line_matrices).
+    
+    Args:
+        start_date: Start date for simulation
+        end_date: End date for simulation
+        site_id: Optional site to restrict to
+        line_ids: Optional lines to restrict to
+        shift_configs: Optional shift config overrides per line
+        efficiency_multipliers: Multipliers of each line's efficiency_factor (default [1])
+        cadence_multipliers: Multipliers of each line's base_capacity_per_hour (default [1])
+        forecast_version_id: Read demand from this ForecastVersion
+    
+    Returns:
+        Dictionary with one row per line (swept efficiency factors and units
+        per hour, current stats and efficiency x cadence surfaces of average
+        and peak utilization and over-capacity weeks) and the pooled 'total'
+    """
+    if _use_forecast_version(forecast_version_id) is None and forecast_version_id:
+        return {'error': f'Forecast version {forecast_version_id} not found'}
+    
+    efficiency_multipliers = [float(value) for value in efficiency_multipliers or [1]]
+    cadence_multipliers = [float(value) for value in cadence_multipliers or [1]]
+    
+    matrices = _load_line_matrices(start_date, end_date, site_id, line_ids, shift_configs)
+    if matrices is None:
+        return {'error': 'No active lines to simulate'}
+    lines = matrices['lines']
+    line_ids = matrices['line_ids']
+    weeks = matrices['periods']
+    lines_dict = matrices['lines_dict']
+    capacity_by_line = matrices['capacity_by_line']
+    demand_by_line = matrices['demand_by_line']
+    efficiency = [
+        float(lines_dict[line.id].efficiency_factor) if line.id in lines_dict else 0.0 for line in lines
+    ]
+    base_rates = [
+        float(lines_dict[line.id].base_capacity_per_hour) if line.id in lines_dict else 0.0 for line in lines
+    ]
+    
+    sweep = sweep_capacity(
+        period_matrix(demand_by_line, line_ids, weeks),
+        period_matrix(capacity_by_line, line_ids, weeks),
+        efficiency, efficiency_multipliers, cadence_multipliers
+    )
+    
+    rows = []
+    for position, line in enumerate(lines):
+        rows.append({
+            'line_id': line.id,
+            'line_name': line.name,
+            'line_code': line.code,
+            'site_code': line.site.code,
+            'efficiency_factor': efficiency[position],
+            'base_capacity_per_hour': base_rates[position],
+            # Values behind each surface row / column
+            'efficiency_factors': [round(value, 4) for value in sweep['efficiency'][position].tolist()],
+            'capacity_per_hour': [
+                round(base_rates[position] * multiplier, 2) for multiplier in cadence_multipliers
+            ],
+            'current': _sweep_current(sweep['current'], position),
+            **_sweep_surfaces(sweep, position),
+        })
+    
+    result = {
+        'efficiency_multipliers': efficiency_multipliers,
+        'cadence_multipliers': cadence_multipliers,
+        'week_count': len(weeks),
+        'lines': rows,
+        'total': {
+            'current': _sweep_current(sweep['current_total']),
+            **_sweep_surfaces(sweep['total']),
+        },
+    }
+    if forecast_version_id:
+        result['forecast_version_id'] = forecast_version_id
+    return result
+
+
+@reads_from_read_database
+def diff_forecast_versions(base_version_id: int, compare_version_id: int,
+                           start_date, end_date,
+                           line_ids: list = None,
+                           simulation_category_id: Optional[int] = None,
+                           client_codes: list = None,
+                           product_codes: list = None) -> dict:
+    """
+    Week-by-week demand deltas between two forecast versions (compare - base)
+    
+    Args:
+        base_version_id, compare_version_id: ForecastVersion IDs
+        start_date: Start date (its week is included)
+        end_date: End date
+        line_ids: Optional lines, restricting to their products like a line simulation
+        simulation_category_id: Optional category, restricting to its products
+        client_codes: Optional filter by client codes
+        product_codes: Optional filter by product codes
+    
+    Returns:
+        Diff dictionary (see forecast_versions.diff_snapshots)
+    """
+    base = get_forecast_snapshot(base_version_id)
+    if base is None:
+        return {'error': f'Forecast version {base_version_id} not found'}
+    compare = get_forecast_snapshot(compare_version_id)
+    if compare is None:
+        return {'error': f'Forecast version {compare_version_id} not found'}
+    
+    product_ids = None
+    if simulation_category_id:
+        index = _get_product_index()
+        product_ids = index.ids(index.category(simulation_category_id))
+    if line_ids:
+        line_product_ids = _get_product_ids_for_lines(line_ids)
+        product_ids = line_product_ids if product_ids is None else product_ids & line_product_ids
+    
+    warnings = []
+    if product_codes:
+        resolved_products, not_found_products = resolve_codes(Product, product_codes)
+        requested_ids = {p.id for p in resolved_products.values()}
+        product_ids = requested_ids if product_ids is None else set(product_ids) & requested_ids
+        warnings += [f"{code} (not found)" for code in not_found_products]
+    
+    client_ids = None
+    if client_codes:
+        resolved_clients, not_found_clients = resolve_codes(Client, client_codes)
+        # Unknown codes only are ignored, like the client filter of the simulations
+        client_ids = [c.id for c in resolved_clients.values()] or None
+        warnings += [f"{code} (not found)" for code in not_found_clients]
+    
+    result = diff_snapshots(
+        base, compare, get_week_start(start_date), end_date,
+        product_ids=product_ids, client_ids=client_ids
+    )
+    
+    client_names = dict(Client.objects.filter(
+        id__in=[row['client_id'] for row in result['by_client']]
+    ).values_list('id', 'code'))
+    for row in result['by_client']:
+        row['client_code'] = client_names.get(row['client_id'])
+    
+    result.update({
+        'base_version_id': base_version_id,
+        'compare_version_id': compare_version_id,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+    })
+    if warnings:
+        result['filter_warnings'] = warnings
+    return result
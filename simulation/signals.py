@@ -0,0 +1,157 @@
+"""
+Signal handlers for Cerelia Simulation
+Keep the per-table DataVersion counters in step with writes to reference data,
+and the category membership table in step with categories, lines and products.
+Also tunes new SQLite connections (settings.SQLITE_PRAGMAS)
+"""
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import (
+    Site, ShiftConfiguration, ProductionLine, LineConfigOverride,
+    Client, Product, SimulationCategory, CustomShiftConfiguration,
+    LineProductAssignment, DemandForecast, SimulationCategoryProduct, DataVersion
+)
+
+
+# =============================================================================
+# Category membership table (SimulationCategoryProduct)
+# =============================================================================
+
+def _refresh_all_categories():
+    for category in SimulationCategory.objects.all():
+        category.refresh_matching_products()
+
+
+@receiver(post_save, sender=SimulationCategory)
+def _category_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.refresh_matching_products()
+
+
+@receiver(post_save, sender=Product)
+def _product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SimulationCategoryProduct.refresh_for_product(instance)
+
+
+@receiver(post_delete, sender=ProductionLine)
+def _line_deleted(sender, instance, **kwargs):
+    # Products of a deleted line lose their default_line through a bulk
+    # UPDATE (SET_NULL) that sends no product signal
+    _refresh_all_categories()
+
+
+@receiver(m2m_changed, sender=SimulationCategory.lines.through)
+def _category_lines_changed(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # line.simulation_categories was edited
+        for category in SimulationCategory.objects.filter(pk__in=kwargs.get('pk_set') or []):
+            category.refresh_matching_products()
+        if action == 'post_clear':
+            _refresh_all_categories()
+    else:
+        instance.refresh_matching_products()
+    DataVersion.bump(SimulationCategory._meta.model_name)
+
+
+# =============================================================================
+# Data versions
+# =============================================================================
+
+# Tables whose writes are versioned. DemandForecast is deliberately left out:
+# delete signals would disable Django's fast bulk delete on the largest table,
+# so the import command bumps its version explicitly instead.
+# Connected after the membership handlers above so that a new version is only
+# visible once the membership table is up to date (see product_index).
+VERSIONED_MODELS = (
+    Site, ShiftConfiguration, ProductionLine, LineConfigOverride,
+    Client, Product, SimulationCategory, CustomShiftConfiguration,
+    LineProductAssignment,
+)
+
+
+def _bump_model_version(sender, **kwargs):
+    if kwargs.get('raw'):
+        # Fixture loading
+        return
+    DataVersion.bump(sender._meta.model_name)
+
+
+for _model in VERSIONED_MODELS:
+    post_save.connect(_bump_model_version, sender=_model, dispatch_uid=f'version_save_{_model._meta.model_name}')
+    post_delete.connect(_bump_model_version, sender=_model, dispatch_uid=f'version_delete_{_model._meta.model_name}')
+
+# Single forecast edits (API/admin) invalidate the compiled demand store.
+# Deletes are bumped by the views/admin that perform them.
+post_save.connect(_bump_model_version, sender=DemandForecast, dispatch_uid='version_save_demandforecast')
+
+
+# =============================================================================
+# Bulk changes
+# =============================================================================
+
+def _handlers():
+    """(signal, receiver, sender, dispatch_uid) of the handlers above, in connection order"""
+    handlers = [
+        (post_save, _category_saved, SimulationCategory, None),
+        (post_save, _product_saved, Product, None),
+        (post_delete, _line_deleted, ProductionLine, None),
+        (m2m_changed, _category_lines_changed, SimulationCategory.lines.through, None),
+    ]
+    for model in VERSIONED_MODELS:
+        name = model._meta.model_name
+        handlers.append((post_save, _bump_model_version, model, f'version_save_{name}'))
+        handlers.append((post_delete, _bump_model_version, model, f'version_delete_{name}'))
+    handlers.append((post_save, _bump_model_version, DemandForecast, 'version_save_demandforecast'))
+    return handlers
+
+
+@contextmanager
+def bulk_data_changes():
+    """
+    Disconnect the membership and version handlers while reference data is
+    written row by row (imports, clearing tables), then refresh every
+    category's membership and bump every versioned table once. Without
+    listeners, deletes of these models also go back to Django's fast delete.
+    Signals are process-wide: meant for management commands, not requests.
+    """
+    handlers = _handlers()
+    for signal, handler, sender, dispatch_uid in handlers:
+        signal.disconnect(handler, sender=sender, dispatch_uid=dispatch_uid)
+    try:
+        yield
+    finally:
+        for signal, handler, sender, dispatch_uid in handlers:
+            signal.connect(handler, sender=sender, dispatch_uid=dispatch_uid)
+    _refresh_all_categories()
+    DataVersion.bump(*(model._meta.model_name for model in VERSIONED_MODELS))
+
+
+
+# =============================================================================
+# SQLite connection tuning
+# =============================================================================
+
+@receiver(connection_created)
+def _tune_sqlite_connection(sender, connection, **kwargs):
+    """
+    Apply settings.SQLITE_PRAGMAS to every new SQLite connection.
+    journal_mode is stored in the database file and needs write access, so
+    read-only connections skip it and follow the mode set through default.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    read_only = 'mode=ro' in str(connection.settings_dict['NAME'])
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            if name == 'journal_mode' and read_only:
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
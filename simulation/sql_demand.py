@@ -0,0 +1,91 @@
+"""
+Server-side demand aggregation for Cerelia Simulation (PostgreSQL)
+Week bucketing, daily spreading and demand modification factors are done in a
+single generate_series query, so large multi-site daily simulations only move
+one row per day out of the database.
+Enabled with settings.SIMULATION_SQL_PUSHDOWN when the read database is PostgreSQL.
+"""
+
+from django.conf import settings
+from django.db import connections, router
+
+from .models import DemandForecast
+
+
+def sql_pushdown_enabled() -> bool:
+    """True when daily line demand should be computed by the database"""
+    if not getattr(settings, 'SIMULATION_SQL_PUSHDOWN', False):
+        return False
+    return connections[router.db_for_read(DemandForecast)].vendor == 'postgresql'
+
+
+def daily_demand_rows(product_ids, client_ids, start_date, end_date, modifications: list) -> list:
+    """
+    Daily demand of a line simulation and the daily delta of each modification.
+
+    Weekly forecasts are spread evenly over Monday-Friday, like
+    get_demand_for_lines_daily; a modification's weekly total times its factor is
+    spread the same way over the days of its window (apply_demand_modifications_daily).
+    The deltas are returned unapplied because each one is clamped at zero in turn.
+
+    Args:
+        product_ids: Products of the base demand
+        client_ids: Clients of the base demand, all clients when empty
+        start_date, end_date: Simulated days
+        modifications: Dicts with client_id, product_ids, start_date, end_date
+            (the modification window) and factor
+
+    Returns:
+        (day, daily_demand, *modification_deltas) rows for working days with base
+        demand, ordered by day; a delta is None where its modification doesn't apply
+    """
+    connection = connections[router.db_for_read(DemandForecast)]
+    table = connection.ops.quote_name(DemandForecast._meta.db_table)
+
+    base_filter = 'product_id = ANY(%s) AND week_start_date >= %s'
+    base_params = [list(product_ids), start_date]
+    if client_ids:
+        base_filter += ' AND client_id = ANY(%s)'
+        base_params.append(list(client_ids))
+
+    modification_sums, modification_sum_params = [], []
+    modification_columns, modification_column_params = [], []
+    for index, mod in enumerate(modifications):
+        modification_sums.append(
+            f',\n               SUM(forecast_quantity) FILTER (WHERE client_id = %s AND product_id = ANY(%s)'
+            f' AND week_start_date >= date_trunc(\'week\', %s::date) AND week_start_date <= %s) AS mod_{index}'
+        )
+        modification_sum_params += [mod['client_id'], list(mod['product_ids']), mod['start_date'], mod['end_date']]
+        modification_columns.append(
+            f',\n           CASE WHEN days.day BETWEEN %s AND %s THEN weekly.mod_{index} * %s / 5 END'
+        )
+        modification_column_params += [mod['start_date'], mod['end_date'], mod['factor']]
+
+    sql = f"""
+    WITH days AS (
+        SELECT series.day::date AS day, date_trunc('week', series.day)::date AS week_start
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') AS series(day)
+        WHERE EXTRACT(ISODOW FROM series.day) <= 5
+    ),
+    weekly AS (
+        SELECT week_start_date,
+               SUM(forecast_quantity) FILTER (WHERE {base_filter}) AS base{''.join(modification_sums)}
+        FROM {table}
+        WHERE week_start_date >= date_trunc('week', %s::date) AND week_start_date <= %s
+        GROUP BY week_start_date
+    )
+    SELECT days.day, weekly.base / 5{''.join(modification_columns)}
+    FROM days
+    JOIN weekly ON weekly.week_start_date = days.week_start
+    WHERE weekly.base IS NOT NULL
+    ORDER BY days.day
+    """
+    params = (
+        [start_date, end_date]
+        + base_params + modification_sum_params
+        + [start_date, end_date]
+        + modification_column_params
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
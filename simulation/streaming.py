@@ -0,0 +1,123 @@
+"""
+Streaming JSON responses for Cerelia Simulation
+Encodes simulation results incrementally so long daily horizons are never
+held in memory as a whole nor serialized in one shot
+"""
+
+from collections.abc import Iterator
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to DRF's encoder
+    orjson = None
+
+
+# Size of the chunks handed to the WSGI/ASGI server
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_fallback_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _orjson_default(obj):
+    """Encode Decimals as floats, like DRF's JSONRenderer does"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def encode_json(value) -> bytes:
+    """Encode a value to JSON bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_orjson_default)
+    return _fallback_encoder.encode(value).encode('utf-8')
+
+
+def _is_lazy(value) -> bool:
+    """True for generators and for dicts that contain one"""
+    if isinstance(value, Iterator):
+        return True
+    if isinstance(value, dict):
+        return any(_is_lazy(item) for item in value.values())
+    return False
+
+
+def iter_json(value):
+    """
+    Yield the JSON encoding of value piece by piece.
+
+    Iterators are encoded as arrays while being consumed. Within a dict, lazy
+    entries are emitted first so that generators which fill in the remaining
+    keys (e.g. an overlay's total_demand) have run before those keys are read.
+    """
+    if isinstance(value, Iterator):
+        yield b'['
+        for index, item in enumerate(value):
+            if index:
+                yield b','
+            yield from iter_json(item)
+        yield b']'
+    elif isinstance(value, dict) and _is_lazy(value):
+        yield b'{'
+        lazy_keys = [key for key, item in value.items() if _is_lazy(item)]
+        for index, key in enumerate(lazy_keys):
+            if index:
+                yield b','
+            yield encode_json(str(key)) + b':'
+            yield from iter_json(value[key])
+        # Plain keys are read afterwards: the lazy entries may have filled them in
+        plain_keys = [key for key in value if key not in lazy_keys]
+        for key in plain_keys:
+            yield b',' + encode_json(str(key)) + b':'
+            yield encode_json(value[key])
+        yield b'}'
+    else:
+        yield encode_json(value)
+
+
+def _chunked(pieces, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Group small encoded pieces into larger chunks"""
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def streaming_json_response(result, status: int = 200) -> StreamingHttpResponse:
+    """Build a streamed application/json response for a simulation result"""
+    return StreamingHttpResponse(
+        _chunked(iter_json(result)),
+        content_type='application/json',
+        status=status
+    )
+
+
+async def _aiter_chunks(chunks):
+    """
+    Consume a sync chunk iterator from async code. Lazy data points may hit
+    the database, so every step runs in the sync thread.
+    """
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+def as_async_streaming(response: StreamingHttpResponse) -> StreamingHttpResponse:
+    """
+    Make a streamed response of a sync view (see streaming_json_response)
+    consumable by ASGI servers chunk by chunk instead of buffered whole
+    """
+    response.streaming_content = _aiter_chunks(response.streaming_content)
+    return response
@@ -1,3 +1,1218 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Count, F, Sum
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import archive, demand_store, forecast_versions, product_index, services, views
+from .archive import archive_forecasts, archive_live_past_weeks
+from .build_ahead import smooth_build_ahead
+from .client_impact import rank_client_impacts
+from .demand_store import build_demand_store, demand_store_status, get_demand_store
+from .facets import FACET_FIELDS, get_product_facets
+from .forecast_versions import create_forecast_version, diff_snapshots, get_forecast_snapshot
+from .product_index import get_product_index
+from .signals import bulk_data_changes
+from .models import (
+    Site, ShiftConfiguration, ProductionLine, Client, Product, DemandForecast, DataVersion,
+    SimulationCategory, SimulationCategoryProduct, ArchivedDemandForecast, LineConfigOverride
+)
+
+
+FIRST_WEEK = date(2026, 1, 5)
+WEEK_COUNT = 8
+
+
+def create_simulation_data():
+    """
+    Two lines of one site, three products per line, three clients and
+    WEEK_COUNT weeks of forecasts for every client/product pair (quantities
+    with cents, so rounding mistakes show up).
+
+    Returns:
+        Dict with the created 'site', 'config', 'lines', 'products' and 'clients'
+    """
+    site = Site.objects.create(name='Test site', code='TS')
+    config = ShiftConfiguration.objects.create(
+        name='2x8', shifts_per_day=2, hours_per_shift=Decimal('8'), days_per_week=5
+    )
+    lines = [
+        ProductionLine.objects.create(
+            site=site, name=f'Line {number}', code=f'L{number}', default_shift_config=config,
+            base_capacity_per_hour=Decimal('40'), efficiency_factor=Decimal('0.85')
+        )
+        for number in (1, 2)
+    ]
+    products = [
+        Product.objects.create(
+            code=f'P{number}', name=f'Product {number}', default_line=lines[number % 2],
+            product_type='Dough' if number % 3 else 'Crust', recipe_type=f'R{number % 2}'
+        )
+        for number in range(6)
+    ]
+    clients = [Client.objects.create(name=f'Client {number}', code=f'C{number}') for number in range(3)]
+
+    forecasts = []
+    for week in range(WEEK_COUNT):
+        week_start = FIRST_WEEK + timedelta(weeks=week)
+        year, week_number, _ = week_start.isocalendar()
+        for client_number, client in enumerate(clients):
+            for product_number, product in enumerate(products):
+                quantity = Decimal(100 * (client_number + 1) + 37 * product_number + 11 * week) + Decimal('0.25')
+                forecasts.append(DemandForecast(
+                    client=client, product=product, year=year, week_number=week_number,
+                    week_start_date=week_start, forecast_quantity=quantity
+                ))
+    DemandForecast.objects.bulk_create(forecasts)
+    DataVersion.bump('demandforecast')
+    return {'site': site, 'config': config, 'lines': lines, 'products': products, 'clients': clients}
+
+
+def forecast_totals(*fields, **filters):
+    """
+    Reference aggregation straight from the DemandForecast rows: sum of
+    forecast_quantity per value (or tuple of values) of fields
+    """
+    rows = DemandForecast.objects.filter(**filters).values(*fields).annotate(
+        total=Sum('forecast_quantity')
+    ).order_by()
+    return {
+        row[fields[0]] if len(fields) == 1 else tuple(row[field] for field in fields): row['total']
+        for row in rows
+    }
+
+
+def nested(totals):
+    """{(key, week): total} -> {key: {week: total}}"""
+    result = {}
+    for (key, week), total in totals.items():
+        result.setdefault(key, {})[week] = total
+    return result
+
+
+class SimulationDataMixin:
+    """Fixture data, an empty demand store directory and fresh caches for each test"""
+
+    databases = {'default', 'read'}
+
+    def setUp(self):
+        super().setUp()
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir, ignore_errors=True)
+        settings_override = override_settings(DEMAND_STORE_DIR=store_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        services.clear_caches()
+        # Process-wide snapshots are keyed by IDs and versions the test
+        # database hands out again in every test
+        for patcher in (
+            mock.patch.object(product_index, '_index', None),
+            mock.patch.object(demand_store, '_store', None),
+            mock.patch.object(demand_store, '_stale_warned_version', None),
+            mock.patch.object(archive, '_cutoff', None),
+            mock.patch.dict(forecast_versions._snapshots, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.data = create_simulation_data()
+        self.line_ids = [line.id for line in self.data['lines']]
+        self.shift_configs = [
+            {'line_id': line_id, 'shift_config_id': self.data['config'].id} for line_id in self.line_ids
+        ]
+
+    @property
+    def last_week(self):
+        return FIRST_WEEK + timedelta(weeks=WEEK_COUNT - 1)
+
+    def run_line_simulation(self, **kwargs):
+        services.clear_caches()
+        kwargs.setdefault('line_ids', self.line_ids)
+        kwargs.setdefault('shift_configs', self.shift_configs)
+        result = services.run_line_simulation(
+            start_date=FIRST_WEEK, end_date=self.last_week + timedelta(days=6), **kwargs
+        )
+        result.pop('result_token', None)
+        return result
+
+
+class ForecastVersionIsolationTests(SimulationDataMixin, TransactionTestCase):
+    """A simulation on a forecast version and one on the current forecasts, at the same time"""
+
+    def test_concurrent_simulations_keep_their_own_forecast_version(self):
+        version = create_forecast_version('Before doubling')
+        DemandForecast.objects.update(forecast_quantity=F('forecast_quantity') * 2)
+        DataVersion.bump('demandforecast')
+
+        expected = {
+            'version': self.run_line_simulation(forecast_version_id=version.id)['total_demand'],
+            'current': self.run_line_simulation()['total_demand'],
+        }
+        self.assertEqual(expected['current'], expected['version'] * 2)
+
+        # Both threads pick their forecast version, then read demand only once
+        # the other one has picked its own as well
+        barrier = threading.Barrier(2, timeout=10)
+        waited = threading.local()
+        sum_demand_by_week = services._sum_demand_by_week
+
+        def sum_demand_after_barrier(*args, **kwargs):
+            if not getattr(waited, 'done', False):
+                waited.done = True
+                barrier.wait()
+            return sum_demand_by_week(*args, **kwargs)
+
+        results = {}
+
+        def simulate(name, forecast_version_id):
+            try:
+                results[name] = self.run_line_simulation(forecast_version_id=forecast_version_id)['total_demand']
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(services, '_sum_demand_by_week', sum_demand_after_barrier):
+            threads = [
+                threading.Thread(target=simulate, args=('version', version.id)),
+                threading.Thread(target=simulate, args=('current', None)),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, expected)
+
+
+class ForecastSnapshotTests(SimulationDataMixin, TransactionTestCase):
+    """Forecast version snapshots against the DemandForecast rows they were taken from"""
+
+    def setUp(self):
+        super().setUp()
+        # A pair with a zero forecast one week, a single cent another and no
+        # row at all the other weeks
+        self.sparse_product = Product.objects.create(code='P6', name='Product 6', default_line=self.data['lines'][0])
+        client = self.data['clients'][2]
+        for week, quantity in ((1, Decimal('0')), (3, Decimal('0.01'))):
+            week_start = FIRST_WEEK + timedelta(weeks=week)
+            DemandForecast.objects.create(
+                client=client, product=self.sparse_product, year=week_start.isocalendar()[0],
+                week_number=week_start.isocalendar()[1], week_start_date=week_start, forecast_quantity=quantity
+            )
+        self.product_ids = list(Product.objects.values_list('id', flat=True))
+
+    def test_snapshot_encoding(self):
+        snapshot = get_forecast_snapshot(create_forecast_version('Sparse').id)
+        row = (snapshot.clients == self.data['clients'][2].id) & (snapshot.products == self.sparse_product.id)
+        self.assertEqual(snapshot.qty_cents[row].tolist(), [[-1, 0, -1, 1] + [-1] * (WEEK_COUNT - 4)])
+        self.assertEqual(
+            snapshot.weekly_demand([self.sparse_product.id], FIRST_WEEK, self.last_week),
+            {FIRST_WEEK + timedelta(weeks=1): Decimal('0.00'), FIRST_WEEK + timedelta(weeks=3): Decimal('0.01')}
+        )
+
+    def test_snapshot_matches_forecast_rows(self):
+        snapshot = get_forecast_snapshot(create_forecast_version('Current').id)
+        week_end = FIRST_WEEK + timedelta(weeks=5)
+        client_ids = [self.data['clients'][0].id, self.data['clients'][2].id]
+        product_lines = dict(Product.objects.values_list('id', 'default_line_id'))
+
+        self.assertEqual(
+            snapshot.weekly_demand(self.product_ids, FIRST_WEEK, week_end),
+            forecast_totals('week_start_date', week_start_date__lte=week_end)
+        )
+        self.assertEqual(
+            snapshot.weekly_demand(self.product_ids[1:], FIRST_WEEK, week_end, client_ids=client_ids),
+            forecast_totals(
+                'week_start_date', product_id__in=self.product_ids[1:], client_id__in=client_ids,
+                week_start_date__lte=week_end
+            )
+        )
+        self.assertEqual(
+            snapshot.weekly_demand_by_group(product_lines, FIRST_WEEK, week_end, client_ids=client_ids),
+            nested(forecast_totals(
+                'product__default_line_id', 'week_start_date', client_id__in=client_ids,
+                week_start_date__lte=week_end
+            ))
+        )
+        self.assertEqual(
+            snapshot.weekly_demand_by_client(self.product_ids, FIRST_WEEK, week_end),
+            nested(forecast_totals('client_id', 'week_start_date', week_start_date__lte=week_end))
+        )
+
+        current = self.run_line_simulation(overlay_client_codes=['C1'])
+        versioned = self.run_line_simulation(overlay_client_codes=['C1'], forecast_version_id=snapshot.version_id)
+        self.assertEqual(versioned.pop('overlay_data'), {'forecast_version_id': snapshot.version_id})
+        current.pop('overlay_data')
+        self.assertEqual(versioned, current)
+
+    def test_diff_snapshots_matches_forecast_rows(self):
+        base = get_forecast_snapshot(create_forecast_version('Base').id)
+        base_weeks = forecast_totals('week_start_date')
+        base_clients = forecast_totals('client_id')
+
+        clients = self.data['clients']
+        DemandForecast.objects.filter(client=clients[0]).update(forecast_quantity=F('forecast_quantity') * 2)
+        DemandForecast.objects.filter(client=clients[1], week_start_date=FIRST_WEEK).delete()
+        DemandForecast.objects.create(
+            client=clients[2], product=self.sparse_product, year=2026, week_number=2,
+            week_start_date=FIRST_WEEK, forecast_quantity=Decimal('12.34')
+        )
+        DataVersion.bump('demandforecast')
+        compare = get_forecast_snapshot(create_forecast_version('Compare').id)
+        compare_weeks = forecast_totals('week_start_date')
+        compare_clients = forecast_totals('client_id')
+
+        diff = diff_snapshots(base, compare, FIRST_WEEK, self.last_week)
+        weeks = sorted(base_weeks)
+        self.assertEqual(diff['weeks'], [week.isoformat() for week in weeks])
+        self.assertEqual(diff['base'], [float(base_weeks[week]) for week in weeks])
+        self.assertEqual(diff['compare'], [float(compare_weeks[week]) for week in weeks])
+        self.assertEqual(diff['delta'], [float(compare_weeks[week] - base_weeks[week]) for week in weeks])
+        self.assertEqual(diff['totals']['delta'], float(sum(compare_weeks.values()) - sum(base_weeks.values())))
+        self.assertEqual(
+            {row['client_id']: row['delta'] for row in diff['by_client']},
+            {client_id: float(compare_clients[client_id] - base_clients[client_id]) for client_id in base_clients}
+        )
+        deltas = [abs(row['delta']) for row in diff['by_client']]
+        self.assertEqual(deltas, sorted(deltas, reverse=True))
+
+
+class ProductIndexTests(SimulationDataMixin, TransactionTestCase):
+    """Bitset product index against the equivalent Product queries"""
+
+    def product_ids(self, **filters):
+        return set(Product.objects.filter(is_active=True, **filters).values_list('id', flat=True))
+
+    def test_index_matches_product_queries(self):
+        line_1, line_2 = self.data['lines']
+        Product.objects.create(code='P6', name='Inactive', default_line=line_1, product_type='Dough', is_active=False)
+        Product.objects.create(code='P7', name='No line', product_type='Dough')
+        category = SimulationCategory.objects.create(name='Dough R1', product_types='Dough', recipe_types='R1')
+        category.lines.set([line_1, line_2])
+        index = get_product_index()
+
+        self.assertEqual(index.ids(index.all()), self.product_ids())
+        self.assertEqual(index.ids(index.lines([line_1.id])), self.product_ids(default_line=line_1))
+        self.assertEqual(
+            index.product_lines([line_2.id]),
+            dict(Product.objects.filter(is_active=True, default_line=line_2).values_list('id', 'default_line_id'))
+        )
+        self.assertEqual(
+            index.ids(index.attribute('product_type', ['Dough']) & index.lines([line_1.id, line_2.id])),
+            self.product_ids(product_type='Dough', default_line__isnull=False)
+        )
+        self.assertEqual(
+            index.ids(index.lines([line_2.id]) & index.bitset_not(index.attribute('recipe_type', ['R1']))),
+            self.product_ids(default_line=line_2) - self.product_ids(recipe_type='R1')
+        )
+        self.assertEqual(index.count(index.bitset_not(index.all())), 0)
+        self.assertEqual(
+            index.ids(index.category(category.id)),
+            set(category.compute_matching_products().values_list('id', flat=True))
+        )
+        known = [product.id for product in self.data['products'][:2]]
+        self.assertEqual(index.ids(index.products(known + [0, 10 ** 6])), set(known))
+
+    def test_index_follows_product_writes(self):
+        index = get_product_index()
+        product = self.data['products'][0]
+        product.default_line = self.data['lines'][1]
+        product.save()
+
+        rebuilt = get_product_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(
+            rebuilt.ids(rebuilt.lines([product.default_line_id])), self.product_ids(default_line=product.default_line)
+        )
+
+
+class ConditionalGetTests(SimulationDataMixin, TransactionTestCase):
+    """ETags of reference data endpoints against writes to the tables they depend on"""
+
+    def assert_not_modified(self, url, etag):
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def assert_modified(self, url, etag):
+        """Returns the new ETag"""
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assert_not_modified(url, response['ETag'])
+        return response['ETag']
+
+    def test_writes_change_the_etag(self):
+        line = self.data['lines'][0]
+        for url in ('/api/lines/', f'/api/lines/{line.id}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                self.assert_not_modified(url, etag)
+
+                # Tables the lines are not serialized from keep the tag
+                self.data['clients'][0].save()
+                self.assert_not_modified(url, etag)
+
+                line.name = f'{line.name}*'
+                line.save()
+                etag = self.assert_modified(url, etag)
+
+                self.data['site'].save()
+                etag = self.assert_modified(url, etag)
+
+                LineConfigOverride.objects.create(
+                    line=line, start_date=FIRST_WEEK, end_date=FIRST_WEEK + timedelta(days=6),
+                    shifts_per_day=3, hours_per_shift=Decimal('8')
+                )
+                self.assert_modified(url, etag)
+
+
+class ProductFacetTests(SimulationDataMixin, TransactionTestCase):
+    """Cross-filtered facet counts against product queries, and their invalidation"""
+
+    URL = '/api/simulation-categories/product_attributes/'
+
+    def setUp(self):
+        super().setUp()
+        for code, material_type in (('P1', 'Flour'), ('P2', 'Flour'), ('P4', 'Rye'), ('P5', 'Rye')):
+            Product.objects.filter(code=code).update(material_type=material_type)
+        DataVersion.bump('product')
+
+    def expected_counts(self, name, selected):
+        """Counts of a facet's values among active products matching the other facets' selections"""
+        products = Product.objects.filter(is_active=True).exclude(**{name: ''})
+        filters = {f'{other}__in': values for other, values in selected.items() if other != name}
+        counts = dict(products.filter(**filters).values_list(name).annotate(count=Count('id')))
+        values = sorted(set(products.values_list(name, flat=True)))
+        return [{'value': value, 'count': counts.get(value, 0)} for value in values]
+
+    def test_counts_match_product_queries(self):
+        selected = {'product_type': ['Dough'], 'recipe_type': ['R1']}
+        facets = get_product_facets(selected=selected)
+        for name in FACET_FIELDS:
+            with self.subTest(facet=name):
+                self.assertEqual(facets['facets'][name], self.expected_counts(name, selected))
+        self.assertEqual(facets['match_count'], Product.objects.filter(
+            is_active=True, product_type__in=['Dough'], recipe_type__in=['R1']
+        ).count())
+        self.assertEqual(facets['total_products'], Product.objects.filter(is_active=True).count())
+        # Each facet applies the other facet's selection only: P3 is R1 Crust, P2/P4 R0 Dough
+        self.assertEqual(facets['facets']['product_type'], [{'value': 'Crust', 'count': 1},
+                                                            {'value': 'Dough', 'count': 2}])
+        self.assertEqual(facets['facets']['recipe_type'], [{'value': 'R0', 'count': 2},
+                                                           {'value': 'R1', 'count': 2}])
+        self.assertEqual(facets['facets']['material_type'], [{'value': 'Flour', 'count': 1},
+                                                             {'value': 'Rye', 'count': 1}])
+
+    def test_product_writes_change_the_cache_key_and_etag(self):
+        query = {'product_types': 'Dough'}
+        with mock.patch('simulation.facets.cache', wraps=cache) as facet_cache:
+            first = self.client.get(self.URL, query)
+            self.assertEqual(first.status_code, 200)
+            etag = first['ETag']
+            self.assertEqual(self.client.get(self.URL, query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            product = Product.objects.get(code='P0')
+            product.product_type = 'Dough'
+            product.save()
+            second = self.client.get(self.URL, query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], etag)
+        keys = [call.args[0] for call in facet_cache.get.call_args_list]
+        self.assertEqual(len(keys), 2)
+        self.assertNotEqual(keys[0], keys[1])
+        counts = {entry['value']: entry['count'] for entry in second.json()['facets']['product_type']}
+        self.assertEqual(counts, {'Crust': 1, 'Dough': 5})
+
+
+class DemandStoreTests(SimulationDataMixin, TransactionTestCase):
+    """Memory-mapped demand store against the ORM aggregations it replaces"""
+
+    def modifications(self):
+        clients, products = self.data['clients'], self.data['products']
+        return [
+            {'client_id': clients[0].id, 'product_id': None, 'percentage': Decimal('-40'),
+             'start_date': FIRST_WEEK + timedelta(days=3), 'end_date': FIRST_WEEK + timedelta(weeks=4)},
+            {'client_id': clients[2].id, 'product_id': products[3].id, 'percentage': Decimal('250'),
+             'start_date': FIRST_WEEK + timedelta(weeks=2), 'end_date': self.last_week},
+        ]
+
+    def test_store_matches_forecast_rows(self):
+        build_demand_store()
+        store = get_demand_store()
+        self.assertIsNotNone(store)
+        product_ids = [product.id for product in self.data['products']]
+        client_ids = [self.data['clients'][1].id]
+        week_start, week_end = FIRST_WEEK + timedelta(weeks=1), FIRST_WEEK + timedelta(weeks=6)
+        dates = {'week_start_date__gte': week_start, 'week_start_date__lte': week_end}
+
+        self.assertEqual(
+            store.weekly_demand(product_ids[::2], week_start, week_end),
+            forecast_totals('week_start_date', product_id__in=product_ids[::2], **dates)
+        )
+        self.assertEqual(
+            store.weekly_demand(product_ids + [10 ** 6], week_start, week_end, client_ids=client_ids),
+            forecast_totals('week_start_date', client_id__in=client_ids, **dates)
+        )
+        self.assertEqual(
+            store.weekly_demand_by_group(
+                dict(Product.objects.values_list('id', 'default_line_id')), week_start, week_end
+            ),
+            nested(forecast_totals('product__default_line_id', 'week_start_date', **dates))
+        )
+        self.assertEqual(
+            store.weekly_demand_by_client(product_ids[1:], week_start, week_end),
+            nested(forecast_totals('client_id', 'week_start_date', product_id__in=product_ids[1:], **dates))
+        )
+
+    def test_forecast_edits_mark_the_store_stale(self):
+        build_demand_store()
+        self.assertFalse(demand_store_status()['stale'])
+        store = get_demand_store()
+
+        forecast = DemandForecast.objects.first()
+        response = self.client.patch(
+            f'/api/forecasts/{forecast.id}/', {'forecast_quantity': '1.50'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        status = self.client.get('/api/forecasts/store-status/').json()
+        self.assertEqual(status['store_version'], store.version)
+        self.assertTrue(status['stale'])
+        with self.assertLogs('simulation.demand_store', 'WARNING'):
+            self.assertIsNone(get_demand_store())
+
+        call_command('build_demand_store', '--if-stale', stdout=io.StringIO())
+        self.assertFalse(demand_store_status()['stale'])
+        self.assertEqual(
+            get_demand_store().weekly_demand([forecast.product_id], FIRST_WEEK, self.last_week, [forecast.client_id]),
+            forecast_totals('week_start_date', product_id=forecast.product_id, client_id=forecast.client_id)
+        )
+
+    def test_simulations_match_orm(self):
+        build_demand_store()
+        simulations = {
+            'weekly': {'overlay_client_codes': ['C0', 'C2'], 'demand_modifications': self.modifications()},
+            'daily': {'granularity': 'day', 'client_codes': ['C1', 'C2'], 'demand_modifications': self.modifications()},
+            'products': {'product_codes': ['P1', 'P4'], 'overlay_client_codes': ['C1']},
+        }
+        for name, kwargs in simulations.items():
+            with self.subTest(name):
+                from_store = self.run_line_simulation(**kwargs)
+                self.assertIsNotNone(services._get_demand_store())
+                with override_settings(DEMAND_STORE_ENABLED=False):
+                    self.assertEqual(self.run_line_simulation(**kwargs), from_store)
+
+        def heatmap():
+            services.clear_caches()
+            return services.run_line_heatmap(FIRST_WEEK, self.last_week, shift_configs=self.shift_configs)
+
+        from_store = heatmap()
+        with override_settings(DEMAND_STORE_ENABLED=False):
+            self.assertEqual(heatmap(), from_store)
+
+
+@skipUnless(connections['read'].vendor == 'postgresql', 'SQL pushdown is PostgreSQL only')
+class SqlPushdownTests(SimulationDataMixin, TransactionTestCase):
+    """Daily demand computed by generate_series against the Python spreading"""
+
+    def test_pushdown_matches_python_daily_demand(self):
+        clients, products = self.data['clients'], self.data['products']
+        modifications = [
+            {'client_id': clients[0].id, 'product_id': None, 'percentage': Decimal('-100'),
+             'start_date': FIRST_WEEK + timedelta(days=2), 'end_date': FIRST_WEEK + timedelta(weeks=2, days=1)},
+            {'client_id': clients[1].id, 'product_id': products[2].id, 'percentage': Decimal('35.5'),
+             'start_date': FIRST_WEEK + timedelta(weeks=3), 'end_date': self.last_week},
+        ]
+        simulations = {
+            'all': {},
+            'clients': {'client_codes': ['C0', 'C1'], 'demand_modifications': modifications},
+            'products': {'product_codes': ['P0', 'P3'], 'client_codes': ['C2'], 'demand_modifications': modifications},
+        }
+        for name, kwargs in simulations.items():
+            with self.subTest(name):
+                with override_settings(SIMULATION_SQL_PUSHDOWN=False):
+                    expected = self.run_line_simulation(granularity='day', **kwargs)
+                with override_settings(SIMULATION_SQL_PUSHDOWN=True), \
+                        mock.patch.object(services, 'daily_demand_rows', wraps=services.daily_demand_rows) as rows:
+                    self.assertEqual(self.run_line_simulation(granularity='day', **kwargs), expected)
+                rows.assert_called_once()
+
+
+class DownsamplingTests(SimulationDataMixin, TransactionTestCase):
+    """Downsampled charts against the full resolution series they summarize"""
+
+    SUMMARY = ('total_demand', 'total_capacity', 'average_utilization', 'peak_utilization', 'over_capacity_periods')
+
+    def simulate(self, granularity, **kwargs):
+        return self.run_line_simulation(
+            granularity=granularity, response_format='columnar', overlay_client_codes=['C1'], **kwargs
+        )
+
+    def assert_summary_equal(self, downsampled, full):
+        self.assertEqual({key: downsampled[key] for key in self.SUMMARY}, {key: full[key] for key in self.SUMMARY})
+        self.assertEqual(
+            downsampled['client_overlays']['C1']['total_demand'], full['client_overlays']['C1']['total_demand']
+        )
+
+    def test_minmax_buckets_match_full_series(self):
+        for granularity, max_points in (('week', 3), ('day', 7)):
+            with self.subTest(granularity):
+                full = self.simulate(granularity)
+                downsampled = self.simulate(granularity, max_points=max_points)
+                self.assert_summary_equal(downsampled, full)
+                columns, full_columns = downsampled['columns'], full['columns']
+                self.assertEqual(len(columns['date']), max_points)
+
+                periods = full_columns['period_start']
+                stops = [periods.index(period_end) + 1 for period_end in columns['period_end']]
+                starts = [periods.index(period) for period in columns['period_start']]
+                self.assertEqual(starts, [0] + stops[:-1])
+                self.assertEqual(stops[-1], len(periods))
+                for position, (start, stop) in enumerate(zip(starts, stops)):
+                    demand = full_columns['demand'][start:stop]
+                    utilization = [
+                        value for value in full_columns['utilization_percent'][start:stop] if value is not None
+                    ]
+                    self.assertAlmostEqual(columns['demand'][position], sum(demand) / len(demand), places=6)
+                    self.assertEqual(columns['demand_min'][position], min(demand))
+                    self.assertEqual(columns['demand_max'][position], max(demand))
+                    self.assertEqual(columns['utilization_min'][position], min(utilization))
+                    self.assertEqual(columns['utilization_max'][position], max(utilization))
+                    self.assertEqual(
+                        columns['over_capacity'][position], any(full_columns['over_capacity'][start:stop])
+                    )
+
+    def test_lttb_keeps_actual_periods(self):
+        for granularity, max_points in (('week', 4), ('day', 9)):
+            with self.subTest(granularity):
+                full = self.simulate(granularity)
+                downsampled = self.simulate(granularity, max_points=max_points, bucket='lttb')
+                self.assert_summary_equal(downsampled, full)
+                columns, full_columns = downsampled['columns'], full['columns']
+                self.assertEqual(len(columns['date']), max_points)
+
+                periods = full_columns['period_start']
+                positions = [periods.index(period) for period in columns['period_start']]
+                self.assertEqual(positions, sorted(set(positions)))
+                self.assertEqual((positions[0], positions[-1]), (0, len(periods) - 1))
+                for name in ('demand', 'capacity', 'utilization_percent', 'over_capacity'):
+                    self.assertEqual(columns[name], [full_columns[name][position] for position in positions])
+                self.assertEqual(
+                    downsampled['client_overlays']['C1']['demand'],
+                    [full['client_overlays']['C1']['demand'][position] for position in positions]
+                )
+
+
+class DailyStreamTests(SimulationDataMixin, TransactionTestCase):
+    """Streamed daily data points computed day by day against the built series"""
+
+    def materialize(self, result):
+        return services._materialize_data_points(result)
+
+    def test_line_stream_matches_built_series(self):
+        # Lines without shifts have demand but no capacity (days flagged 999%)
+        stopped = ShiftConfiguration.objects.create(
+            name='Stopped', shifts_per_day=0, hours_per_shift=Decimal('8'), days_per_week=5
+        )
+        stopped_configs = [{'line_id': line_id, 'shift_config_id': stopped.id} for line_id in self.line_ids]
+        for kwargs in (
+            {}, {'client_codes': ['C1'], 'overlay_client_codes': ['C2']},
+            {'shift_configs': stopped_configs}, {'max_points': 9}
+        ):
+            with self.subTest(kwargs=list(kwargs)):
+                built = self.run_line_simulation(granularity='day', **kwargs)
+                with mock.patch.object(
+                    services, '_build_period_series', wraps=services._build_period_series
+                ) as build:
+                    streamed = self.run_line_simulation(granularity='day', stream=True, **kwargs)
+                    self.assertNotIsInstance(streamed['data_points'], list)
+                    self.assertEqual(self.materialize(streamed), built)
+                self.assertEqual(build.called, 'max_points' in kwargs)
+
+    def test_category_stream_matches_built_series(self):
+        category = SimulationCategory.objects.create(name='Dough', product_types='Dough')
+        category.lines.set(self.data['lines'])
+        kwargs = dict(
+            simulation_category_id=category.id, shift_configs=self.shift_configs, start_date=FIRST_WEEK,
+            end_date=self.last_week + timedelta(days=6), granularity='day'
+        )
+        services.clear_caches()
+        built = services.run_category_simulation(**kwargs)
+        services.clear_caches()
+        with mock.patch.object(services, '_build_period_series') as build:
+            streamed = services.run_category_simulation(stream=True, **kwargs)
+            self.assertEqual(self.materialize(streamed), built)
+        build.assert_not_called()
+
+
+def forward_build_ahead_shortfall(demand, capacity, max_stock_weeks=None, shelf_life_weeks=None):
+    """
+    Reference for build-ahead: walk forward, stock all the slack (as lots of
+    the week it was produced, up to the stock cap) and serve each excess from
+    the oldest lots still within shelf life. Returns the total demand left unmet.
+    """
+    lots = []
+    shortfall = Decimal('0')
+    for week, (week_demand, week_capacity) in enumerate(zip(demand, capacity)):
+        if shelf_life_weeks is not None:
+            lots = [lot for lot in lots if week - lot[0] <= shelf_life_weeks]
+        excess = week_demand - week_capacity
+        while excess > 0 and lots:
+            served = min(excess, lots[0][1])
+            excess -= served
+            lots[0][1] -= served
+            if not lots[0][1]:
+                lots.pop(0)
+        if excess > 0:
+            shortfall += excess
+        elif excess < 0:
+            lots.append([week, -excess])
+        if max_stock_weeks is not None:
+            # Stock beyond the cap should not have been built: drop the newest
+            surplus = sum(lot[1] for lot in lots) - sum(demand[week + 1:week + 1 + max_stock_weeks])
+            while surplus > 0:
+                dropped = min(surplus, lots[-1][1])
+                surplus -= dropped
+                lots[-1][1] -= dropped
+                if not lots[-1][1]:
+                    lots.pop()
+    return shortfall
+
+
+class BuildAheadTests(SimulationDataMixin, TransactionTestCase):
+    """Build-ahead plans against the plain weekly simulation and a forward reference"""
+
+    def test_plan_matches_weekly_simulation(self):
+        line = self.data['lines'][0]
+        kwargs = {'line_ids': [line.id], 'shift_configs': self.shift_configs[:1]}
+        plain = self.run_line_simulation(**kwargs)
+        demand = [point['demand'] for point in plain['data_points']]
+        capacity = [point['capacity'] for point in plain['data_points']]
+        # The fixture line has slack in its first weeks and is over capacity after
+        self.assertTrue(demand[0] < capacity[0] and demand[-1] > capacity[-1])
+
+        for max_stock_weeks, shelf_life_weeks in ((None, None), (None, 1), (2, None), (1, None), (0, 0)):
+            with self.subTest(max_stock_weeks=max_stock_weeks, shelf_life_weeks=shelf_life_weeks):
+                result = self.run_line_simulation(
+                    build_ahead=True, max_stock_weeks=max_stock_weeks, shelf_life_weeks=shelf_life_weeks, **kwargs
+                )
+                plan = result.pop('build_ahead')
+                self.assertEqual(result, plain)
+                self.assertEqual(
+                    plan['total_shortfall'],
+                    forward_build_ahead_shortfall(demand, capacity, max_stock_weeks, shelf_life_weeks)
+                )
+
+                stock = Decimal('0')
+                for week, point in enumerate(plan['data_points']):
+                    self.assertLessEqual(point['production'], capacity[week])
+                    stock += point['production'] - (demand[week] - point['shortfall'])
+                    self.assertEqual(point['inventory'], stock)
+                    if max_stock_weeks is not None:
+                        self.assertLessEqual(stock, sum(demand[week + 1:week + 1 + max_stock_weeks]))
+                self.assertEqual(plan['total_built_ahead'], sum(point['built_ahead'] for point in plan['data_points']))
+
+    def test_shelf_life_and_stock_cap(self):
+        demand = [Decimal(value) for value in (0, 5, 0, 25, 25)]
+        capacity = [Decimal(value) for value in (15, 10, 10, 10, 10)]
+        cases = ((None, None, 0), (None, 1, 20), (None, 2, 15), (None, 3, 0), (1, None, 20), (2, None, 10))
+        for max_stock_weeks, shelf_life_weeks, shortfall in cases:
+            with self.subTest(max_stock_weeks=max_stock_weeks, shelf_life_weeks=shelf_life_weeks):
+                plan = smooth_build_ahead(demand, capacity, max_stock_weeks, shelf_life_weeks)
+                self.assertEqual(sum(plan['shortfall']), shortfall)
+                self.assertEqual(
+                    sum(plan['shortfall']),
+                    forward_build_ahead_shortfall(demand, capacity, max_stock_weeks, shelf_life_weeks)
+                )
+
+
+class CapacityGapTests(SimulationDataMixin, TransactionTestCase):
+    """Capacity gap solver against line simulations run on the configurations it picks"""
+
+    def weekly_points(self, line_id, shift_config_id):
+        result = self.run_line_simulation(
+            line_ids=[line_id], shift_configs=[{'line_id': line_id, 'shift_config_id': shift_config_id}]
+        )
+        return result['data_points']
+
+    def test_gap_matches_line_simulations(self):
+        for name, hours_per_shift, shifts_per_day in (('2x10', '10', 2), ('3x8', '8', 3)):
+            ShiftConfiguration.objects.create(
+                name=name, shifts_per_day=shifts_per_day, hours_per_shift=Decimal(hours_per_shift), days_per_week=5
+            )
+
+        for target in (Decimal('100'), Decimal('90')):
+            services.clear_caches()
+            gap = services.run_capacity_gap(
+                FIRST_WEEK, self.last_week + timedelta(days=6), shift_configs=self.shift_configs,
+                target_utilization=target
+            )
+            configs = gap['configs']
+            self.assertEqual([config['weekly_hours'] for config in configs], [80, 100, 120])
+            for row in gap['lines']:
+                with self.subTest(target=target, line=row['line_code']):
+                    rate = row['units_per_hour']
+                    points = {
+                        config['id']: self.weekly_points(row['line_id'], config['id']) for config in configs
+                    }
+                    current = points[self.data['config'].id]
+                    self.assertTrue(any(row['extra_hours']))
+                    for week, point in enumerate(current):
+                        self.assertAlmostEqual(row['current_hours'][week] * rate, float(point['capacity']), delta=0.5)
+                        self.assertAlmostEqual(
+                            row['required_hours'][week] * rate * float(target) / 100, float(point['demand']), delta=0.5
+                        )
+                        config_index = row['config_index'][week]
+                        if not row['extra_hours'][week]:
+                            self.assertIsNone(config_index)
+                            self.assertLessEqual(point['demand'] * 100, point['capacity'] * target)
+                            continue
+                        self.assertGreater(point['demand'] * 100, point['capacity'] * target)
+                        if config_index is None:
+                            self.assertGreater(row['required_hours'][week], configs[-1]['weekly_hours'])
+                            continue
+                        # The picked configuration keeps the week under target, the next smaller one doesn't
+                        picked = points[configs[config_index]['id']][week]
+                        self.assertLessEqual(picked['demand'] * 100, picked['capacity'] * target)
+                        smaller = points[configs[config_index - 1]['id']][week]
+                        self.assertGreater(smaller['demand'] * 100, smaller['capacity'] * target)
+
+
+class SensitivitySweepTests(SimulationDataMixin, TransactionTestCase):
+    """Efficiency/cadence sweep against line simulations of lines edited to each grid point"""
+
+    STATS = ('average_utilization', 'peak_utilization', 'over_capacity_periods')
+
+    def assert_stats_match(self, sweep_stats, simulation):
+        self.assertEqual(sweep_stats['over_capacity_periods'], simulation['over_capacity_periods'])
+        for name in ('average_utilization', 'peak_utilization'):
+            self.assertAlmostEqual(sweep_stats[name], float(simulation[name]), delta=0.11)
+
+    def test_sweep_matches_edited_lines(self):
+        efficiency_multipliers = [0.8, 1, 1.2]
+        cadence_multipliers = [0.9, 1, 1.25]
+        services.clear_caches()
+        sweep = services.run_sensitivity_sweep(
+            FIRST_WEEK, self.last_week + timedelta(days=6), shift_configs=self.shift_configs,
+            efficiency_multipliers=efficiency_multipliers, cadence_multipliers=cadence_multipliers
+        )
+        self.assertEqual(sweep['week_count'], WEEK_COUNT)
+        self.assert_stats_match(sweep['total']['current'], self.run_line_simulation())
+        total_grid = {name: sweep['total'][name][1][1] for name in self.STATS}
+        self.assertEqual(total_grid, sweep['total']['current'])
+
+        for row, shift_config in zip(sweep['lines'], self.shift_configs):
+            # 0.85 x 1.2 is capped at an efficiency of 1
+            self.assertEqual(row['efficiency_factors'], [0.68, 0.85, 1.0])
+            line = ProductionLine.objects.get(pk=row['line_id'])
+            for efficiency_index, cadence_index in ((0, 0), (1, 1), (2, 2), (2, 0), (0, 2)):
+                with self.subTest(line=line.code, efficiency=efficiency_index, cadence=cadence_index):
+                    line.efficiency_factor = Decimal(str(row['efficiency_factors'][efficiency_index]))
+                    line.base_capacity_per_hour = Decimal(str(row['capacity_per_hour'][cadence_index]))
+                    line.save()
+                    simulation = self.run_line_simulation(line_ids=[line.id], shift_configs=[shift_config])
+                    self.assert_stats_match(
+                        {name: row[name][efficiency_index][cadence_index] for name in self.STATS}, simulation
+                    )
+
+
+class HeatmapTests(SimulationDataMixin, TransactionTestCase):
+    """Line heatmap rows against one line simulation per line"""
+
+    SUMMARY = ('total_demand', 'total_capacity', 'average_utilization', 'peak_utilization', 'over_capacity_periods')
+    COLUMNS = ('demand', 'capacity', 'utilization_percent', 'over_capacity')
+
+    def test_rows_match_line_simulations(self):
+        for granularity in ('week', 'day'):
+            services.clear_caches()
+            heatmap = services.run_line_heatmap(
+                FIRST_WEEK, self.last_week + timedelta(days=6), line_ids=self.line_ids,
+                shift_configs=self.shift_configs, granularity=granularity
+            )
+            self.assertEqual([row['line_id'] for row in heatmap['lines']], self.line_ids)
+            for position, (row, shift_config) in enumerate(zip(heatmap['lines'], self.shift_configs)):
+                with self.subTest(granularity=granularity, line=row['line_code']):
+                    simulation = self.run_line_simulation(
+                        line_ids=[row['line_id']], shift_configs=[shift_config], granularity=granularity,
+                        response_format='columnar'
+                    )
+                    self.assertEqual({name: row[name] for name in self.SUMMARY},
+                                     {name: simulation[name] for name in self.SUMMARY})
+                    self.assertEqual(heatmap['periods'], simulation['columns']['date'])
+                    for name in self.COLUMNS:
+                        self.assertEqual(heatmap[name][position], simulation['columns'][name])
+            self.assertTrue(heatmap['overloaded_lines'])
+
+
+class ClientImpactRankingTests(SimulationDataMixin, TransactionTestCase):
+    """Client ranking against one simulation per client"""
+
+    STATS = ('average_utilization', 'peak_utilization', 'over_capacity_periods')
+
+    def rank(self, change_percent):
+        services.clear_caches()
+        return services.run_client_impact_ranking(
+            self.line_ids, self.shift_configs, FIRST_WEEK, self.last_week + timedelta(days=6),
+            change_percent=change_percent, top_n=len(self.data['clients'])
+        )
+
+    def assert_stats_match(self, entry, simulation):
+        self.assertEqual(entry['over_capacity_periods'], simulation['over_capacity_periods'])
+        for name in ('average_utilization', 'peak_utilization'):
+            self.assertAlmostEqual(entry[name], float(simulation[name]), delta=0.11)
+
+    def test_lost_clients_match_lost_client_simulations(self):
+        ranking = self.rank(-100)
+        self.assertEqual(
+            {entry['client_id'] for entry in ranking['clients']}, {client.id for client in self.data['clients']}
+        )
+        self.assert_stats_match(ranking['baseline'], self.run_line_simulation())
+        for entry in ranking['clients']:
+            with self.subTest(client=entry['client_code']):
+                services.clear_caches()
+                simulation = services.run_lost_client_simulation(
+                    self.line_ids, self.shift_configs, FIRST_WEEK, self.last_week + timedelta(days=6),
+                    lost_client_id=entry['client_id']
+                )
+                self.assert_stats_match(entry, simulation)
+                self.assertAlmostEqual(
+                    entry['total_demand'], simulation['overlay_data']['total_lost_demand'], places=2
+                )
+                for name in self.STATS:
+                    self.assertAlmostEqual(
+                        entry[f'{name}_change'], entry[name] - ranking['baseline'][name], delta=0.11
+                    )
+
+    def test_growth_matches_demand_modifications(self):
+        ranking = self.rank(50)
+        for entry in ranking['clients']:
+            with self.subTest(client=entry['client_code']):
+                simulation = self.run_line_simulation(demand_modifications=[{
+                    'client_id': entry['client_id'], 'start_date': FIRST_WEEK,
+                    'end_date': self.last_week + timedelta(days=6), 'percentage': Decimal('50'),
+                }])
+                self.assert_stats_match(entry, simulation)
+                self.assertEqual(
+                    entry['utilization_percent'],
+                    [float(point['utilization_percent']) for point in simulation['data_points']]
+                )
+
+    def test_ties_go_to_the_next_metrics_then_client_order(self):
+        # Clients 0 and 3 are identical; 2 ties with them on over-capacity weeks only
+        client_demand = np.array([[10.0, 0.0], [0.0, 10.0], [5.0, 0.0], [10.0, 0.0]])
+        capacity = [20.0, 20.0]
+        for rank_by, order in (
+            ('over_capacity_periods', [0, 3, 2, 1]),
+            ('average_utilization', [0, 3, 1, 2]),
+            ('peak_utilization', [0, 3, 2, 1]),
+        ):
+            with self.subTest(rank_by=rank_by):
+                ranking = rank_client_impacts(client_demand, capacity, -100, rank_by)
+                self.assertEqual(ranking['rows'].tolist(), order)
+        self.assertEqual(rank_client_impacts(client_demand, capacity, -100, top_n=2)['rows'].tolist(), [0, 3])
+
+
+class NewClientMixTests(SimulationDataMixin, TransactionTestCase):
+    """New client product mixes against forecast totals and hand-computed splits"""
+
+    def simulate(self, line_ids=None, **kwargs):
+        services.clear_caches()
+        line_ids = line_ids or self.line_ids
+        return services.run_new_client_simulation(
+            line_ids, [config for config in self.shift_configs if config['line_id'] in line_ids],
+            FIRST_WEEK, self.last_week + timedelta(days=6), **kwargs
+        )
+
+    def test_profile_copies_the_client_forecasts(self):
+        client = self.data['clients'][1]
+        result = self.simulate(profile_client_id=client.id, profile_scale=Decimal('1.5'))
+        by_line = forecast_totals('product__default_line', client=client)
+        by_week = forecast_totals('week_start_date', client=client)
+        self.assertEqual(
+            {row['line_id']: row['added_demand'] for row in result['lines']},
+            {line_id: round(float(total * Decimal('1.5')), 2) for line_id, total in by_line.items()}
+        )
+        self.assertEqual(
+            [point['new_client_demand'] for point in result['data_points']],
+            [by_week[FIRST_WEEK + timedelta(weeks=week)] * Decimal('1.5') for week in range(WEEK_COUNT)]
+        )
+        self.assertEqual(result['overlay_data']['new_client_mix']['profile_client_name'], client.name)
+
+        # Copying the client at 1.5x is the client's demand grown by 150%
+        for row in result['lines']:
+            with self.subTest(line=row['line_code']):
+                shift_configs = [config for config in self.shift_configs if config['line_id'] == row['line_id']]
+                before = self.run_line_simulation(line_ids=[row['line_id']], shift_configs=shift_configs)
+                after = self.run_line_simulation(
+                    line_ids=[row['line_id']], shift_configs=shift_configs, demand_modifications=[{
+                        'client_id': client.id, 'start_date': FIRST_WEEK,
+                        'end_date': self.last_week + timedelta(days=6), 'percentage': Decimal('150'),
+                    }]
+                )
+                for name, simulation in (('average_utilization_before', before), ('average_utilization', after)):
+                    self.assertAlmostEqual(row[name], float(simulation['average_utilization']), delta=0.11)
+                self.assertEqual(row['over_capacity_periods'], after['over_capacity_periods'])
+
+    def test_shares_are_split_over_products_and_lines(self):
+        line_1, line_2 = self.data['lines']
+        # Crust: P0 (line 1) and P3 (line 2), half a share each; P1 is made on line 2
+        shares = [
+            {'attribute': 'product_type', 'value': 'Crust', 'share': 1},
+            {'product_code': 'p1', 'share': 2},
+        ]
+        result = self.simulate(new_client_demand=Decimal('1000'), product_shares=shares)
+        added = {row['line_id']: row['added_demand'] for row in result['lines']}
+        # 1000 x 0.5/3 and 1000 x 2.5/3, quantized per line and week
+        self.assertEqual(added, {line_1.id: 166.67 * WEEK_COUNT, line_2.id: 833.33 * WEEK_COUNT})
+        self.assertEqual(
+            {point['new_client_demand'] for point in result['data_points']}, {Decimal('1000.00')}
+        )
+        mix = result['overlay_data']['new_client_mix']
+        self.assertEqual(
+            [(share['label'], share['routed_percent']) for share in mix['shares']],
+            [('product_type=Crust', 100.0), ('p1', 100.0)]
+        )
+        self.assertEqual(mix['unrouted_percent'], 0.0)
+
+        # Only line 1 selected: P3 and P1 are made elsewhere
+        result = self.simulate(line_ids=[line_1.id], new_client_demand=Decimal('1000'), product_shares=shares)
+        self.assertEqual(
+            {point['new_client_demand'] for point in result['data_points']}, {Decimal('166.67')}
+        )
+        mix = result['overlay_data']['new_client_mix']
+        self.assertEqual([share['routed_percent'] for share in mix['shares']], [50.0, 0.0])
+        self.assertEqual(mix['unrouted_percent'], 83.3)
+
+    def test_invalid_shares(self):
+        for shares, error in (
+            ([{'product_code': 'PX', 'share': 1}], 'Product PX not found'),
+            ([{'attribute': 'product_type', 'value': 'Cake', 'share': 1}], 'No active products with product_type=Cake'),
+            ([{'share': 1}], 'Each product share needs a product_code or an attribute and value'),
+        ):
+            with self.subTest(error=error):
+                self.assertEqual(
+                    self.simulate(new_client_demand=Decimal('1000'), product_shares=shares), {'error': error}
+                )
+        missing_id = Client.objects.order_by('-id').first().id + 1
+        self.assertEqual(
+            self.simulate(profile_client_id=missing_id), {'error': f'Profile client {missing_id} not found'}
+        )
+
+
+class DemandStateTests(SimulationDataMixin, TransactionTestCase):
+    """Result tokens of line simulations (keep_state / base_token)"""
+
+    def test_state_is_only_kept_on_request(self):
+        with mock.patch.object(services, '_save_demand_state', wraps=services._save_demand_state) as save:
+            result = services.run_line_simulation(
+                line_ids=self.line_ids, shift_configs=self.shift_configs,
+                start_date=FIRST_WEEK, end_date=self.last_week
+            )
+        self.assertNotIn('result_token', result)
+        save.assert_not_called()
+
+    def test_base_token_matches_full_modifications(self):
+        clients = self.data['clients']
+        modifications = [
+            {'client_id': clients[0].id, 'percentage': Decimal('-50'),
+             'start_date': FIRST_WEEK, 'end_date': FIRST_WEEK + timedelta(weeks=3)},
+            {'client_id': clients[2].id, 'product_id': self.data['products'][1].id, 'percentage': Decimal('80'),
+             'start_date': FIRST_WEEK + timedelta(weeks=2), 'end_date': self.last_week},
+        ]
+        for granularity in ('week', 'day'):
+            with self.subTest(granularity):
+                services.clear_caches()
+                first = services.run_line_simulation(
+                    line_ids=self.line_ids, shift_configs=self.shift_configs, granularity=granularity,
+                    start_date=FIRST_WEEK, end_date=self.last_week + timedelta(days=6),
+                    demand_modifications=modifications[:1], keep_state=True
+                )
+                with mock.patch.object(services, 'get_demand_for_lines') as weekly_demand, \
+                        mock.patch.object(services, 'get_demand_for_lines_daily') as daily_demand:
+                    resumed = self.run_line_simulation(
+                        granularity=granularity, demand_modifications=modifications[1:],
+                        base_token=first['result_token']
+                    )
+                weekly_demand.assert_not_called()
+                daily_demand.assert_not_called()
+                self.assertEqual(
+                    resumed, self.run_line_simulation(granularity=granularity, demand_modifications=modifications)
+                )
+
+                stale = self.run_line_simulation(
+                    granularity=granularity, line_ids=self.line_ids[:1], base_token=first['result_token']
+                )
+                self.assertTrue(stale['stale_base_token'])
+
+
+class BulkDataChangesTests(SimulationDataMixin, TransactionTestCase):
+    """Membership and version handlers suspended for imports"""
+
+    def test_membership_and_versions_are_refreshed_once(self):
+        line_1, line_2 = self.data['lines']
+        category = SimulationCategory.objects.create(name='Dough', product_types='Dough')
+        category.lines.set([line_1])
+        versions = DataVersion.get_versions(['product', 'productionline'])
+
+        with bulk_data_changes():
+            with CaptureQueriesContext(connection) as queries:
+                for number in range(6, 16):
+                    Product.objects.create(
+                        code=f'P{number}', name=f'Product {number}', default_line=line_1, product_type='Dough'
+                    )
+            # One INSERT per product, no membership or version writes
+            self.assertEqual(len(queries), 10)
+            ProductionLine.objects.filter(pk=line_2.pk).update(name='Renamed')
+            self.assertEqual(DataVersion.get_versions(['product', 'productionline']), versions)
+
+        self.assertEqual(
+            set(SimulationCategoryProduct.objects.filter(category=category).values_list('product_id', flat=True)),
+            set(category.compute_matching_products().values_list('id', flat=True))
+        )
+        self.assertEqual(
+            DataVersion.get_versions(['product', 'productionline']),
+            {name: version + 1 for name, version in versions.items()}
+        )
+
+        # Handlers are back once the block is left
+        product = Product.objects.create(code='P99', name='Product 99', default_line=line_1, product_type='Dough')
+        self.assertTrue(SimulationCategoryProduct.objects.filter(category=category, product=product).exists())
+        self.assertEqual(DataVersion.get_versions(['product'])['product'], versions['product'] + 2)
+
+    def test_products_are_fast_deleted(self):
+        DemandForecast.objects.all().delete()
+        Product.objects.bulk_create([Product(code=f'P{number}', name=f'Product {number}') for number in range(6, 40)])
+        with bulk_data_changes():
+            with CaptureQueriesContext(connection) as queries:
+                Product.objects.all().delete()
+        self.assertFalse(Product.objects.exists())
+        # A few queries per related table, none per product (signals and version bumps)
+        self.assertLess(len(queries), 20)
+
+
+class ArchiveTests(SimulationDataMixin, TransactionTestCase):
+    """Past weeks written again after they were archived"""
+
+    def test_reimported_past_weeks_replace_their_archived_copy(self):
+        expected = self.run_line_simulation()
+        archive_forecasts(FIRST_WEEK + timedelta(weeks=3))
+        self.assertEqual(self.run_line_simulation(), expected)
+
+        # An import writes week 1 again, with new quantities and one row less
+        week_start = FIRST_WEEK + timedelta(weeks=1)
+        reimported = [
+            DemandForecast(
+                client=forecast.client, product=forecast.product, year=forecast.year,
+                week_number=forecast.week_number, week_start_date=week_start,
+                forecast_quantity=forecast.forecast_quantity * 2
+            )
+            for forecast in ArchivedDemandForecast.objects.filter(week_start_date=week_start)[1:]
+        ]
+        DemandForecast.objects.bulk_create(reimported)
+        DataVersion.bump('demandforecast')
+
+        self.assertEqual(archive_live_past_weeks(), len(reimported))
+        self.assertFalse(DemandForecast.objects.filter(week_start_date__lte=week_start).exists())
+        point = self.run_line_simulation()['data_points'][1]
+        self.assertEqual(point['week_start'], week_start)
+        self.assertEqual(point['demand'], sum(forecast.forecast_quantity for forecast in reimported))
+        self.assertEqual(archive_live_past_weeks(), 0)
+
+    def test_api_rejects_archived_weeks(self):
+        archive_forecasts(FIRST_WEEK + timedelta(weeks=3))
+        forecast = {
+            'client': self.data['clients'][0].id, 'product': self.data['products'][0].id,
+            'year': 2026, 'forecast_quantity': '10.00',
+        }
+        for week, status_code in ((2, 400), (WEEK_COUNT, 201)):
+            week_start = FIRST_WEEK + timedelta(weeks=week)
+            response = self.client.post('/api/forecasts/', dict(
+                forecast, week_number=week_start.isocalendar()[1], week_start_date=week_start.isoformat()
+            ), content_type='application/json')
+            self.assertEqual(response.status_code, status_code)
+
+
+class AsyncSimulationViewTests(SimulationDataMixin, TransactionTestCase):
+    """Async variants of the simulate endpoints"""
+
+    def request_bodies(self):
+        dates = {
+            'start_date': FIRST_WEEK.isoformat(),
+            'end_date': (FIRST_WEEK + timedelta(weeks=WEEK_COUNT - 1)).isoformat(),
+        }
+        lines = dict(dates, line_ids=self.line_ids, shift_configs=self.shift_configs)
+        return [
+            ('line', lines),
+            ('line', dict(lines, format='columnar', max_points=4)),
+            ('line', dict(lines, granularity='day', stream=True, overlay_client_codes=['C1'])),
+            ('new-client', dict(lines, new_client_demand=500)),
+            ('lost-client', dict(lines, lost_client_id=self.data['clients'][0].id)),
+            ('client-impact', lines),
+            ('heatmap', dates),
+            ('capacity-gap', dates),
+            ('sensitivity', dict(dates, efficiency_multipliers=[0.9, 1.1])),
+            ('line', {}),
+        ]
+
+    async def post(self, client, url, body):
+        response = await client.post(url, body, content_type='application/json')
+        if response.streaming:
+            if response.is_async:
+                content = b''.join([chunk async for chunk in response.streaming_content])
+            else:
+                # Like the ASGI handler, iterate sync content off the event loop
+                content = await sync_to_async(b''.join)(response.streaming_content)
+        else:
+            content = response.content
+        data = json.loads(content)
+        data.pop('result_token', None)
+        return response.status_code, data
+
+    def test_async_views_match_sync_views(self):
+        async def post_both(endpoint, body):
+            client = AsyncClient()
+            return (
+                await self.post(client, f'/api/simulate/{endpoint}/', body),
+                await self.post(client, f'/api/simulate/{endpoint}/async/', body),
+            )
+
+        for endpoint, body in self.request_bodies() + [('line', 'not json')]:
+            with self.subTest(endpoint=endpoint, body=body):
+                payload = body if isinstance(body, str) else json.dumps(body)
+                sync_response, async_response = async_to_sync(post_both)(endpoint, payload)
+                self.assertEqual(async_response, sync_response)
+
+    def test_async_simulations_of_concurrent_requests_run_in_parallel(self):
+        # Each simulation waits for the other one: this only completes when
+        # they run at the same time, not one after the other in one thread
+        barrier = threading.Barrier(2, timeout=10)
+        run_line_simulation = views.run_line_simulation
+
+        def run_after_barrier(**kwargs):
+            barrier.wait()
+            return run_line_simulation(**kwargs)
+
+        body = json.dumps(self.request_bodies()[0][1])
+
+        async def post_concurrently():
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                self.post(client, '/api/simulate/line/async/', body) for _ in range(2)
+            ))
+
+        with mock.patch.object(views, 'run_line_simulation', run_after_barrier):
+            responses = async_to_sync(post_concurrently)()
+        self.assertEqual([status_code for status_code, _ in responses], [200, 200])
+        self.assertEqual(responses[0], responses[1])
@@ -16,6 +16,7 @@ router.register(r'products', views.ProductViewSet)
 router.register(r'line-assignments', views.LineProductAssignmentViewSet)
 router.register(r'forecasts', views.DemandForecastViewSet)
 router.register(r'line-overrides', views.LineConfigOverrideViewSet)
+router.register(r'forecast-versions', views.ForecastVersionViewSet)
 
 # Simulation Category and Custom Shift Config API Router
 router.register(r'simulation-categories', views.SimulationCategoryViewSet)
@@ -39,6 +40,22 @@ urlpatterns = [
     path('api/simulate/category/', views.simulate_category, name='api_simulate_category'),
     path('api/simulate/new-client/', views.simulate_new_client, name='api_simulate_new_client'),
     path('api/simulate/lost-client/', views.simulate_lost_client, name='api_simulate_lost_client'),
+    path('api/simulate/client-impact/', views.simulate_client_impact, name='api_simulate_client_impact'),
+    path('api/simulate/heatmap/', views.simulate_line_heatmap, name='api_simulate_line_heatmap'),
+    path('api/simulate/capacity-gap/', views.simulate_capacity_gap, name='api_simulate_capacity_gap'),
+    path('api/simulate/sensitivity/', views.simulate_sensitivity, name='api_simulate_sensitivity'),
+    
+    # Async variants of the simulation API (ASGI)
+    path('api/simulate/line/async/', views.simulate_line_async, name='api_simulate_line_async'),
+    path('api/simulate/category/async/', views.simulate_category_async, name='api_simulate_category_async'),
+    path('api/simulate/new-client/async/', views.simulate_new_client_async, name='api_simulate_new_client_async'),
+    path('api/simulate/lost-client/async/', views.simulate_lost_client_async, name='api_simulate_lost_client_async'),
+    path('api/simulate/client-impact/async/', views.simulate_client_impact_async,
+         name='api_simulate_client_impact_async'),
+    path('api/simulate/heatmap/async/', views.simulate_line_heatmap_async, name='api_simulate_line_heatmap_async'),
+    path('api/simulate/capacity-gap/async/', views.simulate_capacity_gap_async,
+         name='api_simulate_capacity_gap_async'),
+    path('api/simulate/sensitivity/async/', views.simulate_sensitivity_async, name='api_simulate_sensitivity_async'),
     
     # Line configuration API
     path('api/lines/<int:pk>/update-config/', views.update_line_config, name='api_update_line_config'),
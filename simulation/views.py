@@ -3,7 +3,14 @@ Views for Cerelia Simulation
 Includes both API viewsets and template views
 """
 
+import hashlib
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import connections
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
@@ -11,24 +18,32 @@ from rest_framework.response import Response
 from .models import (
     Site, ShiftConfiguration, ProductionLine,
     Client, Product, LineProductAssignment, DemandForecast, LineConfigOverride,
-    SimulationCategory, CustomShiftConfiguration
+    SimulationCategory, CustomShiftConfiguration, ForecastVersion, DataVersion
 )
 from .serializers import (
     SiteSerializer, ShiftConfigurationSerializer,
     ProductionLineSerializer, ClientSerializer, ProductSerializer,
     LineProductAssignmentSerializer, DemandForecastSerializer,
-    LineSimulationRequestSerializer,
+    LineSimulationRequestSerializer, LineHeatmapRequestSerializer, CapacityGapRequestSerializer,
+    SensitivitySweepRequestSerializer,
     NewClientSimulationRequestSerializer, LostClientSimulationRequestSerializer,
+    ClientImpactRequestSerializer,
     LineConfigOverrideSerializer,
     SimulationCategorySerializer, CustomShiftConfigurationSerializer,
-    CategorySimulationRequestSerializer
+    CategorySimulationRequestSerializer,
+    ForecastVersionSerializer, ForecastVersionDiffRequestSerializer
 )
 from .services import (
-    run_line_simulation,
-    run_new_client_simulation, run_lost_client_simulation,
+    run_line_simulation, run_line_heatmap, run_capacity_gap, run_sensitivity_sweep,
+    run_new_client_simulation, run_lost_client_simulation, run_client_impact_ranking,
     clear_caches,
-    run_category_simulation
+    run_category_simulation,
+    diff_forecast_versions
 )
+from .streaming import streaming_json_response, as_async_streaming
+from .demand_store import demand_store_status
+from .facets import FACET_FIELDS, FACET_VERSION_MODELS, get_product_facets
+from .forecast_versions import create_forecast_version, forget_forecast_snapshot
 
 
 # =============================================================================
@@ -64,28 +79,87 @@ def shift_management_view(request):
     return render(request, 'simulation/shift_management.html')
 
 
+# =============================================================================
+# Conditional GET (ETags) for reference data
+# =============================================================================
+
+def data_version_etag(request, model_names):
+    """
+    Build an ETag from the DataVersion of the given tables.
+    The request path and Accept header are included so that pages, filters and
+    renderers of the same endpoint never share a tag; the date is included
+    because some serializers filter on today (e.g. upcoming line overrides).
+    """
+    versions = DataVersion.get_versions(model_names)
+    key = '|'.join(
+        [f'{name}:{version}' for name, version in sorted(versions.items())]
+        + [date.today().isoformat(), request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+    )
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def conditional_get(request, model_names, build_response):
+    """
+    Answer If-None-Match with 304 before build_response (queries + serializers) runs.
+    Fresh responses carry the ETag and must be revalidated by the client.
+    """
+    etag = data_version_etag(request, model_names)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    response = build_response()
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+class DataVersionETagMixin:
+    """
+    ETag support for list/retrieve of rarely changing reference data.
+    etag_models lists every table the serialized output depends on.
+    """
+    etag_models = ()
+    
+    def list(self, request, *args, **kwargs):
+        return conditional_get(
+            request, self.etag_models,
+            lambda: super(DataVersionETagMixin, self).list(request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_get(
+            request, self.etag_models,
+            lambda: super(DataVersionETagMixin, self).retrieve(request, *args, **kwargs)
+        )
+
+
 # =============================================================================
 # API ViewSets
 # =============================================================================
 
-class SiteViewSet(viewsets.ModelViewSet):
+class SiteViewSet(DataVersionETagMixin, viewsets.ModelViewSet):
     queryset = Site.objects.all()
     serializer_class = SiteSerializer
     search_fields = ['name', 'code']
+    etag_models = ['site']
 
 
-class ShiftConfigurationViewSet(viewsets.ModelViewSet):
+class ShiftConfigurationViewSet(DataVersionETagMixin, viewsets.ModelViewSet):
     queryset = ShiftConfiguration.objects.all()
     serializer_class = ShiftConfigurationSerializer
+    etag_models = ['shiftconfiguration']
 
 
-class ProductionLineViewSet(viewsets.ModelViewSet):
+class ProductionLineViewSet(DataVersionETagMixin, viewsets.ModelViewSet):
     queryset = ProductionLine.objects.filter(is_active=True).select_related(
         'site', 'default_shift_config'
     ).prefetch_related('config_overrides')
     serializer_class = ProductionLineSerializer
     filterset_fields = ['site', 'is_active']
     search_fields = ['name', 'code']
+    etag_models = ['productionline', 'site', 'shiftconfiguration', 'lineconfigoverride']
     
     @action(detail=False, methods=['get'])
     def by_site(self, request):
@@ -135,6 +209,16 @@ class DemandForecastViewSet(viewsets.ModelViewSet):
     serializer_class = DemandForecastSerializer
     filterset_fields = ['client', 'product', 'year', 'week_number']
     
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        # Forecast deletes send no signal (see signals.py)
+        DataVersion.bump('demandforecast')
+    
+    @action(detail=False, methods=['get'], url_path='store-status')
+    def store_status(self, request):
+        """Whether simulations read the compiled demand store or fall back to the ORM"""
+        return Response(demand_store_status())
+    
     @action(detail=False, methods=['get'])
     def by_date_range(self, request):
         """Get forecasts within a date range"""
@@ -222,22 +306,9 @@ class LineConfigOverrideViewSet(viewsets.ModelViewSet):
 # Simulation API Endpoints
 # =============================================================================
 
-@api_view(['POST'])
-def simulate_line(request):
-    """
-    Line Simulation API (Dashboard 1)
-    Analyze demand vs capacity for selected production lines
-    """
-    # Clear caches at the start of each request for fresh data
-    clear_caches()
-    
-    serializer = LineSimulationRequestSerializer(data=request.data)
-    if not serializer.is_valid():
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-    data = serializer.validated_data
-    
-    result = run_line_simulation(
+def _line_simulation_kwargs(data: dict) -> dict:
+    """run_line_simulation arguments from a validated LineSimulationRequestSerializer"""
+    return dict(
         line_ids=data['line_ids'],
         shift_configs=data['shift_configs'],
         start_date=data['start_date'],
@@ -248,12 +319,71 @@ def simulate_line(request):
         product_codes=data.get('product_codes'),
         overlay_client_codes=data.get('overlay_client_codes', []),
         granularity=data.get('granularity', 'week'),
-        demand_modifications=data.get('demand_modifications')
+        demand_modifications=data.get('demand_modifications'),
+        stream=data.get('stream', False),
+        response_format=data.get('format', 'rows'),
+        max_points=data.get('max_points'),
+        bucket=data.get('bucket', 'minmax'),
+        base_token=data.get('base_token'),
+        keep_state=data.get('keep_state', False),
+        forecast_version_id=data.get('forecast_version_id'),
+        build_ahead=data.get('build_ahead', False),
+        max_stock_weeks=data.get('max_stock_weeks'),
+        shelf_life_weeks=data.get('shelf_life_weeks')
+    )
+
+
+def _category_simulation_kwargs(data: dict) -> dict:
+    """run_category_simulation arguments from a validated CategorySimulationRequestSerializer"""
+    return dict(
+        simulation_category_id=data['simulation_category_id'],
+        shift_configs=data['shift_configs'],
+        start_date=data['start_date'],
+        end_date=data['end_date'],
+        client_codes=data.get('client_codes'),
+        product_code=data.get('product_code'),
+        product_codes=data.get('product_codes'),
+        overlay_client_codes=data.get('overlay_client_codes', []),
+        granularity=data.get('granularity', 'week'),
+        demand_modifications=data.get('demand_modifications'),
+        stream=data.get('stream', False),
+        response_format=data.get('format', 'rows'),
+        max_points=data.get('max_points'),
+        bucket=data.get('bucket', 'minmax'),
+        forecast_version_id=data.get('forecast_version_id'),
+        breakdown=data.get('breakdown', False)
     )
+
+
+def _simulate_line(request, concurrent_loads: bool = False):
+    """Validate and run a line simulation request (simulate_line and its async variant)"""
+    # Clear caches at the start of each request for fresh data
+    clear_caches()
     
+    serializer = LineSimulationRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    result = run_line_simulation(**_line_simulation_kwargs(data), concurrent_loads=concurrent_loads)
+    
+    if result.get('stale_base_token'):
+        return Response(result, status=status.HTTP_409_CONFLICT)
+    if data.get('stream'):
+        return streaming_json_response(result)
     return Response(result)
 
 
+@api_view(['POST'])
+def simulate_line(request):
+    """
+    Line Simulation API (Dashboard 1)
+    Analyze demand vs capacity for selected production lines
+    """
+    return _simulate_line(request)
+
+
 @api_view(['POST'])
 def simulate_new_client(request):
     """
@@ -274,8 +404,11 @@ def simulate_new_client(request):
         shift_configs=data['shift_configs'],
         start_date=data['start_date'],
         end_date=data['end_date'],
-        new_client_demand=data['new_client_demand'],
-        remove_client_id=data.get('remove_client_id')
+        new_client_demand=data.get('new_client_demand', 0),
+        remove_client_id=data.get('remove_client_id'),
+        profile_client_id=data.get('profile_client_id'),
+        profile_scale=data.get('profile_scale', 1),
+        product_shares=data.get('product_shares')
     )
     
     return Response(result)
@@ -307,6 +440,118 @@ def simulate_lost_client(request):
     return Response(result)
 
 
+@api_view(['POST'])
+def simulate_client_impact(request):
+    """
+    Client Impact API
+    Rank all clients by how much losing them (or their growth) changes utilization
+    """
+    clear_caches()
+    
+    serializer = ClientImpactRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    result = run_client_impact_ranking(
+        line_ids=data['line_ids'],
+        shift_configs=data.get('shift_configs', []),
+        start_date=data['start_date'],
+        end_date=data['end_date'],
+        change_percent=data.get('change_percent', -100),
+        rank_by=data.get('rank_by', 'over_capacity_periods'),
+        top_n=data.get('top_n', 10),
+        forecast_version_id=data.get('forecast_version_id')
+    )
+    
+    return Response(result)
+
+
+@api_view(['POST'])
+def simulate_line_heatmap(request):
+    """
+    Line Heatmap API
+    Demand, capacity and utilization of every active line (or one site's) per period
+    """
+    clear_caches()
+    
+    serializer = LineHeatmapRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    result = run_line_heatmap(
+        start_date=data['start_date'],
+        end_date=data['end_date'],
+        site_id=data.get('site_id'),
+        line_ids=data.get('line_ids'),
+        shift_configs=data.get('shift_configs', []),
+        granularity=data.get('granularity', 'week'),
+        forecast_version_id=data.get('forecast_version_id')
+    )
+    
+    return Response(result)
+
+
+@api_view(['POST'])
+def simulate_capacity_gap(request):
+    """
+    Capacity Gap API
+    Extra hours per line and week to stay under a target utilization, and the
+    smallest shift configuration covering them
+    """
+    clear_caches()
+    
+    serializer = CapacityGapRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    result = run_capacity_gap(
+        start_date=data['start_date'],
+        end_date=data['end_date'],
+        site_id=data.get('site_id'),
+        line_ids=data.get('line_ids'),
+        shift_configs=data.get('shift_configs', []),
+        target_utilization=data.get('target_utilization', 100),
+        forecast_version_id=data.get('forecast_version_id')
+    )
+    
+    return Response(result)
+
+
+@api_view(['POST'])
+def simulate_sensitivity(request):
+    """
+    Sensitivity Sweep API
+    Utilization surfaces per line over a grid of efficiency and cadence
+    multipliers, without editing the lines (see update_line_config)
+    """
+    clear_caches()
+    
+    serializer = SensitivitySweepRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    data = serializer.validated_data
+    
+    result = run_sensitivity_sweep(
+        start_date=data['start_date'],
+        end_date=data['end_date'],
+        site_id=data.get('site_id'),
+        line_ids=data.get('line_ids'),
+        shift_configs=data.get('shift_configs', []),
+        efficiency_multipliers=data.get('efficiency_multipliers'),
+        cadence_multipliers=data.get('cadence_multipliers'),
+        forecast_version_id=data.get('forecast_version_id')
+    )
+    
+    return Response(result)
+
+
 @api_view(['POST', 'PATCH'])
 def update_line_config(request, pk):
     """
@@ -372,36 +617,98 @@ class SimulationCategoryViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def product_attributes(self, request):
-        """Get distinct product attribute values for filtering"""
-        products = Product.objects.filter(is_active=True)
-        return Response({
-            'product_types': list(products.exclude(product_type='').values_list('product_type', flat=True).distinct().order_by('product_type')),
-            'recipe_types': list(products.exclude(recipe_type='').values_list('recipe_type', flat=True).distinct().order_by('recipe_type')),
-            'material_types': list(products.exclude(material_type='').values_list('material_type', flat=True).distinct().order_by('material_type')),
-            'packaging_types': list(products.exclude(packaging_type='').values_list('packaging_type', flat=True).distinct().order_by('packaging_type')),
-        })
+        """
+        Get distinct product attribute values for filtering, with counts.
+        Optional query params: site_id, line_ids (comma-separated) to scope the
+        products, and product_types / recipe_types / material_types /
+        packaging_types (comma-separated) for cross-filtered counts.
+        """
+        params = request.query_params
+        try:
+            site_id = int(params['site_id']) if params.get('site_id') else None
+            line_ids = [int(i) for i in params['line_ids'].split(',') if i.strip()] if params.get('line_ids') else None
+        except ValueError:
+            return Response({'error': 'site_id and line_ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        selected = {
+            name: [v.strip() for v in params.get(f'{name}s', '').split(',') if v.strip()]
+            for name in FACET_FIELDS
+        }
+        
+        return conditional_get(
+            request, FACET_VERSION_MODELS,
+            lambda: Response(get_product_facets(site_id=site_id, line_ids=line_ids, selected=selected))
+        )
 
 
 # =============================================================================
 # Custom Shift Configuration API ViewSet
 # =============================================================================
 
-class CustomShiftConfigurationViewSet(viewsets.ModelViewSet):
+class CustomShiftConfigurationViewSet(DataVersionETagMixin, viewsets.ModelViewSet):
     queryset = CustomShiftConfiguration.objects.all()
     serializer_class = CustomShiftConfigurationSerializer
     search_fields = ['name', 'description']
+    etag_models = ['customshiftconfiguration']
 
 
 # =============================================================================
-# Category Simulation API Endpoint
+# Forecast Version API ViewSet
 # =============================================================================
 
-@api_view(['POST'])
-def simulate_category(request):
+class ForecastVersionViewSet(viewsets.ModelViewSet):
     """
-    Category-based Simulation API (new workflow)
-    Uses simulation categories to filter lines and products
+    Saved forecast versions. Creating one snapshots the current forecasts;
+    simulations take a forecast_version_id to run against a version.
     """
+    queryset = ForecastVersion.objects.defer('snapshot')
+    serializer_class = ForecastVersionSerializer
+    search_fields = ['name', 'description']
+    
+    def perform_create(self, serializer):
+        serializer.instance = create_forecast_version(
+            serializer.validated_data['name'],
+            serializer.validated_data.get('description', '')
+        )
+    
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        forget_forecast_snapshot(instance.id)
+    
+    @action(detail=True, methods=['post'])
+    def diff(self, request, pk=None):
+        """
+        Week-by-week demand deltas from this version to compare_version_id,
+        optionally scoped to lines, a simulation category, clients or products
+        """
+        clear_caches()
+        
+        serializer = ForecastVersionDiffRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = serializer.validated_data
+        result = diff_forecast_versions(
+            base_version_id=int(pk),
+            compare_version_id=data['compare_version_id'],
+            start_date=data['start_date'],
+            end_date=data['end_date'],
+            line_ids=data.get('line_ids'),
+            simulation_category_id=data.get('simulation_category_id'),
+            client_codes=data.get('client_codes'),
+            product_codes=data.get('product_codes')
+        )
+        
+        if 'error' in result:
+            return Response(result, status=status.HTTP_404_NOT_FOUND)
+        return Response(result)
+
+
+# =============================================================================
+# Category Simulation API Endpoint
+# =============================================================================
+
+def _simulate_category(request, concurrent_loads: bool = False):
+    """Validate and run a category simulation request (simulate_category and its async variant)"""
     clear_caches()
     
     serializer = CategorySimulationRequestSerializer(data=request.data)
@@ -410,18 +717,76 @@ def simulate_category(request):
     
     data = serializer.validated_data
     
-    result = run_category_simulation(
-        simulation_category_id=data['simulation_category_id'],
-        shift_configs=data['shift_configs'],
-        start_date=data['start_date'],
-        end_date=data['end_date'],
-        client_codes=data.get('client_codes'),
-        product_code=data.get('product_code'),
-        product_codes=data.get('product_codes'),
-        overlay_client_codes=data.get('overlay_client_codes', []),
-        granularity=data.get('granularity', 'week'),
-        demand_modifications=data.get('demand_modifications')
-    )
+    result = run_category_simulation(**_category_simulation_kwargs(data), concurrent_loads=concurrent_loads)
     
+    if data.get('stream'):
+        return streaming_json_response(result)
     return Response(result)
 
+
+@api_view(['POST'])
+def simulate_category(request):
+    """
+    Category-based Simulation API (new workflow)
+    Uses simulation categories to filter lines and products
+    """
+    return _simulate_category(request)
+
+
+# =============================================================================
+# Async Simulation API Endpoints (ASGI)
+# =============================================================================
+
+def _async_view(view):
+    """
+    Async variant of a DRF simulation view for ASGI deployments: same parsing,
+    validation, errors and responses. The view runs on a worker thread of its
+    own rather than the shared sync thread, so simulations of concurrent
+    requests run in parallel (the service caches are request-local, see
+    services.clear_caches). Streamed responses are consumed asynchronously.
+    """
+    def run(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            # Worker threads outlive the request, their connections must not
+            connections.close_all()
+    
+    run_in_worker = sync_to_async(run, thread_sensitive=False)
+    
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        response = await run_in_worker(request, *args, **kwargs)
+        if response.streaming and not response.is_async:
+            as_async_streaming(response)
+        return response
+    return async_view
+
+
+@_async_view
+@api_view(['POST'])
+def simulate_line_async(request):
+    """
+    Line Simulation API, async variant.
+    Same request and response as simulate_line; data loads run concurrently.
+    """
+    return _simulate_line(request, concurrent_loads=True)
+
+
+@_async_view
+@api_view(['POST'])
+def simulate_category_async(request):
+    """
+    Category Simulation API, async variant.
+    Same request and response as simulate_category; data loads run concurrently.
+    """
+    return _simulate_category(request, concurrent_loads=True)
+
+
+# Same request and response as their sync views
+simulate_new_client_async = _async_view(simulate_new_client)
+simulate_lost_client_async = _async_view(simulate_lost_client)
+simulate_client_impact_async = _async_view(simulate_client_impact)
+simulate_line_heatmap_async = _async_view(simulate_line_heatmap)
+simulate_capacity_gap_async = _async_view(simulate_capacity_gap)
+simulate_sensitivity_async = _async_view(simulate_sensitivity)